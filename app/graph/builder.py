@@ -3,13 +3,17 @@
 from langgraph.graph import StateGraph, END
 from langgraph.prebuilt import ToolNode
 from langchain_core.messages import AIMessage
+from typing import Optional
 
 from .nodes.agent import complexModelNode, codingModelNode, fastModelNode
 # from .nodes.triage import triage_node
-from .router import router_node
+from .router import QueryRouter, make_router_node
 from .tools.search import searxng_search
 from .state import ChatGraphState
 
+# Nodes that generate the answer, their token chunks are streamed to the client
+AGENT_NODES = ("fast_model", "complex_model", "coding_model")
+
 def should_continue(state: ChatGraphState):
   last_message = state["messages"][-1]
 
@@ -30,11 +34,12 @@ def route_logic(state: ChatGraphState):
     return state["model_info"]["name"]
   return END
 
-def build_graph(checkpointer):
+def build_graph(checkpointer, query_router: Optional[QueryRouter] = None):
   tool_node = ToolNode([searxng_search])
 
   workflow = StateGraph(ChatGraphState)
-  workflow.add_node("router", router_node)
+  # The router node keeps the node LLMChat routed to (query_router), it only routes graphs run without one
+  workflow.add_node("router", make_router_node(query_router))
   workflow.add_node("complex_model", complexModelNode)
   workflow.add_node("coding_model", codingModelNode)
   workflow.add_node("fast_model", fastModelNode)
@@ -49,7 +54,7 @@ def build_graph(checkpointer):
 
   # Edge 2: Model -> Tools (or END)
   # We apply this logic to ALL three models
-  for node_name in ["fast_model", "complex_model", "coding_model"]:
+  for node_name in AGENT_NODES:
     workflow.add_conditional_edges(node_name, should_continue, {"tools": "tools", END: END})
 
   # Edge 3: Tools -> Back to Agent
@@ -1,47 +1,98 @@
+import asyncio
+from typing import Any, Optional
+
+from langchain_core.messages import AIMessageChunk
+from langchain_core.runnables import RunnableConfig
 from langchain_core.tools import BaseTool
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_ollama import ChatOllama
-from transformers import AutoTokenizer
 
 from ..state import ChatGraphState
 from ..tools.search import searxng_search
 from ..prompts import agent_prompt_template
+from app.utils.hedging import HEDGING, HedgedChatModel, can_hedge_on
+from app.utils.model_registry import model_registry
+from app.utils.model_residency import model_residency
+from app.utils.model_router import MODEL_CATALOG, node_for_model
+from app.utils.token_counter import trim_messages
+
+def make_agent_node(model: str, tools: list[BaseTool], sysPrompt: ChatPromptTemplate, max_context_tokens: int, **params: Any):
+	# The client (shared through the registry) is only created when the node first runs
+	prompt = None
+	chat_model = None
+	hedge_model: Optional[str] = None
+
+	async def agent_node(state: ChatGraphState, config: RunnableConfig):
+		nonlocal prompt, chat_model, hedge_model
+		if chat_model is None:
+			prompt = sysPrompt
+			if "tools" in prompt.input_variables:
+				prompt = prompt.partial(tools="\n".join(f"- {tool.name}: {tool.description}" for tool in tools))
+			client = model_registry.chat_model(model, **params)
+
+			# A request slow to produce its first token is hedged on the fallback model of the catalog,
+			# unless the fallback is heavier (slower) than this model
+			catalog_node = node_for_model(model)
+			fallback_model = MODEL_CATALOG[catalog_node]["fallback_model"] if catalog_node else None
+			if HEDGING and fallback_model and can_hedge_on(model, fallback_model):
+				hedge_model = fallback_model
+				client = HedgedChatModel(
+					primary=client,
+					fallback=model_registry.chat_model(fallback_model, **params),
+					primary_name=model,
+					fallback_name=fallback_model
+				)
+			chat_model = client.bind_tools(tools)
 
-def make_agent_node(model: ChatOllama, tools: list[BaseTool], sysPrompt: ChatPromptTemplate):
-	model_with_tools = model.bind_tools(tools)
-	agent = sysPrompt | model_with_tools
+		# While the residency manager runs, each request tells Ollama how long to keep the model loaded
+		# based on the recent traffic of the model
+		agent = prompt | chat_model
+		if model_residency.started:
+			model_residency.record_request(model)
+			keep_alive: dict[str, Any] = {"keep_alive": model_residency.keep_alive(model)}
+			if hedge_model:
+				keep_alive["fallback_keep_alive"] = model_residency.keep_alive(hedge_model)
+			agent = prompt | chat_model.bind(**keep_alive)
 
-	# check if the messages fit within the model's context length
-	# model.get_num_tokens(input_prompt)
+		# check if the messages fit within the model's context length, the oldest messages are dropped first
+		# (off the event loop, counting can load a tokenizer)
+		messages = await asyncio.to_thread(trim_messages, state["messages"], max_context_tokens, model)
 
-	tokenizer = AutoTokenizer.from_pretrained(model.model)
-	len(tokenizer.encode())
+		# Streamed so every chunk reaches the "messages" stream mode of the graph as soon as the model produces it,
+		# the chunks are merged back into one message (tool call chunks included) for the state
+		response: Optional[AIMessageChunk] = None
+		async for chunk in agent.astream({"messages": messages}, config=config):
+			response = chunk if response is None else response + chunk
 
-	def agent_node(state: ChatGraphState):
-		return {"messages": [agent.invoke({"messages": state["messages"]})]}
+		return {"messages": [response] if response is not None else []}
 
 	return agent_node
 
 # Fast Model
 # 256k, text + image, vision + tools
 fastModelNode = make_agent_node(
-	ChatOllama(model="qwen3-vl:2b", temperature=0),
+	"qwen3-vl:2b",
 	[searxng_search],
-	agent_prompt_template
+	agent_prompt_template,
+	max_context_tokens=256_000,
+	temperature=0
 )
 
 # Complex Model
 # 256k, text + image, vision + tools
 complexModelNode = make_agent_node(
-	ChatOllama(model="qwen3-vl:4b", temperature=0),
+	"qwen3-vl:4b",
 	[searxng_search],
-	agent_prompt_template
+	agent_prompt_template,
+	max_context_tokens=256_000,
+	temperature=0
 )
 
 # Coding Model
 # 32k, text, tools
 codingModelNode = make_agent_node(
-	ChatOllama(model="qwen2.5-coder:0.5b", temperature=0),
+	"qwen2.5-coder:0.5b",
 	[searxng_search],
-	agent_prompt_template
+	agent_prompt_template,
+	max_context_tokens=32_000,
+	temperature=0
 )
\ No newline at end of file
@@ -13,7 +13,7 @@ triage_prompt = ChatPromptTemplate.from_messages([
 agent_prompt_template = ChatPromptTemplate.from_messages([
   ("system",
     "You are a helpful AI assistant. You have access to the following tools:\n\n"
-    "{tools}\n\n" # The .bind_tools() method will populate this.
+    "{tools}\n\n" # make_agent_node fills this with the names and descriptions of the bound tools
     "You must use the tools when you need current information. "
     "However, you must follow these critical rules:\n"
     "1. After calling a tool, you MUST analyze the result. \n"
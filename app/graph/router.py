@@ -1,39 +1,156 @@
+import os
+import asyncio
+import logging
+import numpy as np
 from langchain_core.messages import SystemMessage, HumanMessage
-from langchain_ollama import ChatOllama
 from pydantic import BaseModel, Field
-from .state import GraphState
-from typing import Literal, cast
+from .state import ChatGraphState, ModelRoutingDecision, QueryAnalysis
+from typing import Any, Literal, Optional, cast, get_args
+
+from app.utils.embedding_service import EmbeddingService
+from app.utils.model_registry import model_registry
+from app.utils.model_router import ModelRouter, node_for_model
+from app.utils.route_classifier import ROUTE_CLASSIFIER_PATH, RouteClassifier
+from app.utils.route_decision_cache import RouteDecisionCache
+
+logger = logging.getLogger(__name__)
+
+# "llm" asks gemma3:1b (below), "classifier" uses the trained RouteClassifier (falls back to "llm" without a model file)
+ROUTER_MODE = os.getenv("ROUTER_MODE", "llm")
+# Latency budget of the classifier / LLM router before falling back to the embedding ModelRouter
+ROUTER_TIMEOUT_MS = float(os.getenv("ROUTER_TIMEOUT_MS", 300))
 
 class RouteQuery(BaseModel):
 	"""Route the user query to the most relevant model."""
 	destination_llm: Literal["complex_model", "fast_model", "coding_model"] = Field(description="The model to use based on query complexity.")
 
+ROUTE_NODES = get_args(RouteQuery.model_fields["destination_llm"].annotation)
+
+ROUTER_SYSTEM_PROMPT = "You are a router. Analyze the query. If it requires heavy reasoning or math, choose 'complex_model'. If it is code, choose 'coding_model'. Otherwise for simple chats use 'fast_model'."
+
 # Right now we are using a smaller cheap model for dynamic routing to more specialized LLM.
-# I will add XGBoost for classification and routing
-# Runnable[LanguageModelInput, dict | BaseModel]
-router_llm = ChatOllama(model="gemma3:1b", temperature=0)
-structured_router = router_llm.with_structured_output(RouteQuery)
-
-def router_node(state: GraphState) -> dict[str, object]:
-	# If the model was selected by the user then simply return it, we dont have to route it 
-	if state["model_info"]:
-		return {"model_info": state["model_info"]}
-	
-	last_message = state["messages"][-1]
-
-	# Right now the llm is only used for generating text so str should be enough and simpler
-	# but later if we are generating images or videos or audio then the dict[str, object] will be needed
-	cleaned_content = cast(str | list[str | dict[str, object]], last_message.content)
+ROUTER_LLM = "gemma3:1b"
+
+# Runnable[LanguageModelInput, dict | BaseModel], built on first use
+_structured_router = None
+
+def get_structured_router():
+	global _structured_router
+	if _structured_router is None:
+		_structured_router = model_registry.chat_model(ROUTER_LLM, temperature=0).with_structured_output(RouteQuery)
+	return _structured_router
 
+# Loaded once, when the first router node is built in classifier mode
+_route_classifier: Optional[RouteClassifier] = None
+_route_classifier_failed = False
+
+def get_route_classifier(embedding_service: Optional[EmbeddingService] = None) -> Optional[RouteClassifier]:
+	"""The classifier embeds with `embedding_service` (the router's, so the model is loaded once) when given"""
+	global _route_classifier, _route_classifier_failed
+	if _route_classifier is None and not _route_classifier_failed:
+		try:
+			_route_classifier = RouteClassifier.load(ROUTE_CLASSIFIER_PATH, embedding_service)
+		except (OSError, ValueError, KeyError) as e:
+			_route_classifier_failed = True
+			logger.warning(f"Route classifier unavailable ({e}), using the LLM router")
+	return _route_classifier
+
+def _message_text(content: str | list[str | dict[str, object]]) -> str:
+	if isinstance(content, str):
+		return content
+	return " ".join(part if isinstance(part, str) else str(part.get("text", "")) for part in content)
+
+def llm_route(content: str | list[str | dict[str, object]]) -> str:
+	"""The destination node chosen by the LLM router"""
 	# We were first using tuples which only works if the content is a string
 	# In HumanMessage and SystemMessage we can pass objects (which may be images, videos, audio, etc.)
-	result = structured_router.invoke([
-		SystemMessage(content="You are a router. Analyze the query. If it requires heavy reasoning or math, choose 'complex_model'. If it is code, choose 'coding_model'. Otherwise for simple chats use 'fast_model'."),
-		HumanMessage(content=cleaned_content)
+	result = get_structured_router().invoke([
+		SystemMessage(content=ROUTER_SYSTEM_PROMPT),
+		HumanMessage(content=content)
 	])
 
 	# BasedPyright doesn't know that the result is a RouteQuery so we need to cast it
-	result = cast(RouteQuery, result)
-	print("------------------ROUTER RESULT------------------------\n", result)
-	print("------------------ROUTER RESULT END------------------------")
-	return {"model_info": {"name": result.destination_llm}}
\ No newline at end of file
+	return cast(RouteQuery, result).destination_llm
+
+async def allm_route(content: str | list[str | dict[str, object]]) -> str:
+	"""Async llm_route, the request is cancelled when the caller gives up on it"""
+	result = await get_structured_router().ainvoke([
+		SystemMessage(content=ROUTER_SYSTEM_PROMPT),
+		HumanMessage(content=content)
+	])
+	return cast(RouteQuery, result).destination_llm
+
+class QueryRouter:
+	"""
+	Routes a query once, before the graph runs, so the model LLMChat announces, admits and caches for is the
+	one that generates: decision cache -> classifier or LLM (within ROUTER_TIMEOUT_MS) -> the embedding
+	ModelRouter when the router is too slow or fails. The ModelRouter's rules apply to every decision
+	(a loaded model over a cold one that scores as close, a vision model for images and video, the model
+	pinned by the client).
+	"""
+
+	def __init__(self, model_router: ModelRouter, decision_cache: Optional[RouteDecisionCache] = None):
+		self.model_router = model_router
+		self.decision_cache = decision_cache
+		self.classifier = get_route_classifier(model_router.embedding_service) if ROUTER_MODE == "classifier" else None
+		# Cached decisions are the router's own, they only depend on the query and on which router made them
+		self.mode = "classifier" if self.classifier is not None else "llm"
+
+	async def route(
+		self,
+		content: str | list[str | dict[str, object]],
+		query_analysis: Optional[QueryAnalysis] = None,
+		user_preferences: Optional[Any] = None
+	) -> ModelRoutingDecision:
+		text = _message_text(content)
+		# Embedded once, for the ModelRouter and the classifier (which shares its embedding service)
+		query_embedding = (await self.model_router.embedding_service.encode([text]))[0]
+		decision = self.model_router.route_embedding(query_embedding, query_analysis, user_preferences)
+
+		# A pinned model needs no router
+		if self.model_router.pinned_node(user_preferences):
+			return decision
+
+		destination = await self.decision_cache.get(text, self.mode) if self.decision_cache is not None else None
+		if destination not in ROUTE_NODES:
+			try:
+				destination = await asyncio.wait_for(self._primary_route(content, text, query_embedding), timeout=ROUTER_TIMEOUT_MS / 1000)
+			except asyncio.TimeoutError:
+				logger.warning(f"Router took longer than {ROUTER_TIMEOUT_MS:.0f}ms, using the embedding router")
+				return decision
+			except Exception as e:
+				logger.warning(f"Router failed ({e}), using the embedding router")
+				return decision
+
+			# Only the primary router decisions are cached, a fallback should not stick for the whole TTL
+			if self.decision_cache is not None:
+				await self.decision_cache.set(text, self.mode, destination)
+
+		# The residency of the models is applied on every decision, cached ones included
+		return self.model_router.route_node(destination, f"{self.mode} router: {destination}", query_embedding, query_analysis, user_preferences)
+
+	async def _primary_route(self, content: str | list[str | dict[str, object]], text: str, query_embedding: np.ndarray) -> str:
+		if self.classifier is not None:
+			return self.classifier.predict_embeddings([text], np.atleast_2d(query_embedding))[0][0]
+		return await allm_route(content)
+
+def make_router_node(query_router: Optional[QueryRouter] = None):
+	"""
+	The router node. LLMChat routes with the QueryRouter before the graph runs and passes the node in
+	`model_info`, the node only routes when the graph is run without one.
+	"""
+
+	async def router_node(state: ChatGraphState) -> dict[str, object]:
+		if state.get("model_info"):
+			return {"model_info": state["model_info"]}
+
+		# Right now the llm is only used for generating text so str should be enough and simpler
+		# but later if we are generating images or videos or audio then the dict[str, object] will be needed
+		cleaned_content = cast(str | list[str | dict[str, object]], state["messages"][-1].content)
+		if query_router is None:
+			return {"model_info": {"name": await allm_route(cleaned_content)}}
+
+		decision = await query_router.route(cleaned_content)
+		return {"model_info": {"name": node_for_model(decision["primary_model"]["name"]) or "fast_model"}}
+
+	return router_node
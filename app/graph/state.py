@@ -9,6 +9,7 @@ from typing import TypedDict, Optional, Literal, Any
 from langchain_core.tools import BaseTool
 from typing_extensions import Annotated
 from langchain_core.messages import BaseMessage
+from langgraph.graph.message import add_messages
 import operator
 from datetime import datetime
 
@@ -119,10 +120,14 @@ class ChatGraphState(TypedDict):
     # ---- Model Selection ----
     routing_decision: Optional[ModelRoutingDecision]
     selected_model: Optional[ModelInfo]
+    model_info: Optional[dict[str, Any]]  # {"name": graph node}, set by the router node
     
     # ---- Context Assembly ----
     # This is what actually goes to the LLM
     llm_messages: Annotated[list[BaseMessage], operator.add]
+
+    # Conversation the agent nodes run on (history + this turn + tool calls/results)
+    messages: Annotated[list[BaseMessage], add_messages]
     
     # Track token usage to avoid overflow
     current_token_count: int
@@ -153,6 +158,9 @@ class ChatGraphState(TypedDict):
     errors: list[str]
     warnings: list[str]
 
+    # ---- Observability ----
+    metrics: "ExecutionMetrics"
+
 # ============================================================
 # INGESTION GRAPH STATE (ASYNC - STORAGE ONLY)
 # ============================================================
@@ -328,6 +336,7 @@ class ExecutionMetrics(TypedDict):
     # Latency breakdown
     routing_time_ms: Optional[int]
     retrieval_time_ms: Optional[int]
+    retrieval_stage_ms: dict[str, float]  # embed / search / post_process
     llm_inference_time_ms: Optional[int]
     total_time_ms: Optional[int]
     
@@ -39,13 +39,14 @@ compact vdisk
 """
 
 import os
+import re
 import sys
 import time
 from datetime import datetime
 from dotenv import load_dotenv
-from typing import Awaitable, Optional, Union, cast
+from typing import Any, Awaitable, Optional, Union, cast
 from google.protobuf.internal.containers import RepeatedCompositeFieldContainer
-from langchain_core.messages import BaseMessage
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage, RemoveMessage
 from langchain_core.runnables import history
 from langgraph.graph.state import CompiledStateGraph, RunnableConfig
 import grpc
@@ -54,18 +55,33 @@ import uuid
 from concurrent import futures
 import grpc.aio
 import asyncio
+from langgraph.graph.message import REMOVE_ALL_MESSAGES
 from langgraph.types import StateSnapshot
 from qdrant_client import AsyncQdrantClient
 from typing_extensions import AsyncIterator
 
 from protos import llm_service_pb2, llm_service_pb2_grpc
-from .graph.builder import build_graph
+from .graph.builder import AGENT_NODES, build_graph
+from .graph.router import ROUTER_LLM, QueryRouter
 from .utils.db.DBRegistry import DBRegistry
-from app.graph.state import ChatGraphState, FileReference, ModelRoutingDecision, QueryAnalysis, RetrievedChunk
+from .utils.db.chatMessageStore import ChatMessageStore
+from app.graph.state import ChatGraphState, ExecutionMetrics, FileReference, ModelRoutingDecision, QueryAnalysis, RetrievedChunk
 from app.graph.tools.search import searxng_search
+from app.utils.admission import Admission, AdmissionController, AdmissionRejected, parse_priority
 from app.utils.conv_ctx_manager import ConversationContextManager
-from app.utils.file_manager import FileManager
-from app.utils.model_router import ModelRouter
+from app.utils.embedding_service import EmbeddingService
+from app.utils.embeddings import RETRIEVAL_EMBEDDING_MODEL, CachedEmbedder
+from app.utils.file_manager import TERMINAL_FILE_STATUSES, FileManager
+from app.utils.file_status_watcher import FileStatusWatcher
+from app.utils.model_registry import model_registry
+from app.utils.model_residency import model_residency
+from app.utils.providers import close_clients, provider_for
+from app.utils.model_router import MODEL_CATALOG, ROUTER_EMBEDDING_MODEL, ModelRouter, node_for_model
+from app.utils.route_decision_cache import RouteDecisionCache
+from app.utils.response_stream import ResponseStream
+from app.utils.semantic_cache import SemanticResponseCache, cache_scope
+from app.utils.single_flight import REQUEST_COALESCING, SingleFlight, coalesce_key
+from app.utils.token_counter import message_text
 if not load_dotenv():
 	raise Exception("Failed to load .env file")
 
@@ -75,6 +91,9 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# How long (seconds) LLMChat keeps streaming file status updates before it moves on
+FILE_STATUS_WATCH_TIMEOUT = float(os.getenv("FILE_STATUS_WATCH_TIMEOUT", 120))
+
 class LLMServiceClass(llm_service_pb2_grpc.LLMServiceServicer):
 	"""
 	Main gRPC servicer for LLM chat
@@ -89,17 +108,25 @@ class LLMServiceClass(llm_service_pb2_grpc.LLMServiceServicer):
 	def __init__(
 		self,
 		chat_graph: CompiledStateGraph,
-		model_router: ModelRouter,
+		query_router: QueryRouter,
 		file_manager: FileManager,
 		context_manager: ConversationContextManager,
-		qdrant_client: AsyncQdrantClient
+		qdrant_client: AsyncQdrantClient,
+		file_status_watcher: Optional[FileStatusWatcher] = None,
+		response_cache: Optional[SemanticResponseCache] = None,
+		admission: Optional[AdmissionController] = None,
+		single_flight: Optional[SingleFlight] = None
 	) -> None:
 		super().__init__()
 		self.chat_graph = chat_graph
-		self.model_router = model_router
+		self.query_router = query_router
 		self.file_manager = file_manager
 		self.context_manager = context_manager
 		self.qdrant_client = qdrant_client
+		self.file_status_watcher = file_status_watcher
+		self.response_cache = response_cache
+		self.admission = admission
+		self.single_flight = single_flight
 
 		logger.info("LLMServiceClass initialized")
 
@@ -140,31 +167,41 @@ class LLMServiceClass(llm_service_pb2_grpc.LLMServiceServicer):
 		logger.info(f"[{request_id}] Attached files: {len(file_refs)}")
 
 		# Check file processing status
-		files_ready = True
-		for file_ref in file_refs:
-			status = await self.file_manager.get_file_status(file_ref["file_id"])
-
-			if status["status"] != "ready":
-				files_ready = False
-
-				# Send file status update
+		file_statuses = await self.file_manager.get_file_statuses([ref["file_id"] for ref in file_refs])
+		pending_file_ids = [
+			file_id for file_id, status in file_statuses.items()
+			if status.get("status") not in TERMINAL_FILE_STATUSES
+		]
+
+		if pending_file_ids and self.file_status_watcher and self._wants_file_status_stream(context):
+			# Forward every status change until the files are ready/failed so the client doesn't have to poll
+			async for status in self.file_status_watcher.watch(pending_file_ids, timeout=FILE_STATUS_WATCH_TIMEOUT):
+				file_statuses[status["file_id"]] = status
 				yield llm_service_pb2.LLMResponse(
 					request_id=request_id,
 					sequence=next_sequence(),
-					file_status=llm_service_pb2.FileProcessingStatus(
-						file_id=file_ref["file_id"],
-						filename=status.get("filename", "unknown"),
-						status=self._map_file_status(status=status["status"]),
-						progress_percent=status.get("progress", 0.0),
-						message=status.get("message", "")
-					)
+					file_status=self._to_file_status_proto(status["file_id"], status)
 				)
+		else:
+			for file_id, status in file_statuses.items():
+				if status.get("status") != "ready":
+					# Send file status update
+					yield llm_service_pb2.LLMResponse(
+						request_id=request_id,
+						sequence=next_sequence(),
+						file_status=self._to_file_status_proto(file_id, status)
+					)
+
+		for file_ref in file_refs:
+			status = file_statuses[file_ref["file_id"]]
+			file_ref["status"] = status.get("status", "pending")
+			file_ref["processing_progress"] = status.get("progress", 0.0)
 
 		# Analyze query to route models
-		query_analysis = await self._analyze_query(user_text, file_refs)
+		query_analysis = self._analyze_query(user_text, file_refs)
 
-		# Route to appropriate model
-		routing_decision = self.model_router.route(query_analysis=query_analysis, user_preferences=request.model_prefs if request.HasField("model_prefs") else None)
+		# Route to appropriate model, once: the graph runs the announced model (model_info in the initial state)
+		routing_decision = await self.query_router.route(user_text, query_analysis=query_analysis, user_preferences=request.model_prefs if request.HasField("model_prefs") else None)
 
 		# Send Model selection event
 		yield llm_service_pb2.LLMResponse(
@@ -177,6 +214,65 @@ class LLMServiceClass(llm_service_pb2_grpc.LLMServiceServicer):
 			)
 		)
 
+		context_options = request.context_options if request.HasField("context_options") else None
+
+		conversation_history: list[BaseMessage] = await self.context_manager.load_history(
+			user_id=user_id,
+			session_id=session_id,
+			max_tokens=context_options.max_history_tokens if context_options else 4000,
+			model=routing_decision["primary_model"]["name"]
+		)
+
+		# Near-identical questions are answered from the semantic cache, without retrieval or generation.
+		# Only questions without history: "continue" or "summarize what I said" depend on the conversation.
+		# Clients opt out per request (ContextOptions.disable_response_cache, older clients don't send it)
+		use_response_cache = (
+			self.response_cache is not None
+			and not conversation_history
+			and not getattr(context_options, "disable_response_cache", False)
+		)
+		response_scope = cache_scope(
+			model=routing_decision["primary_model"]["name"],
+			user_id=user_id,
+			file_ids=[ref["file_id"] for ref in file_refs],
+			used_retrieval=bool(context_options and context_options.enable_retrieval)
+		)
+
+		if use_response_cache:
+			assert self.response_cache is not None
+			try:
+				cached_answer = await self.response_cache.lookup(user_text, response_scope)
+			except Exception as e:
+				logger.warning(f"[{request_id}] Response cache lookup failed: {e}")
+				cached_answer = None
+
+			if cached_answer is not None:
+				logger.info(f"[{request_id}] Answered from the response cache (hit rate {self.response_cache.stats()['hit_rate']:.2%})")
+				async def cached_chunks() -> AsyncIterator[str]:
+					for chunk in re.findall(r"\s*\S+", cached_answer):
+						yield chunk
+
+				async for text in ResponseStream(cached_chunks()):
+					yield llm_service_pb2.LLMResponse(
+						request_id=request_id,
+						sequence=next_sequence(),
+						token=llm_service_pb2.TextToken(text=cast(str, text))
+					)
+
+				await self.context_manager.append_history(
+					user_id=user_id,
+					session_id=session_id,
+					messages=[HumanMessage(content=user_text), AIMessage(content=cached_answer)],
+					model=routing_decision["primary_model"]["name"]
+				)
+
+				yield llm_service_pb2.LLMResponse(
+					request_id=request_id,
+					sequence=next_sequence(),
+					end=llm_service_pb2.StreamEnd(timestamp=str(int(time.time())))
+				)
+				return
+
 		initial_state = await self._build_initial_state(
 			request_id=request_id,
 			session_id=session_id,
@@ -184,7 +280,8 @@ class LLMServiceClass(llm_service_pb2_grpc.LLMServiceServicer):
 			user_text=user_text,
 			file_refs=file_refs,
 			routing_decision=routing_decision,
-			context_options=request.context_options if request.HasField("context_options") else None
+			context_options=context_options,
+			conversation_history=conversation_history
 		)
 
 		# TODO: Logic for selecting a model (the current router is slow since it uses LLM to select the model)
@@ -219,110 +316,203 @@ class LLMServiceClass(llm_service_pb2_grpc.LLMServiceServicer):
 		full_assistant_response = ""
 		model_usage_map: dict[str, dict] = {}
 		stream_reason = llm_service_pb2.COMPLETED
+		graph_errors = False
 
-		try:
+		# The same question without personal history (same model and retrieved chunks) asked while its answer
+		# is being generated joins that generation instead of running its own
+		coalesce: Optional[str] = None
+		if self.single_flight is not None and not conversation_history and not file_refs:
+			coalesce = coalesce_key(routing_decision["primary_model"]["name"], user_text, initial_state["retrieved_context"])
+
+		async def graph_responses() -> AsyncIterator[Union[str, llm_service_pb2.LLMResponse]]:
+			"""Graph events as responses (sequence and request_id are set on output), answer text as plain str"""
 			# With astream, I can define my own events as compared to astrem_events which sends only the
 			# LangChain internal events
-			async for event in self.chat_graph.astream(initial_state, config=config):
-				if "response_chunks" in event and event["response_chunks"]:
-					for chunk in event["response_chunks"]:
-						full_assistant_response += chunk
+			# "messages" delivers the token chunks of the agent nodes as they are generated, "updates" the
+			# state changes of every node (citations, artifacts, tool calls, errors, ...)
+			async for mode, payload in self.chat_graph.astream(initial_state, config=config, stream_mode=["messages", "updates"]):
+				if mode == "messages":
+					chunk, chunk_metadata = payload
+					# The router LLM streams through here too, only answer tokens go to the client
+					if chunk_metadata.get("langgraph_node") in AGENT_NODES and isinstance(chunk, AIMessageChunk):
+						text = message_text(chunk)
+						if text:
+							yield text
+					continue
+
+				# {node name: the update it returned}
+				for event in payload.values():
+					if not isinstance(event, dict):
+						continue
+					if "response_chunks" in event and event["response_chunks"]:
+						for chunk in event["response_chunks"]:
+							yield chunk
+
+					if "response_text" in event and event["response_text"]:
 						yield llm_service_pb2.LLMResponse(
 							request_id=request_id,
-							sequence=next_sequence(),
-							token=llm_service_pb2.TextToken(text=chunk)
+							message=llm_service_pb2.TextMessage(text=event["response_text"])
 						)
 
-				if "response_text" in event and event["response_text"]:
-					yield llm_service_pb2.LLMResponse(
-						request_id=request_id,
-						sequence=next_sequence(),
-						message=llm_service_pb2.TextMessage(text=event["response_text"])
-					)
-
-				if "citations" in event and event["citations"]:
-					for citation in event["citations"]:
-						yield llm_service_pb2.LLMResponse(
-							request_id=request_id,
-							sequence=next_sequence(),
-							citation=llm_service_pb2.Citation(
-								citation_id=citation.get("citation_id", ""),
-								source_uri=citation.get("source_uri", ""),
-								excerpt=citation.get("excerpt", ""),
-								relevance_score=citation.get("relevance_score", 0.0)
+					if "citations" in event and event["citations"]:
+						for citation in event["citations"]:
+							yield llm_service_pb2.LLMResponse(
+								request_id=request_id,
+								citation=llm_service_pb2.Citation(
+									citation_id=citation.get("citation_id", ""),
+									source_uri=citation.get("source_uri", ""),
+									excerpt=citation.get("excerpt", ""),
+									relevance_score=citation.get("relevance_score", 0.0)
+								)
 							)
-						)
 
-				if "pending_artifacts" in event and event["pending_artifacts"]:
-					for artifact in event["pending_artifacts"]:
-						yield llm_service_pb2.LLMResponse(
-							request_id=request_id,
-							sequence=next_sequence(),
-							artifact_started=llm_service_pb2.ArtifactStarted(
-								artifact_id=artifact.get("artifact_id", ""),
-								type=self._map_artifact_type(artifact["type"]),
-								mime_type=artifact.get("mime_type", "")
+					if "pending_artifacts" in event and event["pending_artifacts"]:
+						for artifact in event["pending_artifacts"]:
+							yield llm_service_pb2.LLMResponse(
+								request_id=request_id,
+								artifact_started=llm_service_pb2.ArtifactStarted(
+									artifact_id=artifact.get("artifact_id", ""),
+									type=self._map_artifact_type(artifact["type"]),
+									mime_type=artifact.get("mime_type", "")
+								)
 							)
-						)
 
-						yield llm_service_pb2.LLMResponse(
-							request_id=request_id,
-							sequence=next_sequence(),
-							artifact_completed=llm_service_pb2.ArtifactCompleted(
-								artifact_id=artifact.get("artifact_id", ""),
-								final_uri=artifact.get("final_uri", ""),
-								metadata=artifact.get("metadata", {})
+							yield llm_service_pb2.LLMResponse(
+								request_id=request_id,
+								artifact_completed=llm_service_pb2.ArtifactCompleted(
+									artifact_id=artifact.get("artifact_id", ""),
+									final_uri=artifact.get("final_uri", ""),
+									metadata=artifact.get("metadata", {})
+								)
 							)
-						)
 
-				if "tool_calls" in event and event["tool_calls"]:
-					for tool_call in event["tool_calls"]:
-						yield llm_service_pb2.LLMResponse(
-							request_id=request_id,
-							sequence=next_sequence(),
-							tool_call=llm_service_pb2.ToolCall(
-								tool_name=tool_call["tool_name"],
-								call_id=tool_call["call_id"],
-								input_json=tool_call["input_json"]
+					if "tool_calls" in event and event["tool_calls"]:
+						for tool_call in event["tool_calls"]:
+							yield llm_service_pb2.LLMResponse(
+								request_id=request_id,
+								tool_call=llm_service_pb2.ToolCall(
+									tool_name=tool_call["tool_name"],
+									call_id=tool_call["call_id"],
+									input_json=tool_call["input_json"]
+								)
 							)
-						)
 
-				if "tool_results" in event and event["tool_results"]:
-					for tool_result in event["tool_results"]:
-						yield llm_service_pb2.LLMResponse(
-							request_id=request_id,
-							sequence=next_sequence(),
-							tool_result=llm_service_pb2.ToolResult(
-								call_id=tool_result["call_id"],
-								output_json=tool_result["output_json"],
-								success=tool_result.get("success", True)
+					if "tool_results" in event and event["tool_results"]:
+						for tool_result in event["tool_results"]:
+							yield llm_service_pb2.LLMResponse(
+								request_id=request_id,
+								tool_result=llm_service_pb2.ToolResult(
+									call_id=tool_result["call_id"],
+									output_json=tool_result["output_json"],
+									success=tool_result.get("success", True)
+								)
 							)
-						)
 
-				if "errors" in event and event["errors"]:
-					for error in event["errors"]:
-						yield llm_service_pb2.LLMResponse(
-							request_id=request_id,
-							sequence=next_sequence(),
-							error=llm_service_pb2.ErrorEvent(
-								code="GRAPH_ERROR",
-								message=error,
-								recoverable=True,
-								details={}
+					if "errors" in event and event["errors"]:
+						for error in event["errors"]:
+							yield llm_service_pb2.LLMResponse(
+								request_id=request_id,
+								error=llm_service_pb2.ErrorEvent(
+									code="GRAPH_ERROR",
+									message=error,
+									recoverable=True,
+									details={}
+								)
 							)
-						)
 
-				if "warnings" in event and event["warnings"]:
-					for warning in event["warnings"]:
-						logger.warning(f"[{request_id}] Warning: {warning}")
+					if "warnings" in event and event["warnings"]:
+						for warning in event["warnings"]:
+							logger.warning(f"[{request_id}] Warning: {warning}")
+
+		# Wait for a slot on the model backend (higher `x-priority` first), a saturated backend fails the
+		# call fast with RESOURCE_EXHAUSTED and a retry hint instead of slowing every stream down.
+		# A request joining a generation in flight needs no slot: the leader acquires one before it starts the
+		# flight and the flight holds it until the generation ends, also when the leader's client goes away.
+		# The slot is on the model of the node the graph runs (model_info), so the limits and the queue wait
+		# estimates are charged to the backend that does the work
+		graph_node = cast(dict[str, Any], initial_state["model_info"])["name"]
+		backend = MODEL_CATALOG[graph_node]["name"]
+		admission: Optional[Admission] = None
+		queue_wait_ms: Optional[float] = None
+		responses: Optional[AsyncIterator[Union[str, llm_service_pb2.LLMResponse]]] = None
+		following = False
+		while responses is None:
+			if coalesce is not None and self.single_flight is not None and self.single_flight.in_flight(coalesce):
+				# Checked and joined without an await in between, so the flight can't end in the meantime
+				responses, _ = self.single_flight.subscribe(coalesce, graph_responses)
+				following = True
+				logger.info(f"[{request_id}] Joined the generation in flight for the same question {self.single_flight.stats()}")
+				if admission is not None:
+					# The same generation started while this request waited for its slot
+					admission.release()
+					admission = None
+			elif self.admission is not None and admission is None:
+				try:
+					admission = await self.admission.acquire(backend, self._request_priority(context), timeout=context.time_remaining())
+				except AdmissionRejected as e:
+					logger.warning(f"[{request_id}] Rejected: {e} {self.admission.limiter(backend).stats()}")
+					context.set_trailing_metadata((("grpc-retry-pushback-ms", str(e.retry_after_ms)),))
+					await context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, str(e))
+					return
+				queue_wait_ms = admission.wait_ms
+				if admission.wait_ms >= 1:
+					logger.info(f"[{request_id}] Waited {admission.wait_ms:.0f}ms for {backend}")
+				# Checked again, the same question may have started generating while this one waited
+			elif coalesce is not None and self.single_flight is not None:
+				responses, _ = self.single_flight.subscribe(coalesce, graph_responses, on_done=admission.release if admission is not None else None)
+				# Released by the flight
+				admission = None
+			else:
+				responses = graph_responses()
+
+		try:
+			# Consecutive text chunks are merged into one TextToken and a slow client blocks the graph
+			# (bounded queue) instead of letting the responses pile up in memory
+			response_stream = ResponseStream(responses)
+			async for item in response_stream:
+				if isinstance(item, str):
+					full_assistant_response += item
+					yield llm_service_pb2.LLMResponse(
+						request_id=request_id,
+						sequence=next_sequence(),
+						token=llm_service_pb2.TextToken(text=item)
+					)
+				else:
+					if coalesce is not None:
+						# Shared by every subscriber of the generation
+						response = llm_service_pb2.LLMResponse()
+						response.CopyFrom(item)
+						item = response
+					if item.HasField("error"):
+						graph_errors = True
+					item.request_id = request_id
+					item.sequence = next_sequence()
+					yield item
+			logger.debug(f"[{request_id}] Response stream: {response_stream.stats()}")
+
+			if full_assistant_response:
+				# Only the new turn is appended, the rest of the cached history is untouched
+				await self.context_manager.append_history(
+					user_id=user_id,
+					session_id=session_id,
+					messages=[HumanMessage(content=user_text), AIMessage(content=full_assistant_response)],
+					model=routing_decision["primary_model"]["name"]
+				)
+
+				# Partial answers (graph errors) are never cached, a coalesced answer is stored by its leader
+				if use_response_cache and not graph_errors and not following:
+					assert self.response_cache is not None
+					try:
+						await self.response_cache.store(user_text, response_scope, full_assistant_response)
+					except Exception as e:
+						logger.warning(f"[{request_id}] Failed to cache the response: {e}")
 
-			final_state: ChatGraphState = await self.chat_graph.aget_state(config)
-			StateSnapshot
+			final_state: StateSnapshot = await self.chat_graph.aget_state(config)
 			# Emit the Execution summary after the response is completed
 			yield llm_service_pb2.LLMResponse(
 				request_id=request_id,
 				sequence=next_sequence(),
-				summary=self._create_execution_summary(final_state as ChatGraphState)
+				summary=self._create_execution_summary(cast(ChatGraphState, final_state.values))
 			)
 
 			# Stream End event
@@ -360,6 +550,11 @@ class LLMServiceClass(llm_service_pb2_grpc.LLMServiceServicer):
 			)
 		
 		finally:
+			if admission is not None:
+				admission.release()
+			if queue_wait_ms is not None:
+				context.set_trailing_metadata((("x-queue-wait-ms", f"{queue_wait_ms:.0f}"),))
+
 			model_usages = []
 			total_input = total_output = 0
 
@@ -403,14 +598,15 @@ class LLMServiceClass(llm_service_pb2_grpc.LLMServiceServicer):
 	async def CheckFileStatus(self, request: llm_service_pb2.FileStatusRequest, context: grpc.aio.ServicerContext) -> llm_service_pb2.FileStatusResponse:
 		"""Check Processing Status of a File"""
 		file_infos = []
+		file_statuses = await self.file_manager.get_file_statuses(list(request.file_ids))
 
 		for file_id in request.file_ids:
-			status = await self.file_manager.get_file_status(file_id)
+			status = file_statuses[file_id]
 
 			file_infos.append(
 				llm_service_pb2.FileInfo(
 					file_id=file_id,
-					status=self._map_file_status(status["status"]),
+					status=self._map_file_status(status.get("status", "")),
 					s3_uri=status.get("s3_uri", ""),
 					size_bytes=status.get("size_bytes", 0),
 					mime_type=status.get("mime_type", ""),
@@ -422,30 +618,48 @@ class LLMServiceClass(llm_service_pb2_grpc.LLMServiceServicer):
 
 	async def GetChatHistory(self, request: llm_service_pb2.ChatHistoryRequest, context: grpc.aio.ServicerContext) -> llm_service_pb2.ChatHistoryResponse:
 		"""Retrieve chat history for a session."""
-		# # Query Postgres for history
-		# query = """
-		# 	SELECT message_id, role, content, timestamp, file_ids
-		# 	FROM chat_messages
-		# 	WHERE user_id = $1 AND session_id = $2
-		# 	ORDER BY timestamp DESC
-		# 	LIMIT $3
-		# """
-    
-		# rows = await postgres.fetch(query, user_id, session_id, max_messages)
-    
-		# messages = []
-		# for row in reversed(rows):  # Reverse to get chronological order
-		# 	messages.append(
-		# 		llm_service_pb2.ChatMessage(
-		# 			message_id=row['message_id'],
-		# 			role=row['role'],
-		# 			content=row['content'],
-		# 			timestamp=row['timestamp'].isoformat(),
-		# 			file_ids=row['file_ids'] or []
-		# 		)
-		# )
-    
-		# return llm_service_pb2.ChatHistoryResponse(messages=messages)
+		message_store = self.context_manager.message_store
+		if message_store is None:
+			await context.abort(grpc.StatusCode.UNAVAILABLE, "Chat history store is not configured")
+
+		rows = await message_store.fetch_tail(
+			user_id=request.user_id,
+			session_id=request.session_id,
+			limit=request.max_messages or 50
+		)
+
+		messages = []
+		for row in reversed(rows):  # Reverse to get chronological order
+			messages.append(
+				llm_service_pb2.ChatMessage(
+					message_id=row["message_id"],
+					role=row["role"],
+					content=row["content"],
+					timestamp=row["created_at"].isoformat(),
+					file_ids=row["file_ids"] or []
+				)
+			)
+
+		return llm_service_pb2.ChatHistoryResponse(messages=messages)
+
+	def _wants_file_status_stream(self, context: grpc.aio.ServicerContext) -> bool:
+		"""Clients opt in to streamed file status updates with the `x-file-status-mode: stream` metadata"""
+		metadata = dict(context.invocation_metadata() or ())
+		return metadata.get("x-file-status-mode") == "stream"
+
+	def _request_priority(self, context: grpc.aio.ServicerContext) -> int:
+		"""Admission priority from the `x-priority` metadata (low / normal / high or an integer)"""
+		metadata = dict(context.invocation_metadata() or ())
+		return parse_priority(metadata.get("x-priority"))
+
+	def _to_file_status_proto(self, file_id: str, status: dict[str, Any]) -> llm_service_pb2.FileProcessingStatus:
+		return llm_service_pb2.FileProcessingStatus(
+			file_id=file_id,
+			filename=status.get("filename", "unknown"),
+			status=self._map_file_status(status=status.get("status", "")),
+			progress_percent=status.get("progress", 0.0),
+			message=status.get("message", "")
+		)
 
 	# The return type is int and not llm_service_pb2.FileStatus because it is not
 	# a valid type at runtime, the protobuf enums are just integers in python
@@ -461,10 +675,36 @@ class LLMServiceClass(llm_service_pb2_grpc.LLMServiceServicer):
 
 		return mapping.get(status, llm_service_pb2.FILE_STATUS_UNSPECIFIED)
 
-	# Returns QueryAnalysis object
-	def _analyze_query(self, user_text: str, file_refs: list[FileReference]):
-		"""Analyze user query to determine routing"""
-		pass
+	def _analyze_query(self, user_text: str, file_refs: list[FileReference]) -> QueryAnalysis:
+		"""Analyze user query to determine routing (cheap heuristics, the intent comes from the router embeddings)"""
+		mime_types = [ref["mime_type"] for ref in file_refs]
+		estimated_tokens = len(user_text) // 4
+		needs_vision = any(mime.startswith("image/") for mime in mime_types)
+		needs_video = any(mime.startswith("video/") for mime in mime_types)
+
+		if estimated_tokens > 500 or len(file_refs) > 1 or needs_video:
+			complexity = "complex"
+		elif estimated_tokens > 100 or file_refs:
+			complexity = "medium"
+		else:
+			complexity = "simple"
+
+		pending = any(ref["status"] not in TERMINAL_FILE_STATUSES for ref in file_refs)
+
+		return QueryAnalysis(
+			complexity=complexity,
+			estimated_tokens=estimated_tokens,
+			needs_vision=needs_vision,
+			needs_video_analysis=needs_video,
+			needs_audio=any(mime.startswith("audio/") for mime in mime_types),
+			needs_code_execution=False,
+			needs_web_search=False,
+			has_attached_files=bool(file_refs),
+			file_types_attached=mime_types,
+			intent="other",
+			requires_file_processing=pending,
+			can_answer_immediately=not pending
+		)
 
 	def _parse_request(self, requestPrompt: RepeatedCompositeFieldContainer) -> tuple[str, list[FileReference]]:
 		"""Extract text and file references from request."""
@@ -499,15 +739,24 @@ class LLMServiceClass(llm_service_pb2_grpc.LLMServiceServicer):
 		user_text: str,
 		file_refs: list[FileReference],
 		routing_decision: ModelRoutingDecision,
-		context_options: Optional[llm_service_pb2.ContextOptions]
+		context_options: Optional[llm_service_pb2.ContextOptions],
+		conversation_history: list[BaseMessage]
 	) -> ChatGraphState:
 		"""Build initial state for chat graph."""
 
-		# Load Conversation history
-		conversation_history: list[BaseMessage] = await self.context_manager.load_history(
-			user_id=user_id,
-			session_id=session_id,
-			max_tokens=context_options.max_history_tokens if context_options else 4000
+		metrics = ExecutionMetrics(
+			routing_time_ms=None,
+			retrieval_time_ms=None,
+			retrieval_stage_ms={},
+			llm_inference_time_ms=None,
+			total_time_ms=None,
+			models_used=[],
+			total_tokens=0,
+			estimated_cost_usd=0.0,
+			retrieval_chunks_used=0,
+			context_utilization=0.0,
+			retry_count=0,
+			error_count=0
 		)
 
 		# Retrieve relavant context if needed
@@ -516,7 +765,10 @@ class LLMServiceClass(llm_service_pb2_grpc.LLMServiceServicer):
 			retrieved_context = await self.context_manager.retrieve_context(
 				query=user_text,
 				user_id=user_id,
-				max_chunks=context_options.max_retrieval_chunks or 5
+				max_chunks=context_options.max_retrieval_chunks or 5,
+				# "vector_search" | "keyword" | "hybrid", older clients don't send it
+				method=getattr(context_options, "retrieval_method", "") or "vector_search",
+				metrics=metrics
 			)
 
 		return ChatGraphState(
@@ -530,9 +782,13 @@ class LLMServiceClass(llm_service_pb2_grpc.LLMServiceServicer):
 			routing_decision=routing_decision,
 			selected_model=routing_decision["primary_model"],
 			llm_messages=[],
+			# The checkpointer keeps the previous turn under the same thread, start from the loaded history instead
+			messages=[RemoveMessage(id=REMOVE_ALL_MESSAGES), *conversation_history, HumanMessage(content=user_text)],
+			# Routed by LLMChat, the router node of the graph keeps it
+			model_info={"name": node_for_model(routing_decision["primary_model"]["name"])},
 			current_token_count=0,
 			max_tokens_allowed=routing_decision["primary_model"]["capabilities"]["max_context_tokens"],
-			files_ready=all(ref.status == "ready" for ref in file_refs),
+			files_ready=all(ref["status"] == "ready" for ref in file_refs),
 			needs_retrieval=bool(retrieved_context),
 			needs_vision_model=routing_decision.get("vision_model") is not None,
 			needs_multi_step=False, #Dont hardcode this,
@@ -542,6 +798,7 @@ class LLMServiceClass(llm_service_pb2_grpc.LLMServiceServicer):
 			pending_artifacts=[],
 			errors=[],
 			warnings=[],
+			metrics=metrics,
 			timestamp=datetime.now().isoformat()
 		)
 	
@@ -569,6 +826,11 @@ async def serve():
 	await registry.startup()
 
 	server = grpc.aio.server(futures.ThreadPoolExecutor(max_workers=os.cpu_count()))
+	file_status_watcher: Optional[FileStatusWatcher] = None
+	message_store: Optional[ChatMessageStore] = None
+	embedding_services: list[EmbeddingService] = []
+	residency_task: Optional[asyncio.Task] = None
+	admission = AdmissionController()
 	try:
 		assert registry.valkey_client is not None
 		assert registry.qdrant_client is not None
@@ -577,22 +839,54 @@ async def serve():
 
 		# Initialize dependencies
 		file_manager = FileManager(registry.valkey_client)
-		model_router = ModelRouter()
+		if registry.valkey_subscriber is not None:
+			file_status_watcher = FileStatusWatcher(registry.valkey_subscriber, file_manager)
+			file_status_watcher.start()
+		# Embedding requests of concurrent streams are batched, one service per embedding model
+		router_embeddings = EmbeddingService.create(ROUTER_EMBEDDING_MODEL)
+		retrieval_embeddings = EmbeddingService.create(RETRIEVAL_EMBEDDING_MODEL)
+		embedding_services += [router_embeddings, retrieval_embeddings]
+
+		model_router = ModelRouter(router_embeddings, residency=model_residency)
+
+		# Query embeddings are cached in-process and in Valkey, the model loads on the first miss
+		query_embedder = CachedEmbedder(
+			model_name=retrieval_embeddings.name,
+			encode_fn=retrieval_embeddings.encode,
+			valkey_client=registry.valkey_client
+		)
+
+		message_store = ChatMessageStore(registry.pg_pool)
+		await message_store.setup()
+		message_store.start()
+
 		context_manager = ConversationContextManager(
 			qdrant_client=registry.qdrant_client,
-			valkey_client=registry.valkey_client
+			valkey_client=registry.valkey_client,
+			message_store=message_store,
+			embedder=query_embedder
 		)
 
-		compiled_graph = build_graph(registry.checkpointer)
+		# Decision cache -> classifier / LLM router -> the embedding ModelRouter when those are too slow
+		query_router = QueryRouter(model_router, RouteDecisionCache(registry.valkey_client))
+		compiled_graph = build_graph(registry.checkpointer, query_router=query_router)
 
 		llm_service = LLMServiceClass(
 			chat_graph=compiled_graph,
-			model_router=model_router,
+			query_router=query_router,
 			file_manager=file_manager,
 			context_manager=context_manager,
-			qdrant_client=registry.qdrant_client
+			qdrant_client=registry.qdrant_client,
+			file_status_watcher=file_status_watcher,
+			# Shares the query embeddings (and their cache) with retrieval
+			response_cache=SemanticResponseCache(query_embedder.embed),
+			# Per model concurrency limits (ADMISSION_LIMITS / ADMISSION_DEFAULT_LIMIT)
+			admission=admission,
+			single_flight=SingleFlight() if REQUEST_COALESCING else None
 		)
 
+		admission.start()
+
 		# Injecting the compiled graph into the service
 		llm_service_pb2_grpc.add_LLMServiceServicer_to_server(llm_service, server)
 
@@ -602,11 +896,32 @@ async def serve():
 		await server.start()
 		logging.info("LLMService started on port 50051")
 
+		# Build the model clients and load the tokenizers now instead of on the first request
+		chat_models = [info["name"] for info in MODEL_CATALOG.values()] + [ROUTER_LLM]
+		warm_up_task = model_registry.start_warm_up(chat_models, temperature=0)
+		# Load the models into Ollama and track which ones stay resident
+		ollama_models = [model for model in chat_models if provider_for(model)[0] == "ollama"]
+		if ollama_models:
+			residency_task = asyncio.create_task(model_residency.start(ollama_models))
+
 		await server.wait_for_termination()
 	except KeyboardInterrupt:
 		# signal.signal(signal.SIGTERM, handle_sigterm)
 		await server.stop(0)
 	finally:
+		if file_status_watcher:
+			await file_status_watcher.stop()
+		if message_store:
+			# Flush the queued history writes before the pool closes
+			await message_store.stop()
+		for embedding_service in embedding_services:
+			await embedding_service.stop()
+		if residency_task:
+			residency_task.cancel()
+		await model_residency.stop()
+		# Connection pools of the OpenAI compatible servers
+		await close_clients()
+		await admission.stop()
 		await registry.shutdown()
 
 
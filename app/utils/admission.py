@@ -0,0 +1,238 @@
+"""Admission control in front of the model backends: per backend concurrency limit with a priority wait queue"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Concurrent generations per backend, match OLLAMA_NUM_PARALLEL.
+# ADMISSION_LIMITS overrides it per model: "qwen3-vl:4b=2,qwen2.5-coder:0.5b=8"
+ADMISSION_DEFAULT_LIMIT = int(os.getenv("ADMISSION_DEFAULT_LIMIT", 4))
+ADMISSION_LIMITS = os.getenv("ADMISSION_LIMITS", "")
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", 64))
+ADMISSION_MAX_WAIT_MS = float(os.getenv("ADMISSION_MAX_WAIT_MS", 10_000))
+# Seconds between two stats log lines, 0 disables them
+ADMISSION_STATS_INTERVAL = float(os.getenv("ADMISSION_STATS_INTERVAL", 60))
+
+PRIORITIES = {"low": 0, "normal": 1, "high": 2}
+
+def parse_limits(value: str) -> dict[str, int]:
+	""""model=n,model=n" -> {model: n}"""
+	limits = {}
+	for part in value.split(","):
+		if "=" not in part:
+			continue
+		# Model names contain ":" but never "="
+		backend, _, limit = part.rpartition("=")
+		limits[backend.strip()] = int(limit)
+	return limits
+
+def parse_priority(value: Optional[str]) -> int:
+	"""The `x-priority` metadata: low / normal / high or an integer, higher goes first"""
+	if not value:
+		return PRIORITIES["normal"]
+	value = value.strip().lower()
+	if value in PRIORITIES:
+		return PRIORITIES[value]
+	try:
+		return int(value)
+	except ValueError:
+		return PRIORITIES["normal"]
+
+class AdmissionRejected(Exception):
+	"""The backend is saturated, the client should retry after `retry_after_ms`"""
+
+	def __init__(self, backend: str, reason: str, retry_after_ms: int):
+		super().__init__(f"{backend} is overloaded ({reason}), retry in {retry_after_ms}ms")
+		self.backend = backend
+		self.reason = reason
+		self.retry_after_ms = retry_after_ms
+
+@dataclass(order=True)
+class _Waiter:
+	priority: int # negated, heapq pops the smallest
+	seq: int
+	future: asyncio.Future = field(compare=False)
+
+class Admission:
+	"""A held slot, `release` it when the generation is done (safe to call twice)"""
+
+	def __init__(self, limiter: "BackendLimiter", wait_ms: float):
+		self.limiter = limiter
+		self.wait_ms = wait_ms
+		self._admitted_at = time.perf_counter()
+		self._released = False
+
+	def release(self):
+		if not self._released:
+			self._released = True
+			self.limiter.release(time.perf_counter() - self._admitted_at)
+
+class BackendLimiter:
+	"""
+	At most `limit` requests run on the backend, the others wait in a priority queue (FIFO within a priority).
+	A freed slot is handed to the next waiter directly, so a new request can't overtake the queue.
+	"""
+
+	def __init__(self, backend: str, limit: int, max_queue: int = ADMISSION_MAX_QUEUE):
+		self.backend = backend
+		self.limit = limit
+		self.max_queue = max_queue
+
+		self.active = 0
+		self.queued = 0
+		self._waiters: list[_Waiter] = []
+		self._seq = itertools.count()
+		# EWMA of how long a request keeps its slot (seconds), for the wait estimate and the retry hint
+		self._hold_time = 1.0
+		self._hold_samples = 0
+
+		# Metrics
+		self.admitted = 0
+		self.rejected = 0
+		self.timed_out = 0
+		self.max_queue_depth = 0
+		self._wait_ms: deque[float] = deque(maxlen=1000)
+
+	async def acquire(self, priority: int, timeout: float) -> Admission:
+		start = time.perf_counter()
+		if self.active < self.limit and self.queued == 0:
+			self.active += 1
+			return self._admit(start)
+
+		if self.queued >= self.max_queue:
+			self.rejected += 1
+			raise AdmissionRejected(self.backend, "queue full", self.retry_after_ms())
+
+		# Fail fast when the slot would only come after the deadline (once the hold time is known)
+		if self._hold_samples >= self.limit and self.expected_wait() > timeout:
+			self.rejected += 1
+			raise AdmissionRejected(self.backend, f"expected wait {self.expected_wait() * 1000:.0f}ms", self.retry_after_ms())
+
+		waiter = _Waiter(-priority, next(self._seq), asyncio.get_running_loop().create_future())
+		heapq.heappush(self._waiters, waiter)
+		self.queued += 1
+		self.max_queue_depth = max(self.max_queue_depth, self.queued)
+
+		try:
+			await asyncio.wait_for(asyncio.shield(waiter.future), timeout=max(timeout, 0))
+		except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+			if waiter.future.done():
+				# The slot was handed over while timing out, pass it on
+				self.release(None)
+			else:
+				waiter.future.cancel()
+				self.queued -= 1
+			if isinstance(e, asyncio.CancelledError):
+				raise
+			self.timed_out += 1
+			self.rejected += 1
+			raise AdmissionRejected(self.backend, f"waited {timeout * 1000:.0f}ms", self.retry_after_ms()) from None
+
+		return self._admit(start)
+
+	def release(self, held: Optional[float]):
+		"""Frees a slot (or hands it to the best waiter), `held` is how long it was used"""
+		if held is not None:
+			self._hold_time = held if self._hold_samples == 0 else 0.8 * self._hold_time + 0.2 * held
+			self._hold_samples += 1
+
+		while self._waiters:
+			waiter = heapq.heappop(self._waiters)
+			if waiter.future.done():
+				continue # timed out or cancelled
+			self.queued -= 1
+			waiter.future.set_result(None) # the slot moves to the waiter, `active` is unchanged
+			return
+		self.active -= 1
+
+	def expected_wait(self) -> float:
+		"""Rough time (seconds) until a new request would get a slot"""
+		if self.active < self.limit and self.queued == 0:
+			return 0.0
+		return self._hold_time * (self.queued + 1) / self.limit
+
+	def retry_after_ms(self) -> int:
+		return int(min(30.0, max(0.1, self.expected_wait())) * 1000)
+
+	def stats(self) -> dict[str, float]:
+		waits = np.array(self._wait_ms) if self._wait_ms else np.zeros(1)
+		return {
+			"limit": self.limit,
+			"active": self.active,
+			"queue_depth": self.queued,
+			"max_queue_depth": self.max_queue_depth,
+			"admitted": self.admitted,
+			"rejected": self.rejected,
+			"timed_out": self.timed_out,
+			"wait_p50_ms": float(np.percentile(waits, 50)),
+			"wait_p95_ms": float(np.percentile(waits, 95)),
+			"expected_wait_ms": self.expected_wait() * 1000,
+		}
+
+	def _admit(self, start: float) -> Admission:
+		wait_ms = (time.perf_counter() - start) * 1000
+		self.admitted += 1
+		self._wait_ms.append(wait_ms)
+		return Admission(self, wait_ms)
+
+class AdmissionController:
+	"""One BackendLimiter per backend (the model a request is routed to), created on first use"""
+
+	def __init__(
+		self,
+		limits: Optional[dict[str, int]] = None,
+		default_limit: int = ADMISSION_DEFAULT_LIMIT,
+		max_queue: int = ADMISSION_MAX_QUEUE,
+		max_wait_ms: float = ADMISSION_MAX_WAIT_MS
+	):
+		self.limits = limits if limits is not None else parse_limits(ADMISSION_LIMITS)
+		self.default_limit = default_limit
+		self.max_queue = max_queue
+		self.max_wait = max_wait_ms / 1000
+		self.limiters: dict[str, BackendLimiter] = {}
+		self._stats_task: Optional[asyncio.Task] = None
+
+	def limiter(self, backend: str) -> BackendLimiter:
+		limiter = self.limiters.get(backend)
+		if limiter is None:
+			limiter = BackendLimiter(backend, self.limits.get(backend, self.default_limit), self.max_queue)
+			self.limiters[backend] = limiter
+		return limiter
+
+	async def acquire(self, backend: str, priority: int, timeout: Optional[float] = None) -> Admission:
+		"""Waits for a slot on `backend`, at most `timeout` seconds (capped by ADMISSION_MAX_WAIT_MS)"""
+		wait = self.max_wait if timeout is None else min(timeout, self.max_wait)
+		return await self.limiter(backend).acquire(priority, wait)
+
+	def stats(self) -> dict[str, dict[str, float]]:
+		return {backend: limiter.stats() for backend, limiter in self.limiters.items()}
+
+	def start(self, interval: float = ADMISSION_STATS_INTERVAL):
+		"""Logs the stats of every backend every `interval` seconds"""
+		if interval > 0 and self._stats_task is None:
+			self._stats_task = asyncio.create_task(self._report(interval))
+
+	async def stop(self):
+		if self._stats_task:
+			self._stats_task.cancel()
+			try:
+				await self._stats_task
+			except asyncio.CancelledError:
+				pass
+			self._stats_task = None
+
+	async def _report(self, interval: float):
+		while True:
+			await asyncio.sleep(interval)
+			for backend, stats in self.stats().items():
+				logger.info(f"Admission {backend}: {stats}")
@@ -0,0 +1,82 @@
+"""Versioned binary encoding for the values cached in Valkey"""
+
+import json
+import logging
+from typing import Any, Literal
+
+try:
+	import msgpack
+except ImportError:
+	msgpack = None
+
+try:
+	import zstandard
+except ImportError:
+	zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# The first byte of every encoded value says how the rest was written.
+# JSON text never starts with these bytes, so the plain JSON entries written before
+# the codec existed are still decoded while a rollout is in progress.
+FORMAT_MSGPACK = 0x01
+FORMAT_MSGPACK_ZSTD = 0x02
+FORMAT_JSON = 0x03
+FORMAT_JSON_ZSTD = 0x04
+
+class ValueCodec:
+	"""
+	Encodes values for Valkey as <version byte><payload>.
+
+	- "msgpack" (default) drops JSON's quoting and number formatting overhead, "json" is
+	  kept for values that must stay readable (or when msgpack is not installed)
+	- Payloads bigger than `compress_threshold` bytes are compressed with zstd when available
+	"""
+
+	def __init__(self, format: Literal["msgpack", "json"] = "msgpack", compress_threshold: int = 1024, compression_level: int = 3):
+		if format == "msgpack" and msgpack is None:
+			logger.warning("msgpack is not installed, falling back to JSON encoding")
+			format = "json"
+
+		self.format = format
+		self.compress_threshold = compress_threshold
+
+		self._compressor = zstandard.ZstdCompressor(level=compression_level) if zstandard else None
+		self._decompressor = zstandard.ZstdDecompressor() if zstandard else None
+
+	def encode(self, value: Any) -> bytes:
+		if self.format == "msgpack":
+			payload: bytes = msgpack.packb(value, use_bin_type=True)
+			version = FORMAT_MSGPACK
+		else:
+			payload = json.dumps(value, separators=(",", ":")).encode()
+			version = FORMAT_JSON
+
+		if self._compressor and len(payload) > self.compress_threshold:
+			payload = self._compressor.compress(payload)
+			version = FORMAT_MSGPACK_ZSTD if version == FORMAT_MSGPACK else FORMAT_JSON_ZSTD
+
+		return bytes((version,)) + payload
+
+	def decode(self, data: bytes | str) -> Any:
+		if isinstance(data, str):
+			return json.loads(data)
+		if not data:
+			raise ValueError("Cannot decode an empty value")
+
+		version, payload = data[0], data[1:]
+
+		if version in (FORMAT_MSGPACK_ZSTD, FORMAT_JSON_ZSTD):
+			if self._decompressor is None:
+				raise RuntimeError("zstandard is required to decode this value")
+			payload = self._decompressor.decompress(payload)
+
+		if version in (FORMAT_MSGPACK, FORMAT_MSGPACK_ZSTD):
+			if msgpack is None:
+				raise RuntimeError("msgpack is required to decode this value")
+			return msgpack.unpackb(payload, raw=False)
+		if version in (FORMAT_JSON, FORMAT_JSON_ZSTD):
+			return json.loads(payload)
+
+		# No version byte, written before the codec existed
+		return json.loads(data)
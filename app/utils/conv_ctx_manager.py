@@ -1,16 +1,44 @@
 from datetime import datetime
 import logging
+import asyncio
 import json
-from typing import Any, Optional
+import time
+from typing import Any, Optional, cast
 
-from glide import ExpirySet, ExpiryType, GlideClient
+from glide import Batch, GlideClient
 from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
 from qdrant_client import AsyncQdrantClient
+from qdrant_client.http.models import FieldCondition, Filter, MatchValue, ScoredPoint
+from qdrant_client.models import Document
 
-from app.graph.state import RetrievedChunk
+from app.graph.state import ExecutionMetrics, RetrievedChunk
+from app.utils.codec import ValueCodec
+from app.utils.db.chatMessageStore import ChatMessageStore
+from app.utils.db.connectQdrant import SPARSE_EMBEDDING_MODEL, SPARSE_VECTOR_NAME
+from app.utils.embeddings import CachedEmbedder
+from app.utils.rank_fusion import reciprocal_rank_fusion
+from app.utils.token_counter import TokenCounter, token_counter
 
 logger = logging.getLogger(__name__)
 
+HISTORY_TTL = 3600
+# Number of messages fetched per LRANGE while walking the history backwards
+HISTORY_PAGE_SIZE = 20
+# Number of rows fetched per keyset page when the history has to be read from Postgres
+STORE_PAGE_SIZE = 50
+
+RETRIEVAL_METHODS = ("vector_search", "keyword", "hybrid")
+# In hybrid mode each retriever returns max_chunks * this many candidates before fusion
+HYBRID_CANDIDATE_FACTOR = 3
+
+_MESSAGE_TYPE_CODES: dict[type[BaseMessage], str] = {HumanMessage: "h", AIMessage: "a", SystemMessage: "s"}
+_MESSAGE_CLASSES = {code: cls for cls, code in _MESSAGE_TYPE_CODES.items()}
+_LEGACY_MESSAGE_CLASSES = {cls.__name__: cls for cls in _MESSAGE_TYPE_CODES}
+
+# Roles used in the chat_messages table
+_MESSAGE_ROLES: dict[type[BaseMessage], str] = {HumanMessage: "user", AIMessage: "assistant", SystemMessage: "system"}
+_ROLE_MESSAGE_CLASSES = {role: cls for cls, role in _MESSAGE_ROLES.items()}
+
 class ConversationContextManager:
 	"""
 	Manages conversation context and RAG retrieval.
@@ -22,155 +50,347 @@ class ConversationContextManager:
 	4. Manage token limits
 	"""
 
-	def __init__(self, qdrant_client: AsyncQdrantClient, valkey_client: GlideClient, collection_name: str = "user_documents"):
+	def __init__(
+		self,
+		qdrant_client: AsyncQdrantClient,
+		valkey_client: GlideClient,
+		collection_name: str = "user_documents",
+		codec: Optional[ValueCodec] = None,
+		counter: Optional[TokenCounter] = None,
+		message_store: Optional[ChatMessageStore] = None,
+		embedder: Optional[CachedEmbedder] = None
+	):
 		self.qdrant_client = qdrant_client
 		self.valkey_client = valkey_client
 		self.collection_name = collection_name
+		self.codec = codec or ValueCodec()
+		self.token_counter = counter or token_counter
+		self.message_store = message_store
+		self.embedder = embedder
 
 		logger.info("ContextManager initialized")
 
-	async def load_history(self, user_id: str, session_id: str, max_tokens: int = 4000) -> list[BaseMessage]:
+	async def load_history(self, user_id: str, session_id: str, max_tokens: int = 4000, model: Optional[str] = None) -> list[BaseMessage]:
 		"""
 		Load conversation history from cache/DB.
 
 		Strategy:
 		1. Check Valkey cache first (fast)
-		2. Fall back to Postgres if not cached
+		2. Fall back to Postgres if not cached (and repopulate the cache)
 		3. Trim to fit within max_tokens
+
+		The history is a Valkey list (one message per element), so it is read backwards one
+		page at a time and only the newest messages that fit in max_tokens are fetched and decoded.
+		Tokens are counted with the tokenizer of `model`, reusing the count stored with each message.
 		"""
 
-		cache_key = f"chat_history:{user_id}:{session_id}"
-        
-		# Try Redis cache first
-		cached = await self.valkey_client.get(cache_key)
-		if cached:
-			messages_data = json.loads(cached)
-			messages = self._deserialize_messages(messages_data)
-			logger.info(f"Loaded {len(messages)} messages from cache")
-			return self._trim_messages(messages, max_tokens)
+		cache_key = self._history_key(user_id, session_id)
+		await self.token_counter.load(model)
+
+		system_msg: Optional[BaseMessage] = None
+		newest_first: list[BaseMessage] = []
+		used_tokens = 0
+		end = -1
+		cached = True
+
+		while True:
+			batch = Batch(is_atomic=False)
+			batch.lrange(cache_key, end - HISTORY_PAGE_SIZE + 1, end)
+			if end == -1:
+				# The system message (if any) is the first element and is always kept
+				batch.lindex(cache_key, 0)
+				batch.llen(cache_key)
+
+			results = await self.valkey_client.exec(batch, raise_on_error=True) or []
+			page = cast(list[bytes], results[0])
 
-		# TODO: Load from Postgres if not cached
-		# For now, return empty
-		logger.info("No cached history found, returning empty")
-		return []
+			if end == -1:
+				cached = cast(int, results[2]) > 0
+				first, first_tokens = self._deserialize_message(results[1], model) if results[1] else (None, 0)
+				if isinstance(first, SystemMessage):
+					system_msg = first
+					used_tokens += first_tokens
+
+			budget_reached = False
+			for raw in reversed(page):
+				msg, msg_tokens = self._deserialize_message(raw, model)
+				if msg is None or isinstance(msg, SystemMessage):
+					continue
+
+				if used_tokens + msg_tokens > max_tokens:
+					budget_reached = True
+					break
+
+				newest_first.append(msg)
+				used_tokens += msg_tokens
+
+			# A short page means the start of the list was reached
+			if budget_reached or len(page) < HISTORY_PAGE_SIZE:
+				break
+			end -= HISTORY_PAGE_SIZE
+
+		# Only a missing list is read from Postgres, a cached history where nothing fits max_tokens is just empty
+		if not cached:
+			if self.message_store is None:
+				logger.info("No cached history found, returning empty")
+				return []
+			return await self._load_history_from_store(user_id, session_id, max_tokens, model)
+
+		messages = ([system_msg] if system_msg else []) + newest_first[::-1]
+		logger.info(f"Loaded {len(messages)} messages from cache")
+		return messages
 
-	async def save_history(self, user_id: str, session_id: str, messages: list[BaseMessage]):
-		"""Save conversation history to cache."""
+	async def append_history(self, user_id: str, session_id: str, messages: list[BaseMessage], model: Optional[str] = None):
+		"""
+		Append the messages of a new turn to the cached history.
+		Only the new messages are sent, the TTL of the whole history is refreshed.
+		The token count of each message (for `model`) is stored with it so later turns don't recount.
+		"""
 
-		cache_key = f"chat_history:{user_id}:{session_id}"
+		if not messages:
+			return
 
-		# Serialize messages
-		messages_data = self._serialize_messages(messages)
+		cache_key = self._history_key(user_id, session_id)
+		await self.token_counter.load(model)
 
+		batch = Batch(is_atomic=True)
+		batch.rpush(cache_key, [self._serialize_message(msg, model) for msg in messages])
 		# Store with 1 hour TTL
-		await self.valkey_client.set(cache_key,json.dumps(messages_data), expiry=ExpirySet(ExpiryType.SEC, 3600))
+		batch.expire(cache_key, HISTORY_TTL)
+		await self.valkey_client.exec(batch, raise_on_error=True)
+
+		logger.info(f"Appended {len(messages)} messages to cache")
 
-		logger.info(f"Saved {len(messages)} messages to cache")
+		if self.message_store is not None:
+			# Write-behind, the rows are inserted into Postgres by a background task
+			family = self.token_counter.model_family(model)
+			for msg in messages:
+				self.message_store.enqueue(
+					user_id=user_id,
+					session_id=session_id,
+					role=_MESSAGE_ROLES.get(type(msg), msg.type),
+					content=msg.content,
+					token_count=self.token_counter.count_message(msg, model),
+					token_family=family
+				)
 
-	async def retrieve_context(self, query: str, user_id: str, max_chunks: int = 5, similarity_threshold: float = 0.7) -> list[RetrievedChunk]:
+	async def _load_history_from_store(self, user_id: str, session_id: str, max_tokens: int, model: Optional[str]) -> list[BaseMessage]:
+		"""
+		Read-through for sessions whose cached history expired.
+		Reads the newest messages from Postgres one keyset page at a time until max_tokens is
+		reached, then puts them back in Valkey so the next turns are served from the cache.
+		"""
+		assert self.message_store is not None
+
+		family = self.token_counter.model_family(model)
+		newest_first: list[BaseMessage] = []
+		encoded: list[bytes] = []
+		used_tokens = 0
+		before_id: Optional[int] = None
+
+		while True:
+			rows = await self.message_store.fetch_tail(user_id, session_id, limit=STORE_PAGE_SIZE, before_id=before_id)
+
+			budget_reached = False
+			for row in rows:
+				message_cls = _ROLE_MESSAGE_CLASSES.get(row["role"])
+				if message_cls is None:
+					continue
+
+				msg = message_cls(content=row["content"])
+				if row["token_count"] is not None and row["token_family"] == family:
+					msg_tokens = row["token_count"]
+				else:
+					msg_tokens = self.token_counter.count_message(msg, model)
+
+				if used_tokens + msg_tokens > max_tokens:
+					budget_reached = True
+					break
+
+				newest_first.append(msg)
+				encoded.append(self._serialize_message(msg, model))
+				used_tokens += msg_tokens
+
+			if budget_reached or len(rows) < STORE_PAGE_SIZE:
+				break
+			before_id = rows[-1]["id"]
+
+		if not newest_first:
+			logger.info("No history found in cache or Postgres, returning empty")
+			return []
+
+		# The list is replaced as a whole, so a concurrent read-through of the same session can't append
+		# its copy of the messages to this one
+		cache_key = self._history_key(user_id, session_id)
+		batch = Batch(is_atomic=True)
+		batch.delete([cache_key])
+		batch.rpush(cache_key, encoded[::-1])
+		batch.expire(cache_key, HISTORY_TTL)
+		await self.valkey_client.exec(batch, raise_on_error=True)
+
+		logger.info(f"Loaded {len(newest_first)} messages from Postgres and cached them")
+		return newest_first[::-1]
+
+	async def retrieve_context(
+		self,
+		query: str,
+		user_id: str,
+		max_chunks: int = 5,
+		similarity_threshold: float = 0.7,
+		method: str = "vector_search",
+		metrics: Optional[ExecutionMetrics] = None
+	) -> list[RetrievedChunk]:
 		"""
 		Retrieve relevant chunks from vector DB.
 		Uses:
 		- User's uploaded documents
 		- Previous conversation context
 		- Shared knowledge base (if applicable)
-		""" 
+
+		Methods:
+		- "vector_search": dense similarity search
+		- "keyword": BM25 over the sparse vectors, finds exact identifiers, usernames and error strings
+		- "hybrid": both searches run concurrently and are merged with reciprocal rank fusion
+
+		The time spent in each stage (embed, search, post-process) is recorded in `metrics`.
+		"""
+		stage_ms: dict[str, float] = {}
+		chunks: list[RetrievedChunk] = []
+		start = time.perf_counter()
+
 		try:
-			# TODO: Generate embedding for query
-			# For now, return empty
-			# query_embedding = await self._embed_text(query)
-			# Search Qdrant
-			# results = await self.qdrant.search(
-			#     collection_name=self.collection_name,
-			#     query_vector=query_embedding,
-			#     query_filter=Filter(
-			#         must=[
-			#             FieldCondition(
-			#                 key="user_id",
-			#                 match=MatchValue(value=user_id)
-			#             )
-			#         ]
-			#     ),
-			#     limit=max_chunks,
-			#     score_threshold=similarity_threshold
-			# )
-			# chunks = []
-			# for result in results:
-			#     chunks.append({
-			#         "chunk_id": result.id,
-			#         "content": result.payload["content"],
-			#         "source_file_id": result.payload["file_id"],
-			#         "relevance_score": result.score,
-			#         "chunk_type": result.payload["type"],
-			#         "metadata": result.payload.get("metadata", {})
-			#     })
-			# logger.info(f"Retrieved {len(chunks)} chunks for query")
-			# return chunks
+			if method not in RETRIEVAL_METHODS:
+				logger.warning(f"Retrieval method {method} is not supported, using vector_search")
+				method = "vector_search"
 
-			return []
+			if method != "keyword" and self.embedder is None:
+				logger.warning("No query embedder configured, skipping retrieval")
+				return []
+
+			user_filter = Filter(
+				must=[
+					FieldCondition(
+						key="user_id",
+						match=MatchValue(value=user_id)
+					)
+				]
+			)
+
+			# Hybrid fetches deeper candidate lists so the fusion has something to work with
+			candidates = max_chunks * HYBRID_CANDIDATE_FACTOR if method == "hybrid" else max_chunks
+
+			searches = []
+			if method in ("vector_search", "hybrid"):
+				searches.append(self._dense_search(query, user_filter, candidates, similarity_threshold, stage_ms))
+			if method in ("keyword", "hybrid"):
+				searches.append(self._keyword_search(query, user_filter, candidates, stage_ms))
+
+			rankings = await asyncio.gather(*searches)
+			searched_at = time.perf_counter()
+			# Each search times itself after its query embedding (stage "embed"), so the embedding is not
+			# counted twice. The searches of hybrid run concurrently, the stage is the slowest of them
+			stage_ms["search"] = max(stage_ms.get("vector_search", 0.0), stage_ms.get("keyword_search", 0.0))
+
+			if len(rankings) == 1:
+				scored_points = [(point, point.score) for point in rankings[0][:max_chunks]]
+			else:
+				scored_points = reciprocal_rank_fusion(rankings, key=lambda point: point.id, limit=max_chunks)
+
+			for point, score in scored_points:
+				payload = point.payload or {}
+				chunks.append({
+					"chunk_id": str(point.id),
+					"content": payload["content"],
+					"source_file_id": payload["file_id"],
+					"relevance_score": score,
+					"chunk_type": payload["type"],
+					"metadata": {**payload.get("metadata", {}), "retrieval_method": method}
+				})
+			stage_ms["post_process"] = (time.perf_counter() - searched_at) * 1000
+
+			logger.info(f"Retrieved {len(chunks)} chunks for query ({method})")
+			return chunks
 
 		except Exception as e:
 			logger.error(f"Error retrieving context: {e}")
 			return []
 
-	def _serialize_messages(self, messages: list[BaseMessage]) -> list[dict]:
-		"""Convert LangChain messages to JSON-serializable format."""
-		return [
-		{
-			"type": msg.__class__.__name__,
-			"content": msg.content,
-			"additional_kwargs": msg.additional_kwargs
+		finally:
+			total_ms = (time.perf_counter() - start) * 1000
+			if metrics is not None:
+				metrics["retrieval_time_ms"] = int(total_ms)
+				metrics["retrieval_chunks_used"] = len(chunks)
+				metrics["retrieval_stage_ms"] = stage_ms
+			logger.debug(f"Retrieval took {total_ms:.1f} ms {stage_ms}")
+
+	async def _dense_search(self, query: str, user_filter: Filter, limit: int, similarity_threshold: float, stage_ms: dict[str, float]) -> list[ScoredPoint]:
+		assert self.embedder is not None
+
+		start = time.perf_counter()
+		query_embedding = await self.embedder.embed(query)
+		embedded_at = time.perf_counter()
+		stage_ms["embed"] = (embedded_at - start) * 1000
+
+		response = await self.qdrant_client.query_points(
+			collection_name=self.collection_name,
+			query=query_embedding.tolist(),
+			query_filter=user_filter,
+			limit=limit,
+			score_threshold=similarity_threshold,
+			with_payload=True
+		)
+		stage_ms["vector_search"] = (time.perf_counter() - embedded_at) * 1000
+		return response.points
+
+	async def _keyword_search(self, query: str, user_filter: Filter, limit: int, stage_ms: dict[str, float]) -> list[ScoredPoint]:
+		start = time.perf_counter()
+
+		# The BM25 sparse query vector is computed client side (fastembed), IDF is applied by Qdrant
+		response = await self.qdrant_client.query_points(
+			collection_name=self.collection_name,
+			query=Document(text=query, model=SPARSE_EMBEDDING_MODEL),
+			using=SPARSE_VECTOR_NAME,
+			query_filter=user_filter,
+			limit=limit,
+			with_payload=True
+		)
+		stage_ms["keyword_search"] = (time.perf_counter() - start) * 1000
+		return response.points
+
+	def _history_key(self, user_id: str, session_id: str) -> str:
+		return f"chat_messages:{user_id}:{session_id}"
+
+	def _serialize_message(self, msg: BaseMessage, model: Optional[str] = None) -> bytes:
+		"""Encode a LangChain message as one list element (short keys, type code instead of the class name)."""
+		# Unknown message types keep their class name and are skipped when decoding
+		code = next((code for cls, code in _MESSAGE_TYPE_CODES.items() if isinstance(msg, cls)), msg.__class__.__name__)
+		item: dict[str, Any] = {
+			"t": code,
+			"c": msg.content,
+			# Token count and the tokenizer family it was counted with
+			"n": self.token_counter.count_message(msg, model),
+			"f": self.token_counter.model_family(model)
 		}
-		for msg in messages
-	]
-
-	def _deserialize_messages(self, data: list[dict]) -> list[BaseMessage]:
-		"""Convert JSON back to LangChain messages."""
-		messages = []
-		for item in data:
-			if item["type"] == "HumanMessage":
-				messages.append(HumanMessage(content=item["content"]))
-			elif item["type"] == "AIMessage":
-				messages.append(AIMessage(content=item["content"]))
-			elif item["type"] == "SystemMessage":
-				messages.append(SystemMessage(content=item["content"]))
-		return messages
+		if msg.additional_kwargs:
+			item["k"] = msg.additional_kwargs
+		return self.codec.encode(item)
 
-	def _trim_messages(self, messages: list[BaseMessage], max_tokens: int) -> list[BaseMessage]:
-		"""
-		Trim messages to fit within token limit.
+	def _deserialize_message(self, data: bytes | str, model: Optional[str] = None) -> tuple[Optional[BaseMessage], int]:
+		"""Decode a list element back to a LangChain message and its token count."""
+		item = self.codec.decode(data)
 
-		Strategy:
-		- Keep system message
-		- Keep most recent messages
-		- Drop oldest messages first
-		"""
-	
-		if not messages:
-			return []
-	
-		# Rough token estimation (4 chars per token)
-		estimated_tokens = sum(len(msg.content) // 4 for msg in messages)
-	
-		if estimated_tokens <= max_tokens:
-			return messages
-	
-		# Keep system message if present
-		system_msgs = [msg for msg in messages if isinstance(msg, SystemMessage)]
-		other_msgs = [msg for msg in messages if not isinstance(msg, SystemMessage)]
-	
-		# Trim from oldest
-		trimmed: list[BaseMessage] = []
-		current_tokens = sum(len(msg.content) // 4 for msg in system_msgs)
-	
-		for msg in reversed(other_msgs):
-			msg_tokens = len(msg.content) // 4
-			if current_tokens + msg_tokens <= max_tokens:
-				trimmed.insert(0, msg)
-				current_tokens += msg_tokens
-			else:
-				break
+		if "t" in item:
+			message_cls = _MESSAGE_CLASSES.get(item["t"])
+			content = item["c"]
+		else:
+			# Elements written as plain JSON before the codec was introduced
+			message_cls = _LEGACY_MESSAGE_CLASSES.get(item["type"])
+			content = item["content"]
 
-		logger.info(f"Trimmed messages from {len(messages)} to {len(trimmed) + len(system_msgs)}")
+		if message_cls is None:
+			return None, 0
 
-		return system_msgs + trimmed
\ No newline at end of file
+		msg = message_cls(content=content)
+		if "n" in item and item.get("f") == self.token_counter.model_family(model):
+			return msg, item["n"]
+		return msg, self.token_counter.count_message(msg, model)
@@ -1,7 +1,7 @@
 from typing import Optional, cast, Any
 
 import logging
-from .valkeyConnect import create_valkey_client
+from .valkeyConnect import create_valkey_client, create_valkey_subscriber
 from .connectQdrant import create_qdrant_client
 from .pgSync import get_conn_str
 from psycopg_pool import AsyncConnectionPool
@@ -9,6 +9,7 @@ from psycopg import AsyncConnection
 from psycopg.rows import dict_row
 from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
 from glide import GlideClient
+from app.utils.file_manager import FILE_STATUS_CHANNEL_PREFIX
 from qdrant_client import AsyncQdrantClient
 
 logger = logging.getLogger(__name__)
@@ -16,6 +17,7 @@ logger = logging.getLogger(__name__)
 class DBRegistry:
 	def __init__(self):
 		self.valkey_client: Optional[GlideClient] = None
+		self.valkey_subscriber: Optional[GlideClient] = None
 		self.qdrant_client: Optional[AsyncQdrantClient] = None
 		self.pg_pool: Optional[AsyncConnectionPool] = None
 		self.checkpointer: Optional[AsyncPostgresSaver] = None
@@ -32,6 +34,13 @@ class DBRegistry:
 			logger.error(f"Failed to initialize Valkey: {e}")
 			# raise
 
+		# Initialize the Valkey subscriber for file status events
+		try:
+			self.valkey_subscriber = await create_valkey_subscriber({f"{FILE_STATUS_CHANNEL_PREFIX}*"})
+			logger.info("Valkey subscriber initialized")
+		except Exception as e:
+			logger.error(f"Failed to initialize Valkey subscriber: {e}")
+
 		# Initialize Qdrant
 		try:
 			self.qdrant_client = create_qdrant_client()
@@ -74,6 +83,10 @@ class DBRegistry:
 			await self.valkey_client.close()
 			logger.info("Valkey client closed")
 
+		if self.valkey_subscriber:
+			await self.valkey_subscriber.close()
+			logger.info("Valkey subscriber closed")
+
 		if self.qdrant_client:
 			# AsyncQdrantClient has a close method
 			await self.qdrant_client.close()
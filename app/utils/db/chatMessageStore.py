@@ -0,0 +1,206 @@
+import asyncio
+import json
+import logging
+import uuid
+from datetime import datetime
+from typing import Any, Optional, TypedDict
+
+from psycopg_pool import AsyncConnectionPool
+
+logger = logging.getLogger(__name__)
+
+class ChatMessageRow(TypedDict):
+	id: int
+	message_id: str
+	user_id: str
+	session_id: str
+	role: str  # "system" | "user" | "assistant"
+	content: str
+	token_count: Optional[int]
+	token_family: Optional[str]
+	file_ids: list[str]
+	created_at: datetime
+
+_CREATE_TABLE = """
+CREATE TABLE IF NOT EXISTS chat_messages (
+	id            BIGSERIAL   PRIMARY KEY,
+	message_id    TEXT        NOT NULL UNIQUE,
+	user_id       TEXT        NOT NULL,
+	session_id    TEXT        NOT NULL,
+	role          TEXT        NOT NULL,
+	content       TEXT        NOT NULL,
+	token_count   INTEGER,
+	token_family  TEXT,
+	file_ids      TEXT[]      NOT NULL DEFAULT '{}',
+	created_at    TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+CREATE INDEX IF NOT EXISTS chat_messages_session_idx ON chat_messages (user_id, session_id, id DESC);
+"""
+
+# Keyset pagination: walk the session backwards from the newest message using the id of the
+# oldest row already read, so every page is an index range scan (no OFFSET)
+_FETCH_TAIL = """
+SELECT id, message_id, user_id, session_id, role, content, token_count, token_family, file_ids, created_at
+FROM chat_messages
+WHERE user_id = %(user_id)s AND session_id = %(session_id)s AND (%(before_id)s::BIGINT IS NULL OR id < %(before_id)s)
+ORDER BY id DESC
+LIMIT %(limit)s
+"""
+
+_INSERT = """
+INSERT INTO chat_messages (message_id, user_id, session_id, role, content, token_count, token_family, file_ids, created_at)
+VALUES (%(message_id)s, %(user_id)s, %(session_id)s, %(role)s, %(content)s, %(token_count)s, %(token_family)s, %(file_ids)s, %(created_at)s)
+ON CONFLICT (message_id) DO NOTHING
+"""
+
+class ChatMessageStore:
+	"""
+	Durable chat history in Postgres (the `chat_messages` table).
+
+	Reads are keyset-paginated from the newest message. Writes are write-behind: `enqueue`
+	only puts the rows on an in-memory queue and a background task inserts them in batches,
+	so Postgres latency never sits in the response path. A failed insert is retried with
+	exponential backoff (inserts are idempotent on message_id), rows are only dropped after
+	`max_retries` attempts or when the queue is full, and counted in `dropped_rows`.
+	"""
+
+	def __init__(
+		self,
+		pool: AsyncConnectionPool,
+		batch_size: int = 100,
+		flush_interval_ms: int = 200,
+		max_queue_size: int = 10_000,
+		max_retries: int = 5,
+		retry_backoff_ms: int = 500,
+		max_retry_backoff_ms: int = 10_000
+	):
+		self.pool = pool
+		self.batch_size = batch_size
+		self.flush_interval = flush_interval_ms / 1000
+		self.max_retries = max_retries
+		self.retry_backoff = retry_backoff_ms / 1000
+		self.max_retry_backoff = max_retry_backoff_ms / 1000
+
+		self._queue: asyncio.Queue[dict[str, Any]] = asyncio.Queue(maxsize=max_queue_size)
+		self._writer_task: Optional[asyncio.Task] = None
+		# Rows taken off the queue by a writer that got cancelled before inserting them
+		self._unflushed: list[dict[str, Any]] = []
+
+		# Metrics
+		self.persisted_rows = 0
+		self.insert_retries = 0
+		self.dropped_rows = 0
+
+	async def setup(self):
+		"""Create the table if missing (idempotent, safe to run on every startup)"""
+		async with self.pool.connection() as conn:
+			await conn.execute(_CREATE_TABLE)
+
+	def start(self):
+		if self._writer_task is None:
+			self._writer_task = asyncio.create_task(self._write_batches())
+
+	async def stop(self):
+		"""Stop the writer after flushing everything still queued"""
+		if self._writer_task:
+			self._writer_task.cancel()
+			try:
+				await self._writer_task
+			except asyncio.CancelledError:
+				pass
+			self._writer_task = None
+
+		remaining, self._unflushed = self._unflushed, []
+		while not self._queue.empty():
+			remaining.append(self._queue.get_nowait())
+		if remaining:
+			await self._insert(remaining)
+
+	async def fetch_tail(self, user_id: str, session_id: str, limit: int = 50, before_id: Optional[int] = None) -> list[ChatMessageRow]:
+		"""The newest `limit` messages older than `before_id`, newest first"""
+		async with self.pool.connection() as conn:
+			cursor = await conn.execute(_FETCH_TAIL, {
+				"user_id": user_id,
+				"session_id": session_id,
+				"before_id": before_id,
+				"limit": limit
+			})
+			return await cursor.fetchall()
+
+	def enqueue(self, user_id: str, session_id: str, role: str, content: Any, token_count: Optional[int] = None, token_family: Optional[str] = None, file_ids: Optional[list[str]] = None):
+		"""Queue a message to be persisted, never waits on Postgres"""
+		row = {
+			"message_id": str(uuid.uuid4()),
+			"user_id": user_id,
+			"session_id": session_id,
+			"role": role,
+			"content": content if isinstance(content, str) else json.dumps(content),
+			"token_count": token_count,
+			"token_family": token_family,
+			"file_ids": file_ids or [],
+			"created_at": datetime.now()
+		}
+
+		try:
+			self._queue.put_nowait(row)
+		except asyncio.QueueFull:
+			self.dropped_rows += 1
+			logger.error(f"Chat message queue is full, dropping message for session {session_id} ({self.dropped_rows} dropped)")
+
+	def stats(self) -> dict[str, int]:
+		return {
+			"queued": self._queue.qsize(),
+			"persisted_rows": self.persisted_rows,
+			"insert_retries": self.insert_retries,
+			"dropped_rows": self.dropped_rows,
+		}
+
+	async def _write_batches(self):
+		loop = asyncio.get_running_loop()
+
+		while True:
+			batch: list[dict[str, Any]] = []
+			try:
+				batch.append(await self._queue.get())
+
+				# Give the batch a short window to fill up before writing it
+				deadline = loop.time() + self.flush_interval
+				while len(batch) < self.batch_size:
+					remaining = deadline - loop.time()
+					if remaining <= 0:
+						break
+					try:
+						batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+					except asyncio.TimeoutError:
+						break
+
+				await self._insert_with_retry(batch)
+
+			except asyncio.CancelledError:
+				# Keep the batch so stop() can flush it
+				self._unflushed.extend(batch)
+				raise
+
+	async def _insert_with_retry(self, rows: list[dict[str, Any]]):
+		"""Insert a batch, retrying transient failures (the queue keeps filling meanwhile, up to its bound)"""
+		backoff = self.retry_backoff
+		for attempt in range(self.max_retries + 1):
+			try:
+				await self._insert(rows)
+				return
+			except Exception as e:
+				if attempt == self.max_retries:
+					self.dropped_rows += len(rows)
+					logger.error(f"Failed to persist {len(rows)} chat messages after {attempt + 1} attempts, dropping them ({self.dropped_rows} dropped): {e}")
+					return
+				self.insert_retries += 1
+				logger.warning(f"Failed to persist {len(rows)} chat messages, retrying in {backoff:.1f}s: {e}")
+				await asyncio.sleep(backoff)
+				backoff = min(self.max_retry_backoff, backoff * 2)
+
+	async def _insert(self, rows: list[dict[str, Any]]):
+		async with self.pool.connection() as conn:
+			async with conn.cursor() as cursor:
+				await cursor.executemany(_INSERT, rows)
+		self.persisted_rows += len(rows)
+		logger.debug(f"Persisted {len(rows)} chat messages")
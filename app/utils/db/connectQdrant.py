@@ -5,10 +5,14 @@ if not load_dotenv():
   raise Exception("Failed to load .env file")
 
 from qdrant_client import AsyncQdrantClient, QdrantClient
-from qdrant_client.http.models import Distance, VectorParams, OptimizersConfigDiff
+from qdrant_client.http.models import Distance, Modifier, SparseVectorParams, VectorParams, OptimizersConfigDiff
 
 logger = logging.getLogger(__name__)
 
+# Chunks also carry a BM25 sparse vector (computed with fastembed) for keyword and hybrid retrieval
+SPARSE_VECTOR_NAME = "bm25"
+SPARSE_EMBEDDING_MODEL = "Qdrant/bm25"
+
 def create_qdrant_client(**kwargs) -> AsyncQdrantClient:
 	"""Creates and returns a new AsyncQdrantClient instance"""
 	return AsyncQdrantClient(url=os.getenv("QDRANT_URL_GRPC"), prefer_grpc=True, host=os.getenv("HOST") or "localhost", **kwargs)
@@ -23,6 +27,8 @@ async def create_qdrant_collection(client: AsyncQdrantClient, collection_name: s
 		await client.create_collection(
 			collection_name=collection_name,
 			vectors_config=config or VectorParams(size=1024, distance=Distance.COSINE),
+			# Qdrant applies the IDF part of BM25 at query time
+			sparse_vectors_config={SPARSE_VECTOR_NAME: SparseVectorParams(modifier=Modifier.IDF)},
 		)
 
 	except Exception as e:
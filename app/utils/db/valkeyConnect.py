@@ -20,3 +20,25 @@ async def create_valkey_client() -> GlideClient:
 		# reconnect_strategy=BackoffStrategy(num_of_retries=5, factor=100)
 	)
 	return await GlideClient.create(config)
+
+async def create_valkey_subscriber(patterns: set[str]) -> GlideClient:
+	"""
+	Creates a dedicated Valkey client subscribed to the given channel patterns.
+	Glide configures subscriptions at connection time and a subscribed connection
+	can't be used for normal commands, so this is kept separate from the main client.
+	"""
+	host = os.getenv("VALKEY_HOST", "localhost")
+	port = int(os.getenv("VALKEY_PORT", 6379))
+
+	addresses = [NodeAddress(host, port)]
+	config = GlideClientConfiguration(
+		addresses=addresses,
+		request_timeout=500,
+		client_name="AI_cache_subscriber",
+		pubsub_subscriptions=GlideClientConfiguration.PubSubSubscriptions(
+			channels_and_patterns={GlideClientConfiguration.PubSubChannelModes.Pattern: patterns},
+			callback=None,
+			context=None
+		)
+	)
+	return await GlideClient.create(config)
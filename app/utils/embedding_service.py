@@ -0,0 +1,168 @@
+"""Batches embedding requests from concurrent coroutines into a single forward pass"""
+
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class EmbeddingService:
+	"""
+	Async front end of an embedding model shared by routing, retrieval and caching.
+
+	Concurrent `encode` calls are queued and a single worker drains the queue into batches of
+	at most `max_batch_size` texts, waiting at most `max_wait_ms` for a batch to fill up. Each
+	batch runs on a dedicated worker thread so the event loop never blocks on the model, and
+	every caller gets back only the rows for its own texts.
+	"""
+
+	def __init__(self, encode_batch: Callable[[list[str]], np.ndarray], name: str = "embeddings", max_batch_size: int = 32, max_wait_ms: float = 5):
+		self.encode_batch = encode_batch
+		self.name = name
+		self.max_batch_size = max_batch_size
+		self.max_wait = max_wait_ms / 1000
+
+		self._queue: asyncio.Queue[tuple[str, asyncio.Future, float]] = asyncio.Queue()
+		self._worker_task: Optional[asyncio.Task] = None
+		self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"{name}-encoder")
+
+		# Metrics
+		self.batches = 0
+		self.items = 0
+		self.total_queue_wait = 0.0
+		self.max_queue_wait = 0.0
+		self.busy_time = 0.0
+
+	@classmethod
+	def from_sentence_transformer(cls, model_name: str, **kwargs) -> "EmbeddingService":
+		"""A service backed by a SentenceTransformer that is loaded the first time a batch runs"""
+		model = None
+		lock = threading.Lock()
+
+		def encode_batch(texts: list[str]) -> np.ndarray:
+			nonlocal model
+			if model is None:
+				with lock:
+					if model is None:
+						from sentence_transformers import SentenceTransformer
+						model = SentenceTransformer(model_name)
+			return model.encode(texts, normalize_embeddings=True, batch_size=len(texts))
+
+		return cls(encode_batch, name=model_name, **kwargs)
+
+	@classmethod
+	def from_onnx(cls, model_name: str, quantize: bool = True, **kwargs) -> "EmbeddingService":
+		"""A service backed by the (int8 quantized) ONNX Runtime export of the model, for CPU-only nodes"""
+		from app.utils.onnx_embeddings import OnnxEncoder
+		# The name keys the embedding caches, int8 vectors must not be mixed with the fp32 ones
+		return cls(OnnxEncoder(model_name, quantize=quantize), name=f"{model_name}@onnx{'-int8' if quantize else ''}", **kwargs)
+
+	@classmethod
+	def create(cls, model_name: str, backend: Optional[str] = None, **kwargs) -> "EmbeddingService":
+		"""A service on the configured backend (EMBEDDING_BACKEND, "torch" or "onnx")"""
+		from app.utils.onnx_embeddings import EMBEDDING_BACKEND
+		if (backend or EMBEDDING_BACKEND) == "onnx":
+			return cls.from_onnx(model_name, **kwargs)
+		return cls.from_sentence_transformer(model_name, **kwargs)
+
+	async def encode(self, texts: list[str]) -> np.ndarray:
+		"""Embed the texts, returns one (normalized) row per text"""
+		if not texts:
+			return np.empty((0, 0), dtype=np.float32)
+
+		if self._worker_task is None:
+			self._worker_task = asyncio.create_task(self._run())
+
+		loop = asyncio.get_running_loop()
+		futures: list[asyncio.Future] = []
+		for text in texts:
+			future = loop.create_future()
+			self._queue.put_nowait((text, future, loop.time()))
+			futures.append(future)
+
+		return np.stack(await asyncio.gather(*futures))
+
+	def encode_now(self, texts: list[str]) -> np.ndarray:
+		"""Synchronous encode that bypasses the queue, for startup work outside the event loop"""
+		return np.asarray(self.encode_batch(texts), dtype=np.float32)
+
+	async def stop(self):
+		if self._worker_task:
+			self._worker_task.cancel()
+			try:
+				await self._worker_task
+			except asyncio.CancelledError:
+				pass
+			self._worker_task = None
+
+		while not self._queue.empty():
+			_, future, _ = self._queue.get_nowait()
+			if not future.done():
+				future.set_exception(RuntimeError(f"{self.name} embedding service stopped"))
+
+		self._executor.shutdown(wait=False)
+
+	def stats(self) -> dict[str, float]:
+		return {
+			"batches": self.batches,
+			"items": self.items,
+			"avg_batch_size": self.items / self.batches if self.batches else 0.0,
+			"avg_queue_wait_ms": self.total_queue_wait / self.items * 1000 if self.items else 0.0,
+			"max_queue_wait_ms": self.max_queue_wait * 1000,
+			"throughput_per_s": self.items / self.busy_time if self.busy_time else 0.0,
+			"queue_depth": self._queue.qsize()
+		}
+
+	async def _run(self):
+		loop = asyncio.get_running_loop()
+
+		while True:
+			batch = [await self._queue.get()]
+
+			deadline = loop.time() + self.max_wait
+			while len(batch) < self.max_batch_size:
+				# Take whatever is already queued without waiting, then wait out the rest of the window
+				if not self._queue.empty():
+					batch.append(self._queue.get_nowait())
+					continue
+				remaining = deadline - loop.time()
+				if remaining <= 0:
+					break
+				try:
+					batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+				except asyncio.TimeoutError:
+					break
+
+			# Callers that gave up (cancelled) don't need their text encoded
+			batch = [item for item in batch if not item[1].done()]
+			if not batch:
+				continue
+
+			started = loop.time()
+			for _, _, enqueued_at in batch:
+				wait = started - enqueued_at
+				self.total_queue_wait += wait
+				self.max_queue_wait = max(self.max_queue_wait, wait)
+
+			try:
+				perf_start = time.perf_counter()
+				vectors = await loop.run_in_executor(self._executor, self.encode_batch, [text for text, _, _ in batch])
+				self.busy_time += time.perf_counter() - perf_start
+			except Exception as e:
+				logger.error(f"Embedding batch of {len(batch)} failed: {e}")
+				for _, future, _ in batch:
+					if not future.done():
+						future.set_exception(e)
+				continue
+
+			self.batches += 1
+			self.items += len(batch)
+
+			for (_, future, _), vector in zip(batch, vectors):
+				if not future.done():
+					future.set_result(np.asarray(vector, dtype=np.float32))
@@ -0,0 +1,87 @@
+"""Query embeddings shared by retrieval and routing, with an in-process + Valkey cache"""
+
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+
+import numpy as np
+from glide import ExpirySet, ExpiryType, GlideClient
+
+logger = logging.getLogger(__name__)
+
+# We are using Qwen/Qwen3-Embedding-0.6B for the user documents collection (1024 dims)
+RETRIEVAL_EMBEDDING_MODEL = "Qwen/Qwen3-Embedding-0.6B"
+QUERY_EMBEDDING_TTL = 86400
+
+def normalize_query(text: str) -> str:
+	"""Lowercase and collapse whitespace so trivially different queries share a cache entry"""
+	return " ".join(text.lower().split())
+
+class CachedEmbedder:
+	"""
+	Embeds queries through `encode_fn` (usually `EmbeddingService.encode`) and caches the vectors.
+
+	Lookup order: in-process LRU -> Valkey -> `encode_fn`. Keys are a hash of the normalized
+	query, so repeated and follow-up questions skip the embedding model entirely.
+	Vectors are stored in Valkey as raw float32 bytes.
+	"""
+
+	def __init__(
+		self,
+		model_name: str,
+		encode_fn: Callable[[list[str]], Awaitable[np.ndarray]],
+		valkey_client: Optional[GlideClient] = None,
+		lru_size: int = 10_000
+	):
+		self.model_name = model_name
+		self.encode_fn = encode_fn
+		self.valkey_client = valkey_client
+		self.lru_size = lru_size
+
+		self._lru: OrderedDict[str, np.ndarray] = OrderedDict()
+
+		self.hits = 0
+		self.valkey_hits = 0
+		self.misses = 0
+
+	async def embed(self, text: str) -> np.ndarray:
+		key = self._cache_key(text)
+
+		cached = self._lru.get(key)
+		if cached is not None:
+			self._lru.move_to_end(key)
+			self.hits += 1
+			return cached
+
+		if self.valkey_client is not None:
+			try:
+				data = await self.valkey_client.get(key)
+				if data:
+					vector = np.frombuffer(data, dtype=np.float32)
+					self._remember(key, vector)
+					self.valkey_hits += 1
+					return vector
+			except Exception as e:
+				logger.warning(f"Failed to read cached query embedding: {e}")
+
+		self.misses += 1
+		vector = np.asarray((await self.encode_fn([text]))[0], dtype=np.float32)
+		self._remember(key, vector)
+
+		if self.valkey_client is not None:
+			try:
+				await self.valkey_client.set(key, vector.tobytes(), expiry=ExpirySet(ExpiryType.SEC, QUERY_EMBEDDING_TTL))
+			except Exception as e:
+				logger.warning(f"Failed to cache query embedding: {e}")
+
+		return vector
+
+	def _cache_key(self, text: str) -> str:
+		digest = hashlib.sha256(normalize_query(text).encode()).hexdigest()
+		return f"query_embedding:{self.model_name}:{digest}"
+
+	def _remember(self, key: str, vector: np.ndarray):
+		self._lru[key] = vector
+		if len(self._lru) > self.lru_size:
+			self._lru.popitem(last=False)
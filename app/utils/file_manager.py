@@ -5,20 +5,62 @@ import logging
 import json
 from typing import Any, Optional
 
-from glide import ExpirySet, ExpiryType, GlideClient
+from glide import Batch, GlideClient, RequestError, Script
+
+from app.utils.codec import ValueCodec
 
 logger = logging.getLogger(__name__)
 
+# Status changes are published on "file_status_events:<file_id>"
+FILE_STATUS_CHANNEL_PREFIX = "file_status_events:"
+TERMINAL_FILE_STATUSES = ("ready", "failed")
+FILE_STATUS_TTL = 86400
+
+# The fields read back by get_file_status(es). Workers may store extra fields through **kwargs
+# but the chat path never needs them so they are not fetched.
+STATUS_FIELDS = ("status", "progress", "message", "s3_uri", "filename", "file_name", "mime_type", "size_bytes", "created_at", "completed_at")
+
+# Merges the new fields into the status hash, refreshes the TTL and publishes the full status,
+# all in one atomic round trip. Every hash value is JSON encoded so the types survive (these are
+# small scalars, msgpack would not make them any smaller).
+# Statuses written before the hash layout were a single JSON string, those are converted in place.
+#   KEYS[1] = status hash, ARGV[1] = events channel, ARGV[2] = ttl, ARGV[3] = created_at, ARGV[4..] = field, value, ...
+_UPDATE_STATUS_SCRIPT = Script("""
+if redis.call('TYPE', KEYS[1]).ok == 'string' then
+	local legacy = cjson.decode(redis.call('GET', KEYS[1]))
+	redis.call('DEL', KEYS[1])
+	for field, value in pairs(legacy) do
+		redis.call('HSET', KEYS[1], field, cjson.encode(value))
+	end
+end
+
+redis.call('HSETNX', KEYS[1], 'created_at', ARGV[3])
+redis.call('HSET', KEYS[1], unpack(ARGV, 4))
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+
+local fields = redis.call('HGETALL', KEYS[1])
+local status = {}
+for i = 1, #fields, 2 do
+	status[fields[i]] = fields[i + 1]
+end
+-- Version byte 0x01 (see app/utils/codec.py) followed by a msgpack map
+redis.call('PUBLISH', ARGV[1], string.char(1) .. cmsgpack.pack(status))
+return 1
+""")
+
 class FileManager:
 	"""
 	Manages file processing status.
 
 	Uses Valkey for fast lookups.
 	Ingestion workers update status in Valkey as they process files.
+	Each status is a Valkey hash (one JSON encoded value per field) so updates only
+	touch the fields that changed and never race with other workers.
 	"""
 
-	def __init__(self, valkey_client: GlideClient):
+	def __init__(self, valkey_client: GlideClient, codec: Optional[ValueCodec] = None):
 		self.valkey_client = valkey_client
+		self.codec = codec or ValueCodec()
 		logger.info(f"FileManager initialized")
 
 	async def get_file_status(self, file_id: str) -> dict[str, Any]:
@@ -40,28 +82,35 @@ class FileManager:
 			"completed_at": str | None
 		}
 		"""
-		key = f"file_status:{file_id}"
-		data = await self.valkey_client.get(key)
+		statuses = await self.get_file_statuses([file_id])
+		return statuses[file_id]
 
-		if data:
-			try:
-				return json.loads(data)
-			except json.JSONDecodeError:
-				logger.error(f"Failed to decode JSON for key {key}")
-				return {}
-		else:
-			return {
-				"file_id": file_id,
-				"status": "pending",
-				"progress": 0.0,
-				"message": "File not found in the cache",
-				"s3_uri": "",
-				"filename": "unknown",
-				"mime_type": "",
-				"size_bytes": 0,
-				"created_at": datetime.now().isoformat(),
-				"completed_at": None
-			}
+	async def get_file_statuses(self, file_ids: list[str]) -> dict[str, dict[str, Any]]:
+		"""
+		Get processing status of many files in a single round trip (pipelined HMGETs).
+		Returns a dictionary keyed by file_id, each value has the same shape
+		(and the same defaults for missing files) as `get_file_status`.
+		"""
+		# dict.fromkeys removes duplicates while keeping the order of the request
+		unique_ids = list(dict.fromkeys(file_ids))
+		if not unique_ids:
+			return {}
+
+		batch = Batch(is_atomic=False)
+		for file_id in unique_ids:
+			batch.hmget(self._status_key(file_id), list(STATUS_FIELDS))
+
+		results = await self.valkey_client.exec(batch, raise_on_error=False) or []
+
+		statuses: dict[str, dict[str, Any]] = {}
+		for file_id, values in zip(unique_ids, results):
+			if isinstance(values, RequestError):
+				# WRONGTYPE: the status was written as a JSON string before the hash layout
+				statuses[file_id] = await self._get_legacy_status(file_id)
+			else:
+				statuses[file_id] = self._decode_status(file_id, values)
+
+		return statuses
 
 	async def update_file_status(self, file_id: str, status: str, progress: float = 0.0, message: str = "", **kwargs):
 		"""
@@ -69,41 +118,22 @@ class FileManager:
 		Called by Ingestion Workers
 		"""
 
-		key = f"file_status:{file_id}"
-		existing_data = await self.valkey_client.get(key)
-
-		if existing_data:
-			try:
-				data = json.loads(existing_data)
-			except:
-				logger.error(f"Failed to decode JSON for key {key}")
-				return {}
-		else:
-			data = {
-				"file_id": file_id,
-				"status": "pending",
-				"progress": 0.0,
-				"message": "",
-				"s3_uri": "",
-				"file_name": "unknown",
-				"mime_type": "",
-				"size_bytes": 0,
-				"created_at": datetime.now().isoformat(),
-				"completed_at": None
-			}
-
-		# Updating the fields
-		data.update({
+		fields: dict[str, Any] = {
+			"file_id": file_id,
 			"status": status,
 			"progress": progress,
 			"message": message,
 			**kwargs
-		})
+		}
 
-		if status in ["ready", "failed"]:
-			data["completed_at"] = datetime.now().isoformat()
+		if status in TERMINAL_FILE_STATUSES:
+			fields["completed_at"] = datetime.now().isoformat()
 
-		await self.valkey_client.set(key, json.dumps(data), expiry=ExpirySet(ExpiryType.SEC, 86400))
+		args = [self._events_channel(file_id), str(FILE_STATUS_TTL), json.dumps(datetime.now().isoformat())]
+		for field, value in fields.items():
+			args.extend((field, json.dumps(value)))
+
+		await self.valkey_client.invoke_script(_UPDATE_STATUS_SCRIPT, keys=[self._status_key(file_id)], args=args)
 		logger.info(f"Updated file status: {file_id} -> {status} ({progress*100:.1f}%)")
 
 	async def register_file(self, file_id: str, s3_uri: str, file_name: str, mime_type: str, size_bytes: str):
@@ -117,4 +147,58 @@ class FileManager:
 			file_name=file_name,
 			mime_type=mime_type,
 			size_bytes=size_bytes
-		)
\ No newline at end of file
+		)
+
+	def decode_event(self, file_id: str, message: bytes | str) -> dict[str, Any]:
+		"""Decode a status published by the update script (a map of JSON encoded fields)"""
+		fields: dict[str, str] = self.codec.decode(message)
+		return self._decode_status(file_id, [fields.get(field) for field in STATUS_FIELDS])
+
+	def _status_key(self, file_id: str) -> str:
+		return f"file_status:{file_id}"
+
+	def _events_channel(self, file_id: str) -> str:
+		return f"{FILE_STATUS_CHANNEL_PREFIX}{file_id}"
+
+	def _decode_status(self, file_id: str, values: list[Optional[bytes | str]]) -> dict[str, Any]:
+		"""Decode HMGET values of STATUS_FIELDS, falling back to a "pending" status if the file is not in valkey"""
+		if all(value is None for value in values):
+			return self._default_status(file_id)
+
+		status = self._default_status(file_id)
+		status["message"] = ""
+		for field, value in zip(STATUS_FIELDS, values):
+			if value is None:
+				continue
+			try:
+				status[field] = json.loads(value)
+			except json.JSONDecodeError:
+				logger.error(f"Failed to decode field {field} for key {self._status_key(file_id)}")
+
+		return status
+
+	async def _get_legacy_status(self, file_id: str) -> dict[str, Any]:
+		key = self._status_key(file_id)
+		data = await self.valkey_client.get(key)
+
+		if not data:
+			return self._default_status(file_id)
+		try:
+			return json.loads(data)
+		except json.JSONDecodeError:
+			logger.error(f"Failed to decode JSON for key {key}")
+			return {}
+
+	def _default_status(self, file_id: str) -> dict[str, Any]:
+		return {
+			"file_id": file_id,
+			"status": "pending",
+			"progress": 0.0,
+			"message": "File not found in the cache",
+			"s3_uri": "",
+			"filename": "unknown",
+			"mime_type": "",
+			"size_bytes": 0,
+			"created_at": datetime.now().isoformat(),
+			"completed_at": None
+		}
@@ -0,0 +1,121 @@
+"""Streams file processing status changes published by the ingestion workers"""
+
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Optional
+
+from glide import GlideClient
+
+from app.utils.file_manager import FILE_STATUS_CHANNEL_PREFIX, TERMINAL_FILE_STATUSES, FileManager
+
+logger = logging.getLogger(__name__)
+
+class FileStatusWatcher:
+	"""
+	Fans out file status events to the requests waiting on them.
+
+	One subscriber connection (pattern "file_status_events:*") is shared by the whole
+	process. A background task reads every published status and hands it to the queues
+	of the requests that are watching that file_id.
+	"""
+
+	def __init__(self, subscriber_client: GlideClient, file_manager: FileManager):
+		self.subscriber_client = subscriber_client
+		self.file_manager = file_manager
+
+		self._watchers: dict[str, set[asyncio.Queue[dict[str, Any]]]] = {}
+		self._reader_task: Optional[asyncio.Task] = None
+
+		logger.info("FileStatusWatcher initialized")
+
+	def start(self):
+		"""Start reading published status messages"""
+		if self._reader_task is None:
+			self._reader_task = asyncio.create_task(self._read_messages())
+
+	async def stop(self):
+		if self._reader_task:
+			self._reader_task.cancel()
+			try:
+				await self._reader_task
+			except asyncio.CancelledError:
+				pass
+			self._reader_task = None
+
+	async def watch(self, file_ids: list[str], timeout: float) -> AsyncIterator[dict[str, Any]]:
+		"""
+		Yield the status of the given files every time one changes, until all of them
+		are ready/failed or the timeout (seconds) runs out.
+
+		The current status of every file is yielded first so nothing published between
+		the caller's last read and the subscription is missed.
+		"""
+		unique_ids = list(dict.fromkeys(file_ids))
+		if not unique_ids:
+			return
+
+		queue: asyncio.Queue[dict[str, Any]] = asyncio.Queue()
+
+		# Register before taking the snapshot, otherwise an update could land in between
+		for file_id in unique_ids:
+			self._watchers.setdefault(file_id, set()).add(queue)
+
+		try:
+			pending = set(unique_ids)
+			for file_id, status in (await self.file_manager.get_file_statuses(unique_ids)).items():
+				yield {**status, "file_id": file_id}
+				if status.get("status") in TERMINAL_FILE_STATUSES:
+					pending.discard(file_id)
+
+			loop = asyncio.get_running_loop()
+			deadline = loop.time() + timeout
+
+			while pending:
+				remaining = deadline - loop.time()
+				if remaining <= 0:
+					logger.warning(f"Timed out waiting for files: {sorted(pending)}")
+					return
+
+				try:
+					status = await asyncio.wait_for(queue.get(), timeout=remaining)
+				except asyncio.TimeoutError:
+					continue
+
+				yield status
+				if status.get("status") in TERMINAL_FILE_STATUSES:
+					pending.discard(status["file_id"])
+
+		finally:
+			for file_id in unique_ids:
+				queues = self._watchers.get(file_id)
+				if queues is not None:
+					queues.discard(queue)
+					if not queues:
+						del self._watchers[file_id]
+
+	async def _read_messages(self):
+		while True:
+			try:
+				msg = await self.subscriber_client.get_pubsub_message()
+			except asyncio.CancelledError:
+				raise
+			except Exception as e:
+				logger.error(f"Error reading file status events: {e}")
+				await asyncio.sleep(1)
+				continue
+
+			channel = msg.channel.decode() if isinstance(msg.channel, bytes) else msg.channel
+			file_id = channel.removeprefix(FILE_STATUS_CHANNEL_PREFIX)
+
+			queues = self._watchers.get(file_id)
+			if not queues:
+				continue
+
+			try:
+				status = self.file_manager.decode_event(file_id, msg.message)
+			except (ValueError, RuntimeError):
+				logger.error(f"Failed to decode status event for file {file_id}")
+				continue
+
+			for queue in queues:
+				queue.put_nowait(status)
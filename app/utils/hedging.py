@@ -0,0 +1,255 @@
+"""Hedged generations: a stream that is slow to start is raced against the same request on the fallback model"""
+
+import asyncio
+import logging
+import os
+import re
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Optional, Sequence
+
+import numpy as np
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models import BaseChatModel, LanguageModelInput
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.runnables import Runnable, RunnableBinding
+from pydantic import Field
+
+logger = logging.getLogger(__name__)
+
+# Set to 0 to never hedge
+HEDGING = os.getenv("HEDGING", "1") != "0"
+# At most this fraction of the requests start a hedge (plus a burst of HEDGE_BURST)
+HEDGE_MAX_RATE = float(os.getenv("HEDGE_MAX_RATE", 0.05))
+HEDGE_BURST = float(os.getenv("HEDGE_BURST", 2))
+# The threshold is the TTFT percentile of the model, within these bounds
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", 95))
+HEDGE_MIN_MS = float(os.getenv("HEDGE_MIN_MS", 250))
+HEDGE_MAX_MS = float(os.getenv("HEDGE_MAX_MS", 10_000))
+# Used until a model has HEDGE_MIN_SAMPLES TTFT samples
+HEDGE_DEFAULT_MS = float(os.getenv("HEDGE_DEFAULT_MS", 3000))
+HEDGE_MIN_SAMPLES = 20
+
+class HedgePolicy:
+	"""
+	When to hedge: the time to first token of every model is sampled, a request hedges once it waited
+	longer than the model's p95 TTFT. Hedges are paid from a token bucket that gains HEDGE_MAX_RATE per
+	request, so hedging can't add more than that fraction of load even when every backend is slow.
+	"""
+
+	def __init__(self, max_rate: float = HEDGE_MAX_RATE, burst: float = HEDGE_BURST, percentile: float = HEDGE_PERCENTILE):
+		self.max_rate = max_rate
+		self.burst = burst
+		self.percentile = percentile
+
+		self._ttft: dict[str, deque[float]] = {}
+		self._tokens = burst
+
+		# Metrics
+		self.requests = 0
+		self.hedges = 0
+		self.hedge_wins = 0
+		self.throttled = 0
+
+	def record_request(self):
+		self.requests += 1
+		self._tokens = min(self.burst, self._tokens + self.max_rate)
+
+	def record_ttft(self, model: str, seconds: float):
+		self._ttft.setdefault(model, deque(maxlen=500)).append(seconds)
+
+	def threshold(self, model: str) -> float:
+		"""Seconds to wait for the first token of `model` before hedging"""
+		samples = self._ttft.get(model)
+		if not samples or len(samples) < HEDGE_MIN_SAMPLES:
+			return HEDGE_DEFAULT_MS / 1000
+		value = float(np.percentile(samples, self.percentile))
+		return min(HEDGE_MAX_MS / 1000, max(HEDGE_MIN_MS / 1000, value))
+
+	def try_hedge(self) -> bool:
+		if self._tokens < 1:
+			self.throttled += 1
+			return False
+		self._tokens -= 1
+		self.hedges += 1
+		return True
+
+	def stats(self) -> dict[str, Any]:
+		return {
+			"requests": self.requests,
+			"hedges": self.hedges,
+			"hedge_rate": self.hedges / self.requests if self.requests else 0.0,
+			"hedge_wins": self.hedge_wins,
+			"throttled": self.throttled,
+			"threshold_ms": {model: self.threshold(model) * 1000 for model in self._ttft},
+		}
+
+hedge_policy = HedgePolicy()
+
+def model_size(model: str) -> Optional[float]:
+	"""Billions of parameters from the tag of an Ollama model name (qwen3-vl:4b -> 4.0), None without one"""
+	match = re.search(r":(\d+(?:\.\d+)?)b\b", model.lower())
+	return float(match.group(1)) if match else None
+
+def can_hedge_on(primary: str, fallback: str) -> bool:
+	"""A hedge must not be slower than what it races: never onto a model with more parameters than the primary"""
+	primary_size, fallback_size = model_size(primary), model_size(fallback)
+	if primary_size is None or fallback_size is None:
+		return True
+	return fallback_size <= primary_size
+
+class HedgedChatModel(BaseChatModel):
+	"""
+	Streams from `primary`. If its first chunk takes longer than the policy threshold (and the hedge budget
+	allows it), the same request starts on `fallback`; the first of the two to produce a chunk is streamed
+	and the other one is cancelled. An error before the first chunk also hands over to the other stream.
+
+	The models are driven through their `_astream`, without callbacks, so only the chunks of the winner
+	reach the callbacks (and the "messages" stream of the graph).
+	Tools (and tool_choice) are bound by each model's own `bind_tools`. `keep_alive` only goes to the
+	primary, the fallback gets `fallback_keep_alive` instead.
+	"""
+
+	primary: BaseChatModel
+	fallback: BaseChatModel
+	primary_name: str
+	fallback_name: str
+	policy: Any = None # HedgePolicy, the shared one when not set
+	# Bound by bind_tools, each model's own format of the tools
+	primary_kwargs: dict[str, Any] = Field(default_factory=dict)
+	fallback_kwargs: dict[str, Any] = Field(default_factory=dict)
+
+	@property
+	def _llm_type(self) -> str:
+		return "hedged"
+
+	@property
+	def _identifying_params(self) -> dict[str, Any]:
+		return {"primary": self.primary_name, "fallback": self.fallback_name}
+
+	def bind_tools(self, tools: Sequence[Any], *, tool_choice: Optional[Any] = None, **kwargs: Any) -> Runnable[LanguageModelInput, BaseMessage]:
+		hedged = self.model_copy(update={
+			"primary_kwargs": _bound_kwargs(self.primary.bind_tools(tools, tool_choice=tool_choice)),
+			"fallback_kwargs": _bound_kwargs(self.fallback.bind_tools(tools, tool_choice=tool_choice)),
+		})
+		return hedged.bind(**kwargs)
+
+	def _model_kwargs(self, kwargs: dict[str, Any]) -> tuple[dict[str, Any], dict[str, Any]]:
+		"""The call kwargs of the primary and of the fallback"""
+		kwargs = dict(kwargs)
+		fallback_keep_alive = kwargs.pop("fallback_keep_alive", None)
+		primary_kwargs = {**self.primary_kwargs, **kwargs}
+		fallback_kwargs = {**self.fallback_kwargs, **{name: value for name, value in kwargs.items() if name != "keep_alive"}}
+		if fallback_keep_alive is not None:
+			fallback_kwargs["keep_alive"] = fallback_keep_alive
+		return primary_kwargs, fallback_kwargs
+
+	async def _astream(
+		self,
+		messages: list[BaseMessage],
+		stop: Optional[list[str]] = None,
+		run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+		**kwargs: Any
+	) -> AsyncIterator[ChatGenerationChunk]:
+		policy: HedgePolicy = self.policy or hedge_policy
+		policy.record_request()
+		start = time.perf_counter()
+		primary_kwargs, fallback_kwargs = self._model_kwargs(kwargs)
+
+		streams = {self.primary_name: self.primary._astream(messages, stop, None, **primary_kwargs)}
+		firsts = {self.primary_name: asyncio.ensure_future(anext(streams[self.primary_name]))}
+		winner: Optional[str] = None
+		first: Optional[ChatGenerationChunk] = None
+		errors: dict[str, BaseException] = {}
+
+		try:
+			threshold = policy.threshold(self.primary_name)
+			done, _ = await asyncio.wait(firsts.values(), timeout=threshold)
+			if not done and policy.try_hedge():
+				logger.info(f"No token from {self.primary_name} after {threshold * 1000:.0f}ms, hedging on {self.fallback_name}")
+				streams[self.fallback_name] = self.fallback._astream(messages, stop, None, **fallback_kwargs)
+				firsts[self.fallback_name] = asyncio.ensure_future(anext(streams[self.fallback_name]))
+
+			# The first stream to produce a chunk wins, a failed stream leaves the race
+			pending = set(firsts.values())
+			while pending and winner is None:
+				done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+				for name, task in firsts.items():
+					if task not in done or winner is not None:
+						continue
+					if task.exception() is None:
+						winner, first = name, task.result()
+					elif isinstance(task.exception(), StopAsyncIteration):
+						winner = name # an empty answer is still an answer
+					else:
+						errors[name] = task.exception() # type: ignore[assignment]
+						logger.warning(f"{name} failed before its first token: {errors[name]}")
+
+			if winner is None:
+				raise errors.get(self.primary_name) or next(iter(errors.values()))
+
+			policy.record_ttft(winner, time.perf_counter() - start)
+			if winner != self.primary_name:
+				policy.hedge_wins += 1
+				# Only a lower bound of the primary's TTFT, still better than dropping the slow sample
+				policy.record_ttft(self.primary_name, time.perf_counter() - start)
+		finally:
+			# Cancel the loser (or both, when the consumer went away mid race)
+			for name, task in firsts.items():
+				if name != winner:
+					await _cancel(task, streams[name])
+
+		try:
+			if first is None:
+				return # the winner ended without a chunk, its stream is still closed below
+			if run_manager:
+				await run_manager.on_llm_new_token(first.text, chunk=first)
+			yield first
+
+			async for chunk in streams[winner]:
+				if run_manager:
+					await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+				yield chunk
+		finally:
+			await streams[winner].aclose() # type: ignore[attr-defined]
+
+	async def _agenerate(
+		self,
+		messages: list[BaseMessage],
+		stop: Optional[list[str]] = None,
+		run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+		**kwargs: Any
+	) -> ChatResult:
+		result: Optional[ChatGenerationChunk] = None
+		async for chunk in self._astream(messages, stop, run_manager, **kwargs):
+			result = chunk if result is None else result + chunk
+		if result is None:
+			# An empty answer
+			return ChatResult(generations=[ChatGeneration(message=AIMessage(content=""))])
+		return ChatResult(generations=[ChatGeneration(message=result.message, generation_info=result.generation_info)])
+
+	def _generate(
+		self,
+		messages: list[BaseMessage],
+		stop: Optional[list[str]] = None,
+		run_manager: Optional[CallbackManagerForLLMRun] = None,
+		**kwargs: Any
+	) -> ChatResult:
+		# Sync calls are not hedged
+		return self.primary._generate(messages, stop, run_manager, **self._model_kwargs(kwargs)[0])
+
+def _bound_kwargs(runnable: Runnable) -> dict[str, Any]:
+	return dict(runnable.kwargs) if isinstance(runnable, RunnableBinding) else {}
+
+async def _cancel(task: asyncio.Future, stream: AsyncIterator[ChatGenerationChunk]):
+	"""Stops a stream and its pending `anext` (the generator can only be closed once that has stopped)"""
+	task.cancel()
+	try:
+		await task
+	except (asyncio.CancelledError, Exception):
+		pass
+	try:
+		await stream.aclose() # type: ignore[attr-defined]
+	except (asyncio.CancelledError, Exception):
+		pass
@@ -0,0 +1,79 @@
+"""Chat model clients and tokenizers created on first use and shared by every graph node"""
+
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Optional
+
+from app.utils.token_counter import TokenCounter, token_counter
+
+if TYPE_CHECKING:
+	from langchain_core.language_models import BaseChatModel
+
+logger = logging.getLogger(__name__)
+
+# Set to 0 to skip the background warm-up after the server starts
+MODEL_WARMUP = os.getenv("MODEL_WARMUP", "1") != "0"
+
+class ModelRegistry:
+	"""
+	One chat client per (model, parameters), built the first time a node asks for it with the provider
+	of the model (see app/utils/providers.py). Importing the graph no longer imports langchain_ollama or
+	loads tokenizers, `warm_up` does the same work ahead of the first request once the server is listening.
+	"""
+
+	def __init__(self, counter: Optional[TokenCounter] = None):
+		self.counter = counter or token_counter
+
+		self._chat_models: dict[tuple[str, str], "BaseChatModel"] = {}
+		self._lock = threading.Lock()
+
+	def chat_model(self, model: str, **params: Any) -> "BaseChatModel":
+		key = (model, json.dumps(params, sort_keys=True, default=str))
+
+		chat_model = self._chat_models.get(key)
+		if chat_model is None:
+			with self._lock:
+				chat_model = self._chat_models.get(key)
+				if chat_model is None:
+					from app.utils.providers import create_chat_model
+
+					chat_model = create_chat_model(model, **params)
+					self._chat_models[key] = chat_model
+		return chat_model
+
+	def register(self, model: str, chat_model: Any, **params: Any):
+		"""Use an already built client for (model, params), e.g. another provider or a fake model in benchmarks"""
+		with self._lock:
+			self._chat_models[(model, json.dumps(params, sort_keys=True, default=str))] = chat_model
+
+	def tokenizer(self, model: Optional[str]):
+		"""Loads the tokenizer of the model family (shared by every model of the family)"""
+		return self.counter.tokenizer(model)
+
+	async def warm_up(self, models: list[str], **params: Any):
+		"""Builds the clients and loads the tokenizers of `models` on a worker thread"""
+		def load():
+			for model in models:
+				start = time.perf_counter()
+				try:
+					self.chat_model(model, **params)
+					self.tokenizer(model)
+				except Exception as e:
+					logger.warning(f"Failed to warm up {model}: {e}")
+					continue
+				logger.info(f"Warmed up {model} in {(time.perf_counter() - start) * 1000:.0f}ms")
+			# Messages counted without a model use the default family
+			self.tokenizer(None)
+
+		await asyncio.to_thread(load)
+
+	def start_warm_up(self, models: list[str], **params: Any) -> Optional[asyncio.Task]:
+		if not MODEL_WARMUP:
+			return None
+		return asyncio.create_task(self.warm_up(models, **params))
+
+model_registry = ModelRegistry()
@@ -0,0 +1,173 @@
+"""Keeps the chat models resident in Ollama: preload, residency polling and traffic based keep_alive"""
+
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Callable, Optional
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://127.0.0.1:11434")
+RESIDENCY_POLL_INTERVAL = float(os.getenv("RESIDENCY_POLL_INTERVAL", 15))
+
+# keep_alive bounds in seconds (Ollama's own default is 5 minutes)
+MIN_KEEP_ALIVE = int(os.getenv("MIN_KEEP_ALIVE", 300))
+MAX_KEEP_ALIVE = int(os.getenv("MAX_KEEP_ALIVE", 3600))
+# Traffic older than this is forgotten
+TRAFFIC_WINDOW = 3600
+
+class ModelResidencyManager:
+	"""
+	Tracks which models Ollama has in memory and keeps the busy ones there.
+
+	- `start` preloads the models (an empty /api/generate loads a model) and polls /api/ps.
+	- `keep_alive` is sent with every request: twice the average gap between the recent requests of the
+	  model, clamped to [MIN_KEEP_ALIVE, MAX_KEEP_ALIVE], so a model used every 10 minutes is not unloaded
+	  after 5 while a model nobody uses goes back to the minimum.
+	- `is_warm` tells the ModelRouter which models answer without a cold load.
+	"""
+
+	def __init__(
+		self,
+		models: Optional[list[str]] = None,
+		host: str = OLLAMA_HOST,
+		poll_interval: float = RESIDENCY_POLL_INTERVAL,
+		clock: Callable[[], float] = time.monotonic
+	):
+		self.models = list(models or [])
+		self.host = host.rstrip("/")
+		self.poll_interval = poll_interval
+		self.clock = clock
+
+		self.resident: dict[str, float] = {} # model -> when Ollama unloads it (clock time, inf when unknown)
+		self._requests: dict[str, deque[float]] = {}
+		self._session: Optional[aiohttp.ClientSession] = None
+		self._poll_task: Optional[asyncio.Task] = None
+
+		# Metrics
+		self.polls = 0
+		self.poll_failures = 0
+		self.preloads = 0
+
+	@property
+	def started(self) -> bool:
+		return self._session is not None
+
+	async def start(self, models: Optional[list[str]] = None, preload: bool = True):
+		if models is not None:
+			self.models = list(models)
+		if self._session is None:
+			self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=120))
+
+		await self.poll()
+		if preload:
+			await asyncio.gather(*(self.preload(model) for model in self.models if not self.is_warm(model)))
+
+		if self._poll_task is None:
+			self._poll_task = asyncio.create_task(self._poll_loop())
+
+	async def stop(self):
+		if self._poll_task:
+			self._poll_task.cancel()
+			try:
+				await self._poll_task
+			except asyncio.CancelledError:
+				pass
+			self._poll_task = None
+
+		if self._session:
+			await self._session.close()
+			self._session = None
+
+	async def preload(self, model: str):
+		"""Loads the model into Ollama's memory without generating anything"""
+		assert self._session is not None
+		keep_alive = self.keep_alive(model)
+		start = time.perf_counter()
+		try:
+			async with self._session.post(f"{self.host}/api/generate", json={"model": model, "keep_alive": keep_alive}) as resp:
+				resp.raise_for_status()
+				await resp.read()
+		except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+			logger.warning(f"Failed to preload {model}: {e}")
+			return
+
+		self.preloads += 1
+		self.resident[model] = self.clock() + keep_alive
+		logger.info(f"Preloaded {model} in {(time.perf_counter() - start) * 1000:.0f}ms (keep_alive {keep_alive}s)")
+
+	async def poll(self):
+		"""Refreshes `resident` from Ollama's running models"""
+		assert self._session is not None
+		try:
+			async with self._session.get(f"{self.host}/api/ps") as resp:
+				resp.raise_for_status()
+				data = await resp.json()
+		except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+			self.poll_failures += 1
+			logger.warning(f"Failed to list the running Ollama models: {e}")
+			return
+
+		self.polls += 1
+		now = self.clock()
+		resident: dict[str, float] = {}
+		for entry in data.get("models") or []:
+			name = entry.get("model") or entry.get("name")
+			if name:
+				# expires_at is wall clock (RFC 3339), only its distance from now matters here
+				resident[name] = now + _seconds_until(entry.get("expires_at"))
+		self.resident = resident
+
+	def record_request(self, model: str):
+		requests = self._requests.setdefault(model, deque())
+		now = self.clock()
+		requests.append(now)
+		while requests and requests[0] < now - TRAFFIC_WINDOW:
+			requests.popleft()
+
+		# The request (re)loads the model, it stays resident for at least its keep_alive
+		self.resident[model] = max(self.resident.get(model, 0.0), now + self.keep_alive(model))
+
+	def keep_alive(self, model: str) -> int:
+		"""Seconds Ollama should keep the model loaded after this request"""
+		requests = self._requests.get(model)
+		if not requests or len(requests) < 2:
+			return MIN_KEEP_ALIVE
+
+		average_gap = (requests[-1] - requests[0]) / (len(requests) - 1)
+		return int(min(MAX_KEEP_ALIVE, max(MIN_KEEP_ALIVE, 2 * average_gap)))
+
+	def is_warm(self, model: str) -> bool:
+		return self.resident.get(model, 0.0) > self.clock()
+
+	def warm_models(self) -> set[str]:
+		now = self.clock()
+		return {model for model, expires in self.resident.items() if expires > now}
+
+	async def _poll_loop(self):
+		while True:
+			await asyncio.sleep(self.poll_interval)
+			await self.poll()
+
+def _seconds_until(expires_at: Optional[str]) -> float:
+	if not expires_at:
+		return float("inf")
+	try:
+		# Ollama sends nanoseconds, fromisoformat only takes microseconds
+		head, dot, tail = expires_at.partition(".")
+		if dot:
+			digits = len(tail) - len(tail.lstrip("0123456789"))
+			tail = tail[:min(digits, 6)] + tail[digits:]
+		expires = datetime.fromisoformat(head + dot + tail)
+	except ValueError:
+		return float("inf")
+	if expires.tzinfo is None:
+		expires = expires.replace(tzinfo=timezone.utc)
+	return (expires - datetime.now(timezone.utc)).total_seconds()
+
+model_residency = ModelResidencyManager()
@@ -1,20 +1,75 @@
-import re
+import hashlib
+import json
 import logging
+import os
 import numpy as np
-from typing import Any, Optional
-from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Optional
 
-from app.graph.state import QueryAnalysis
+from app.graph.state import ModelCapabilities, ModelInfo, ModelRoutingDecision, QueryAnalysis
+from app.utils.embedding_service import EmbeddingService
+from app.utils.providers import provider_for
+
+if TYPE_CHECKING:
+	from app.utils.model_residency import ModelResidencyManager
 
 logger = logging.getLogger(__name__)
 
+ROUTER_EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+ROUTER_CACHE_DIR = Path(os.getenv("ROUTER_CACHE_DIR", Path.home() / ".cache" / "llm_service" / "router"))
+# Intents scoring within this margin of the best one are considered as good, a warm model wins among them
+ROUTER_WARM_MARGIN = float(os.getenv("ROUTER_WARM_MARGIN", 0.03))
+
+def _model(name: str, capabilities: ModelCapabilities, fallback_model: Optional[str]) -> ModelInfo:
+	# Served by Ollama unless LLM_PROVIDER / MODEL_PROVIDERS say otherwise
+	provider, endpoint = provider_for(name)
+	return ModelInfo(
+		name=name,
+		provider=provider,
+		endpoint=endpoint,
+		capabilities=capabilities,
+		parameters={"temperature": 0},
+		routing_reason="",
+		fallback_model=fallback_model
+	)
+
+# Keyed by the graph node that runs the model (see app/graph/builder.py)
+MODEL_CATALOG: dict[str, ModelInfo] = {
+	# 256k, text + image, vision + tools
+	"fast_model": _model("qwen3-vl:2b", ModelCapabilities(vision=True, audio=False, video=False, code=False, max_context_tokens=256_000, cost_per_1k_tokens=0.0), fallback_model="qwen3-vl:4b"),
+	# 256k, text + image, vision + tools
+	"complex_model": _model("qwen3-vl:4b", ModelCapabilities(vision=True, audio=False, video=False, code=False, max_context_tokens=256_000, cost_per_1k_tokens=0.0), fallback_model="qwen3-vl:2b"),
+	# 32k, text, tools
+	"coding_model": _model("qwen2.5-coder:0.5b", ModelCapabilities(vision=False, audio=False, video=False, code=True, max_context_tokens=32_000, cost_per_1k_tokens=0.0), fallback_model="qwen3-vl:4b"),
+}
+
+INTENT_MODELS = {
+	"GENERAL_CONVERSATION": "fast_model",
+	"CODING_ASSISTANCE": "coding_model",
+	"DATA_ANALYSIS": "complex_model",
+	"UNKNOWN": "fast_model",
+}
+
+def node_for_model(model_name: str) -> Optional[str]:
+	"""The graph node of an Ollama model name"""
+	for node, info in MODEL_CATALOG.items():
+		if info["name"] == model_name:
+			return node
+	return None
+
 class ModelRouter:
 	"""
 	Routes Queries to the most appropriate model
 	"""
-	def __init__(self):
-		self.transformer = SentenceTransformer("all-MiniLM-L6-v2")
+	def __init__(
+		self,
+		embedding_service: Optional[EmbeddingService] = None,
+		cache_dir: Optional[Path] = ROUTER_CACHE_DIR,
+		residency: Optional["ModelResidencyManager"] = None
+	):
+		# Shared with every other caller of this model so concurrent queries are encoded in one batch.
+		# The model itself only loads when the first query is embedded
+		self.embedding_service = embedding_service or EmbeddingService.create(ROUTER_EMBEDDING_MODEL)
 		self.intent_examples = {
 			"GENERAL_CONVERSATION": [
 				"Hi", "Who are you?",
@@ -36,22 +91,173 @@ class ModelRouter:
 			]
 		}
 
-		self.intent_embeddings = {}
-		for intent, examples in self.intent_examples.items():
-			self.intent_embeddings[intent] = self.transformer.encode(examples)
+		self.intent_names = list(self.intent_examples)
+
+		self.cache_dir = cache_dir
+
+		# Every example embedding stacked in one L2 normalized matrix (intent by intent, so the rows of an
+		# intent are contiguous) and the row where each intent starts, for the grouped max in _detect_intent
+		self.intent_matrix = self._load_intent_matrix()
+		self.intent_index = np.repeat(np.arange(len(self.intent_names)), [len(self.intent_examples[intent]) for intent in self.intent_names])
+		self.intent_offsets = np.flatnonzero(np.r_[True, np.diff(self.intent_index) != 0])
+
+		# Which models Ollama has loaded, used to break ties between equally good models
+		self.residency = residency
+
+	def _intent_scores(self, query_embeddings: np.ndarray) -> np.ndarray:
+		"""(intents, queries) best cosine similarity of every query to the examples of every intent"""
+		queries = self._normalize(np.atleast_2d(query_embeddings))
+		similarities = self.intent_matrix @ queries.T
+		return np.maximum.reduceat(similarities, self.intent_offsets, axis=0)
+
+	def _detect_intent(self, query_embeddings: np.ndarray, threshold: float = 0.4) -> list[tuple[str, float]]:
+		"""
+		Compares query embedding to all intent clusters.
+		Returns the closest intent (and its score) of every query, "UNKNOWN" below the threshold.
+
+		One matrix product scores every query against every example, the score of an intent is the
+		best score among its examples.
+		"""
+		# (examples, queries) cosine similarities -> (intents, queries) max per intent
+		intent_scores = self._intent_scores(query_embeddings)
+
+		best = intent_scores.argmax(axis=0)
+		best_scores = intent_scores[best, np.arange(intent_scores.shape[1])]
+
+		return [
+			(self.intent_names[i] if score >= threshold else "UNKNOWN", float(score))
+			for i, score in zip(best, best_scores)
+		]
 
-	def _detect_intent(self, query_embeddings, threshold = 0.4):
+	async def route(self, user_text: str, query_analysis: Optional[QueryAnalysis], user_preferences: Optional[Any]) -> ModelRoutingDecision:
+		"""Pick the model for a query (embeds the text through the shared embedding service)"""
+		query_embedding = (await self.embedding_service.encode([user_text]))[0]
+		return self.route_embedding(query_embedding, query_analysis, user_preferences)
+
+	def route_embedding(self, query_embedding: np.ndarray, query_analysis: Optional[QueryAnalysis], user_preferences: Optional[Any]) -> ModelRoutingDecision:
+		"""The routing decision for an already embedded query"""
+		intent, score = self._detect_intent(query_embedding)[0]
+		node = INTENT_MODELS[intent]
+		reasons = [f"intent {intent} ({score:.2f})"]
+
+		# A close runner-up intent whose model is already loaded answers without a cold load
+		if intent != "UNKNOWN" and not self._is_warm(node):
+			node = self._warm_node(node, score, self._intent_scores(query_embedding)[:, 0], reasons)
+
+		if query_analysis and query_analysis["complexity"] == "complex" and node == "fast_model":
+			node = "complex_model"
+			reasons.append("complex query")
+
+		return self._decide(node, reasons, query_analysis, user_preferences)
+
+	def route_node(
+		self,
+		node: str,
+		reason: str,
+		query_embedding: np.ndarray,
+		query_analysis: Optional[QueryAnalysis],
+		user_preferences: Optional[Any]
+	) -> ModelRoutingDecision:
+		"""
+		The decision for the node another router (classifier, LLM) picked, under the same rules: a cold model
+		gives way to a loaded one whose intent scores as close to the query, then vision and preferences.
+		"""
+		reasons = [reason]
+		if not self._is_warm(node):
+			intent_scores = self._intent_scores(query_embedding)[:, 0]
+			node_scores = [intent_scores[i] for i, intent in enumerate(self.intent_names) if INTENT_MODELS[intent] == node]
+			if node_scores:
+				node = self._warm_node(node, float(max(node_scores)), intent_scores, reasons)
+		return self._decide(node, reasons, query_analysis, user_preferences)
+
+	def pinned_node(self, user_preferences: Optional[Any]) -> Optional[str]:
+		"""The node of the model the client pinned, if it is in the catalog"""
+		preferred = getattr(user_preferences, "preferred_model", "") if user_preferences is not None else ""
+		if not preferred:
+			return None
+		return preferred if preferred in MODEL_CATALOG else node_for_model(preferred)
+
+	def _decide(self, node: str, reasons: list[str], query_analysis: Optional[QueryAnalysis], user_preferences: Optional[Any]) -> ModelRoutingDecision:
+		if query_analysis and (query_analysis["needs_vision"] or query_analysis["needs_video_analysis"]) and not MODEL_CATALOG[node]["capabilities"]["vision"]:
+			# Any vision model will do, the loaded one first
+			vision_nodes = [name for name in ("complex_model", "fast_model") if MODEL_CATALOG[name]["capabilities"]["vision"]]
+			node = next((name for name in vision_nodes if self._is_warm(name)), vision_nodes[0])
+			reasons.append("vision required")
+
+		# The client can pin a model
+		pinned = self.pinned_node(user_preferences)
+		if pinned:
+			node = pinned
+			reasons.append("user preference")
+
+		reasoning = ", ".join(reasons)
+		primary_model = ModelInfo(**MODEL_CATALOG[node])
+		primary_model["routing_reason"] = reasoning
+
+		return ModelRoutingDecision(
+			primary_model=primary_model,
+			reasoning=reasoning,
+			vision_model=primary_model if primary_model["capabilities"]["vision"] and query_analysis and query_analysis["needs_vision"] else None,
+			text_model=primary_model
+		)
+
+	def _warm_node(self, node: str, score: float, intent_scores: np.ndarray, reasons: list[str]) -> str:
+		"""The best node with a loaded model among the intents within ROUTER_WARM_MARGIN of `score`, else `node`"""
+		for i in np.argsort(-intent_scores):
+			if intent_scores[i] < score - ROUTER_WARM_MARGIN:
+				break
+			candidate = INTENT_MODELS[self.intent_names[i]]
+			if self._is_warm(candidate):
+				reasons.append(f"{self.intent_names[i]} ({intent_scores[i]:.2f}) is as close and its model is loaded")
+				return candidate
+		return node
+
+	def _is_warm(self, node: str) -> bool:
+		# Only Ollama loads and unloads models, the other servers keep theirs loaded
+		if MODEL_CATALOG[node]["provider"] != "ollama":
+			return True
+		return self.residency is not None and self.residency.is_warm(MODEL_CATALOG[node]["name"])
+
+	def _load_intent_matrix(self) -> np.ndarray:
 		"""
-		Compares query embedding to all intent clusters. 
-		Returns the closest intent.
+		The normalized example matrix, memory mapped from the on-disk cache when it was built for the same
+		model and examples (so forked workers share its pages and the transformer is never loaded at startup).
+		Falls back to encoding the examples, and writes the cache for the next start.
 		"""
-		best_intent = "UNKNOWN"
-		best_score = -1
+		examples = [example for intent in self.intent_names for example in self.intent_examples[intent]]
+		if self.cache_dir is None:
+			return self._normalize(self.embedding_service.encode_now(examples))
+
+		path = Path(self.cache_dir) / f"intent_embeddings-{self._cache_key()}.npy"
+		try:
+			matrix = np.load(path, mmap_mode="r")
+			if matrix.shape[0] == len(examples):
+				return matrix
+			logger.warning(f"Ignoring router cache {path} with {matrix.shape[0]} rows, expected {len(examples)}")
+		except FileNotFoundError:
+			pass
+		except (OSError, ValueError) as e:
+			logger.warning(f"Failed to load router cache {path}: {e}")
 
-		for intent, example_embeddings in self.intent_embeddings.items():
-			similarities = cosine_similarity(query_embeddings.reshape(1, -1), example_embeddings)
+		matrix = self._normalize(self.embedding_service.encode_now(examples))
+		try:
+			path.parent.mkdir(parents=True, exist_ok=True)
+			# Write and rename so a worker starting at the same time never maps a half-written file
+			tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+			with open(tmp_path, "wb") as f:
+				np.save(f, matrix)
+			os.replace(tmp_path, path)
+			return np.load(path, mmap_mode="r")
+		except OSError as e:
+			logger.warning(f"Failed to write router cache {path}: {e}")
+			return matrix
 
-			# max_score
+	def _cache_key(self) -> str:
+		"""Changes whenever the embedding model or any intent example changes"""
+		payload = json.dumps([self.embedding_service.name, self.intent_examples], sort_keys=True)
+		return hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
 
-	async def route(self, query_analysis: QueryAnalysis, user_preferences: Optional[Any]):
-		pass
\ No newline at end of file
+	def _normalize(self, matrix: np.ndarray) -> np.ndarray:
+		matrix = np.asarray(matrix, dtype=np.float32)
+		norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+		return matrix / np.where(norms == 0, 1, norms)
@@ -0,0 +1,187 @@
+"""Int8 quantized ONNX Runtime encoder for the embedding models on CPU-only nodes"""
+
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Literal, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+EmbeddingBackend = Literal["torch", "onnx"]
+
+# "torch" runs SentenceTransformer (PyTorch), "onnx" runs the quantized export below
+EMBEDDING_BACKEND: EmbeddingBackend = "onnx" if os.getenv("EMBEDDING_BACKEND", "torch").lower() == "onnx" else "torch"
+ONNX_CACHE_DIR = Path(os.getenv("ONNX_CACHE_DIR", Path.home() / ".cache" / "llm_service" / "onnx"))
+
+# How each model turns token embeddings into a sentence embedding (what its SentenceTransformer config does)
+POOLING: dict[str, Literal["mean", "last_token"]] = {
+	"all-MiniLM-L6-v2": "mean",
+	"Qwen/Qwen3-Embedding-0.6B": "last_token",
+}
+
+def _hf_name(model_name: str) -> str:
+	# SentenceTransformer resolves bare names to the sentence-transformers organization
+	return model_name if "/" in model_name else f"sentence-transformers/{model_name}"
+
+def max_seq_length(model_name: str, model_max_length: int) -> int:
+	"""What SentenceTransformer truncates to: max_seq_length of its config, else the tokenizer limit"""
+	try:
+		path = Path(model_name) / "sentence_bert_config.json"
+		if not path.exists():
+			from huggingface_hub import hf_hub_download
+
+			path = Path(hf_hub_download(_hf_name(model_name), "sentence_bert_config.json"))
+		with open(path) as f:
+			config = json.load(f)
+		if "max_seq_length" in config:
+			return int(config["max_seq_length"])
+	except Exception as e:
+		logger.warning(f"No sentence-transformers config for {model_name}, truncating to the tokenizer limit: {e}")
+
+	# Newer sentence-transformers versions save the limit as the tokenizer's model_max_length.
+	# Tokenizers without a limit report a huge sentinel value
+	return model_max_length if model_max_length < 1_000_000 else 512
+
+def export_onnx(model_name: str, cache_dir: Path = ONNX_CACHE_DIR, quantize: bool = True) -> Path:
+	"""
+	Exports the transformer of an embedding model to ONNX (dynamic batch and sequence axes) and, by default,
+	quantizes its weights to int8 with dynamic activation quantization. Returns the model path, reusing
+	a previous export when there is one. The export needs torch and onnx, the quantization onnxruntime.
+	"""
+	model_dir = cache_dir / model_name.replace("/", "--")
+	fp32_path = model_dir / "model.onnx"
+	int8_path = model_dir / "model.int8.onnx"
+	target = int8_path if quantize else fp32_path
+
+	if target.exists():
+		return target
+
+	model_dir.mkdir(parents=True, exist_ok=True)
+
+	if not fp32_path.exists():
+		import torch
+		from transformers import AutoModel, AutoTokenizer
+
+		logger.info(f"Exporting {model_name} to ONNX")
+		tokenizer = AutoTokenizer.from_pretrained(_hf_name(model_name))
+		model = AutoModel.from_pretrained(_hf_name(model_name)).eval()
+		# Only last_hidden_state is exported, no KV cache outputs for the decoder based models
+		model.config.use_cache = False
+		sample = tokenizer(["export sample"], return_tensors="pt")
+
+		tmp_path = fp32_path.with_suffix(f".{os.getpid()}.tmp")
+		with torch.no_grad():
+			torch.onnx.export(
+				model,
+				(sample["input_ids"], sample["attention_mask"]),
+				str(tmp_path),
+				input_names=["input_ids", "attention_mask"],
+				output_names=["last_hidden_state"],
+				dynamic_axes={
+					"input_ids": {0: "batch", 1: "sequence"},
+					"attention_mask": {0: "batch", 1: "sequence"},
+					"last_hidden_state": {0: "batch", 1: "sequence"},
+				},
+				opset_version=17,
+				# The TorchScript exporter, the dynamo one (default since torch 2.9) needs onnxscript
+				dynamo=False
+			)
+		os.replace(tmp_path, fp32_path)
+		tokenizer.save_pretrained(model_dir)
+
+	if quantize:
+		from onnxruntime.quantization import QuantType, quantize_dynamic
+
+		logger.info(f"Quantizing {model_name} to int8")
+		tmp_path = int8_path.with_suffix(f".{os.getpid()}.tmp")
+		quantize_dynamic(str(fp32_path), str(tmp_path), weight_type=QuantType.QInt8)
+		os.replace(tmp_path, int8_path)
+
+	return target
+
+class OnnxEncoder:
+	"""
+	Same contract as `SentenceTransformer.encode(texts, normalize_embeddings=True)`: one L2 normalized
+	float32 row per text. The export and the ONNX Runtime session are created on the first call.
+	Texts are truncated to `max_length` tokens, by default the model's max_seq_length (256 for MiniLM)
+	like SentenceTransformer does, so long texts get the same embeddings as with PyTorch.
+	"""
+
+	def __init__(self, model_name: str, quantize: bool = True, cache_dir: Path = ONNX_CACHE_DIR, max_length: Optional[int] = None, num_threads: Optional[int] = None):
+		self.model_name = model_name
+		self.quantize = quantize
+		self.cache_dir = cache_dir
+		self.max_length = max_length
+		self.num_threads = num_threads
+		self.pooling = POOLING.get(model_name, "mean")
+
+		self._session = None
+		self._tokenizer = None
+		self._lock = threading.Lock()
+
+	def __call__(self, texts: list[str]) -> np.ndarray:
+		return self.encode(texts)
+
+	def encode(self, texts: list[str]) -> np.ndarray:
+		if self._session is None:
+			self._load()
+
+		encoded = self._tokenizer(texts, padding=True, truncation=True, max_length=self.max_length, return_tensors="np")
+		attention_mask = encoded["attention_mask"].astype(np.int64)
+		(hidden,) = self._session.run(["last_hidden_state"], {
+			"input_ids": encoded["input_ids"].astype(np.int64),
+			"attention_mask": attention_mask,
+		})
+
+		if self.pooling == "last_token":
+			# The position of the last real token works for both left and right padding
+			last = (attention_mask * np.arange(attention_mask.shape[1])).argmax(axis=1)
+			vectors = hidden[np.arange(hidden.shape[0]), last]
+		else:
+			mask = attention_mask[..., None].astype(np.float32)
+			vectors = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+		vectors = vectors.astype(np.float32)
+		return vectors / np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+
+	def _load(self):
+		with self._lock:
+			if self._session is not None:
+				return
+
+			import onnxruntime as ort
+			from transformers import AutoTokenizer
+
+			path = export_onnx(self.model_name, self.cache_dir, self.quantize)
+
+			options = ort.SessionOptions()
+			options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+			if self.num_threads:
+				options.intra_op_num_threads = self.num_threads
+
+			self._tokenizer = AutoTokenizer.from_pretrained(path.parent)
+			if self.max_length is None:
+				self.max_length = max_seq_length(self.model_name, self._tokenizer.model_max_length)
+			self._session = ort.InferenceSession(str(path), options, providers=["CPUExecutionProvider"])
+			logger.info(f"Loaded ONNX encoder {path}")
+
+def check_parity(model_name: str, texts: list[str], quantize: bool = True, min_cosine: float = 0.98) -> dict[str, float]:
+	"""
+	Cosine agreement of the ONNX encoder with the PyTorch SentenceTransformer on `texts`.
+	Raises ValueError when any text falls below `min_cosine`.
+	"""
+	from sentence_transformers import SentenceTransformer
+
+	reference = SentenceTransformer(model_name).encode(texts, normalize_embeddings=True)
+	candidate = OnnxEncoder(model_name, quantize=quantize).encode(texts)
+
+	cosines = (np.asarray(reference, dtype=np.float32) * candidate).sum(axis=1)
+	report = {"min_cosine": float(cosines.min()), "mean_cosine": float(cosines.mean())}
+
+	if report["min_cosine"] < min_cosine:
+		raise ValueError(f"ONNX encoder of {model_name} disagrees with PyTorch: {report}")
+	return report
@@ -0,0 +1,145 @@
+"""Throttles the progress updates ingestion workers write to Valkey"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Optional, TypedDict
+
+from app.utils.file_manager import TERMINAL_FILE_STATUSES, FileManager
+
+logger = logging.getLogger(__name__)
+
+class _FileProgress(TypedDict):
+	status: str
+	progress: float
+	message: str
+	extra: dict[str, Any]
+
+class ProgressReporter:
+	"""
+	Coalesces per-chunk progress updates before they reach FileManager.
+
+	- A status transition (pending -> processing -> ready/failed) is always written immediately
+	- A progress update is written when `min_interval_ms` has passed since the last write of that
+	  file or the progress moved by at least `min_progress_delta`
+	- Anything in between only replaces the latest in-memory value, a timer writes it once the interval ends
+
+	Usage:
+		async with ProgressReporter(file_manager) as reporter:
+			for i, chunk in enumerate(chunks):
+				...
+				await reporter.report(file_id, "processing", (i + 1) / len(chunks))
+			await reporter.report(file_id, "ready", 1.0)
+	"""
+
+	def __init__(self, file_manager: FileManager, min_interval_ms: int = 500, min_progress_delta: float = 0.05):
+		self.file_manager = file_manager
+		self.min_interval = min_interval_ms / 1000
+		self.min_progress_delta = min_progress_delta
+
+		self._written: dict[str, _FileProgress] = {}
+		self._written_at: dict[str, float] = {}
+		self._pending: dict[str, _FileProgress] = {}
+		self._timers: dict[str, asyncio.Task] = {}
+		self._locks: dict[str, asyncio.Lock] = {}
+
+		self.writes = 0
+		self.suppressed_writes = 0
+
+	async def __aenter__(self) -> "ProgressReporter":
+		return self
+
+	async def __aexit__(self, *exc_info):
+		await self.close()
+
+	async def report(self, file_id: str, status: str, progress: float = 0.0, message: str = "", **kwargs):
+		"""Record the latest status of a file, writing it now only if it is worth a round trip"""
+		update = _FileProgress(status=status, progress=progress, message=message, extra=kwargs)
+
+		last = self._written.get(file_id)
+		now = time.monotonic()
+
+		if (
+			last is None
+			or last["status"] != status
+			or abs(progress - last["progress"]) >= self.min_progress_delta
+			or now - self._written_at[file_id] >= self.min_interval
+		):
+			if self._pending.pop(file_id, None) is not None:
+				# Superseded by this write before its timer fired
+				self.suppressed_writes += 1
+			await self._write(file_id, update)
+			return
+
+		if file_id in self._pending:
+			# The previous pending update never reached Valkey
+			self.suppressed_writes += 1
+		self._pending[file_id] = update
+
+		if file_id not in self._timers:
+			delay = self.min_interval - (now - self._written_at[file_id])
+			self._timers[file_id] = asyncio.create_task(self._flush_later(file_id, delay))
+
+	async def flush(self, file_id: Optional[str] = None):
+		"""Write the pending update of one file (or of every file) right away"""
+		file_ids = [file_id] if file_id is not None else list(self._pending)
+
+		for pending_id in file_ids:
+			update = self._pending.pop(pending_id, None)
+			if update is not None:
+				await self._write(pending_id, update)
+
+	async def close(self):
+		"""Final flush, call this when the worker is done with its files"""
+		for timer in self._timers.values():
+			timer.cancel()
+		self._timers.clear()
+
+		await self.flush()
+		logger.info(f"ProgressReporter closed: {self.writes} writes, {self.suppressed_writes} suppressed")
+
+	def stats(self) -> dict[str, int]:
+		return {
+			"writes": self.writes,
+			"suppressed_writes": self.suppressed_writes,
+			"pending": len(self._pending)
+		}
+
+	async def _flush_later(self, file_id: str, delay: float):
+		try:
+			await asyncio.sleep(max(delay, 0))
+			self._timers.pop(file_id, None)
+			await self.flush(file_id)
+		except asyncio.CancelledError:
+			pass
+		except Exception as e:
+			logger.error(f"Failed to flush progress for file {file_id}: {e}")
+
+	async def _write(self, file_id: str, update: _FileProgress):
+		# Writes of the same file must land in order, a timer flush can race with report()
+		lock = self._locks.setdefault(file_id, asyncio.Lock())
+
+		async with lock:
+			await self.file_manager.update_file_status(
+				file_id=file_id,
+				status=update["status"],
+				progress=update["progress"],
+				message=update["message"],
+				**update["extra"]
+			)
+
+		self.writes += 1
+
+		timer = self._timers.pop(file_id, None)
+		if timer is not None and timer is not asyncio.current_task():
+			timer.cancel()
+
+		if update["status"] in TERMINAL_FILE_STATUSES:
+			# Nothing more will be reported for this file
+			self._written.pop(file_id, None)
+			self._written_at.pop(file_id, None)
+			self._locks.pop(file_id, None)
+			self._pending.pop(file_id, None)
+		else:
+			self._written[file_id] = update
+			self._written_at[file_id] = time.monotonic()
@@ -0,0 +1,296 @@
+"""
+Model providers: which server runs a model and the chat client that talks to it.
+
+- "ollama": ChatOllama
+- "vllm" / "openai-compatible": ChatOpenAICompatible, an OpenAI chat completions client streaming over a
+  pooled keep-alive aiohttp session, so vLLM's continuous batching sees every concurrent stream at once.
+  Start vLLM with `--served-model-name` set to the catalog names (e.g. qwen3-vl:4b) so the nodes don't change.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import threading
+from typing import Any, AsyncIterator, Literal, Optional, Sequence, Union
+
+import aiohttp
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models import BaseChatModel, LanguageModelInput
+from langchain_core.messages import AIMessageChunk, BaseMessage, convert_to_openai_messages
+from langchain_core.messages.tool import tool_call_chunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.runnables import Runnable
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+logger = logging.getLogger(__name__)
+
+Provider = Literal["ollama", "vllm", "openai-compatible"]
+
+# Provider of every model, and the endpoint of its server ("" is the client default, e.g. the local Ollama)
+LLM_PROVIDER: Provider = os.getenv("LLM_PROVIDER", "ollama") # type: ignore[assignment]
+LLM_ENDPOINT = os.getenv("LLM_ENDPOINT", "")
+# Per model overrides: "qwen3-vl:4b=vllm@http://gpu-1:8000/v1,qwen3-vl:2b=ollama"
+MODEL_PROVIDERS = os.getenv("MODEL_PROVIDERS", "")
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
+# Connections kept open per OpenAI compatible server
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", 100))
+
+PROVIDERS: tuple[Provider, ...] = ("ollama", "vllm", "openai-compatible")
+
+def parse_model_providers(value: str) -> dict[str, tuple[Provider, str]]:
+	""""model=provider@endpoint,..." -> {model: (provider, endpoint)}"""
+	providers: dict[str, tuple[Provider, str]] = {}
+	for part in value.split(","):
+		if "=" not in part:
+			continue
+		model, _, target = part.rpartition("=")
+		provider, _, endpoint = target.partition("@")
+		if provider not in PROVIDERS:
+			raise ValueError(f"Unknown provider {provider} for {model}, expected one of {PROVIDERS}")
+		providers[model.strip()] = (provider, endpoint.strip()) # type: ignore[assignment]
+	return providers
+
+_model_providers = parse_model_providers(MODEL_PROVIDERS)
+
+def provider_for(model: str) -> tuple[Provider, str]:
+	"""(provider, endpoint) of a model"""
+	return _model_providers.get(model, (LLM_PROVIDER, LLM_ENDPOINT))
+
+def create_chat_model(model: str, provider: Optional[Provider] = None, endpoint: Optional[str] = None, **params: Any) -> BaseChatModel:
+	"""The chat client of `model` for its provider (from provider_for unless given)"""
+	default_provider, default_endpoint = provider_for(model)
+	provider = provider or default_provider
+	endpoint = default_endpoint if endpoint is None else endpoint
+
+	if provider == "ollama":
+		from langchain_ollama import ChatOllama
+
+		if endpoint:
+			params.setdefault("base_url", endpoint)
+		return ChatOllama(model=model, **params)
+
+	if not endpoint:
+		raise ValueError(f"{model} uses the {provider} provider but has no endpoint (LLM_ENDPOINT / MODEL_PROVIDERS)")
+	return ChatOpenAICompatible(model=model, base_url=endpoint, **params)
+
+class OpenAICompatibleError(Exception):
+	def __init__(self, status: int, body: str):
+		super().__init__(f"HTTP {status}: {body[:500]}")
+		self.status = status
+
+class OpenAICompatibleClient:
+	"""
+	Streams /chat/completions over one aiohttp session per server: the TCP connections are kept alive and
+	reused by every request, instead of a handshake per generation.
+	"""
+
+	def __init__(self, base_url: str, api_key: str = OPENAI_API_KEY, max_connections: int = OPENAI_MAX_CONNECTIONS, timeout: float = 600):
+		self.base_url = base_url.rstrip("/")
+		self.api_key = api_key
+		self.max_connections = max_connections
+		self.timeout = timeout
+
+		self._session: Optional[aiohttp.ClientSession] = None
+		self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+	def session(self) -> aiohttp.ClientSession:
+		# A session belongs to the event loop it was created on
+		loop = asyncio.get_running_loop()
+		if self._session is None or self._session.closed or self._loop is not loop:
+			self._session = aiohttp.ClientSession(
+				connector=aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=60),
+				timeout=aiohttp.ClientTimeout(total=self.timeout, sock_connect=10),
+				headers={"Authorization": f"Bearer {self.api_key}"} if self.api_key else None
+			)
+			self._loop = loop
+		return self._session
+
+	async def stream_chat(self, payload: dict[str, Any]) -> AsyncIterator[dict[str, Any]]:
+		"""The parsed `data:` events of a streamed chat completion"""
+		async with self.session().post(f"{self.base_url}/chat/completions", json={**payload, "stream": True}) as resp:
+			if resp.status >= 400:
+				raise OpenAICompatibleError(resp.status, await resp.text())
+
+			data: list[str] = []
+			async for raw_line in resp.content:
+				line = raw_line.decode().rstrip("\r\n")
+				if line.startswith("data:"):
+					data.append(line[5:].lstrip())
+					continue
+				if line or not data:
+					continue # comments (":"), other fields, keep-alive blank lines
+
+				# A blank line ends the event
+				event = "\n".join(data)
+				data = []
+				if event == "[DONE]":
+					return
+				yield json.loads(event)
+
+			if data and data[-1] != "[DONE]":
+				yield json.loads("\n".join(data))
+
+	async def close(self):
+		if self._session is not None:
+			await self._session.close()
+			self._session = None
+
+_clients: dict[str, OpenAICompatibleClient] = {}
+
+# Sync calls run on their own event loop thread, with their own clients (a session belongs to one loop)
+_sync_loop: Optional[asyncio.AbstractEventLoop] = None
+_sync_clients: dict[str, OpenAICompatibleClient] = {}
+_sync_lock = threading.Lock()
+
+def get_client(base_url: str) -> OpenAICompatibleClient:
+	"""The shared client (and connection pool) of a server"""
+	client = _clients.get(base_url)
+	if client is None:
+		client = OpenAICompatibleClient(base_url)
+		_clients[base_url] = client
+	return client
+
+def _get_sync_loop() -> asyncio.AbstractEventLoop:
+	global _sync_loop
+	with _sync_lock:
+		if _sync_loop is None:
+			_sync_loop = asyncio.new_event_loop()
+			threading.Thread(target=_sync_loop.run_forever, name="openai-compatible-sync", daemon=True).start()
+		return _sync_loop
+
+async def close_clients():
+	for client in _clients.values():
+		await client.close()
+	if _sync_loop is not None:
+		for client in _sync_clients.values():
+			await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(client.close(), _sync_loop))
+
+class ChatOpenAICompatible(BaseChatModel):
+	"""Chat model for OpenAI compatible servers (vLLM, llama.cpp server, TGI, ...), tools and streaming included"""
+
+	model: str
+	base_url: str
+	temperature: Optional[float] = None
+	max_tokens: Optional[int] = None
+	top_p: Optional[float] = None
+
+	@property
+	def _llm_type(self) -> str:
+		return "openai-compatible"
+
+	@property
+	def _identifying_params(self) -> dict[str, Any]:
+		return {"model": self.model, "base_url": self.base_url}
+
+	def bind_tools(self, tools: Sequence[Any], *, tool_choice: Optional[Union[str, dict]] = None, **kwargs: Any) -> Runnable[LanguageModelInput, BaseMessage]:
+		formatted = [convert_to_openai_tool(tool) for tool in tools]
+		if tool_choice == "any":
+			tool_choice = "required"
+		elif isinstance(tool_choice, str) and tool_choice not in ("auto", "none", "required"):
+			tool_choice = {"type": "function", "function": {"name": tool_choice}}
+		if tools and tool_choice is not None:
+			kwargs["tool_choice"] = tool_choice
+		return super().bind(tools=formatted, **kwargs)
+
+	def _payload(self, messages: list[BaseMessage], stop: Optional[list[str]], **kwargs: Any) -> dict[str, Any]:
+		payload: dict[str, Any] = {
+			"model": self.model,
+			"messages": convert_to_openai_messages(messages),
+			"stream_options": {"include_usage": True},
+		}
+		for name in ("temperature", "max_tokens", "top_p"):
+			value = kwargs.get(name, getattr(self, name))
+			if value is not None:
+				payload[name] = value
+		if stop:
+			payload["stop"] = stop
+		# Only OpenAI parameters are sent, provider specific ones (Ollama's keep_alive, ...) are dropped
+		if kwargs.get("tools"):
+			payload["tools"] = kwargs["tools"]
+			if "tool_choice" in kwargs:
+				payload["tool_choice"] = kwargs["tool_choice"]
+		return payload
+
+	async def _astream(
+		self,
+		messages: list[BaseMessage],
+		stop: Optional[list[str]] = None,
+		run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+		**kwargs: Any
+	) -> AsyncIterator[ChatGenerationChunk]:
+		client = kwargs.pop("client", None) or get_client(self.base_url)
+		async for event in client.stream_chat(self._payload(messages, stop, **kwargs)):
+			chunk = self._to_chunk(event)
+			if chunk is None:
+				continue
+			if run_manager:
+				await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+			yield chunk
+
+	async def _agenerate(
+		self,
+		messages: list[BaseMessage],
+		stop: Optional[list[str]] = None,
+		run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+		**kwargs: Any
+	) -> ChatResult:
+		result: Optional[ChatGenerationChunk] = None
+		async for chunk in self._astream(messages, stop, run_manager, **kwargs):
+			result = chunk if result is None else result + chunk
+		if result is None:
+			raise OpenAICompatibleError(200, "empty completion stream")
+		return ChatResult(generations=[ChatGeneration(message=result.message, generation_info=result.generation_info)])
+
+	def _generate(
+		self,
+		messages: list[BaseMessage],
+		stop: Optional[list[str]] = None,
+		run_manager: Optional[CallbackManagerForLLMRun] = None,
+		**kwargs: Any
+	) -> ChatResult:
+		# Runs on the dedicated sync loop, so it also works when called from a thread with a running loop
+		loop = _get_sync_loop()
+		with _sync_lock:
+			client = _sync_clients.get(self.base_url)
+			if client is None:
+				client = _sync_clients[self.base_url] = OpenAICompatibleClient(self.base_url)
+		future = asyncio.run_coroutine_threadsafe(self._agenerate(messages, stop, None, client=client, **kwargs), loop)
+		return future.result()
+
+	def _to_chunk(self, event: dict[str, Any]) -> Optional[ChatGenerationChunk]:
+		usage = event.get("usage")
+		choices = event.get("choices") or []
+		if not choices:
+			if not usage:
+				return None
+			# The last event carries the token usage of the whole completion
+			return ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata={
+				"input_tokens": usage.get("prompt_tokens", 0),
+				"output_tokens": usage.get("completion_tokens", 0),
+				"total_tokens": usage.get("total_tokens", 0),
+			}))
+
+		choice = choices[0]
+		delta = choice.get("delta") or {}
+		tool_call_chunks = [
+			tool_call_chunk(
+				name=(call.get("function") or {}).get("name"),
+				args=(call.get("function") or {}).get("arguments"),
+				id=call.get("id"),
+				index=call.get("index")
+			)
+			for call in delta.get("tool_calls") or []
+		]
+		finish_reason = choice.get("finish_reason")
+		response_metadata = {"finish_reason": finish_reason, "model_name": event.get("model", self.model)} if finish_reason else {}
+
+		return ChatGenerationChunk(
+			message=AIMessageChunk(
+				content=delta.get("content") or "",
+				tool_call_chunks=tool_call_chunks,
+				response_metadata=response_metadata,
+				id=event.get("id")
+			),
+			generation_info={"finish_reason": finish_reason} if finish_reason else None
+		)
@@ -0,0 +1,27 @@
+"""Merges ranked result lists from different retrievers"""
+
+from typing import Hashable, Sequence, TypeVar
+
+T = TypeVar("T")
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[T]], key=lambda item: item, k: int = 60, limit: int | None = None) -> list[tuple[T, float]]:
+	"""
+	Reciprocal rank fusion: every list adds 1 / (k + rank) to the score of each item it contains.
+	Only ranks are used, so scores from retrievers on different scales (BM25, cosine) don't need
+	to be normalized. Returns (item, fused score) pairs, best first. When an item appears in several
+	lists the first occurrence is the one returned.
+	"""
+	scores: dict[Hashable, float] = {}
+	items: dict[Hashable, T] = {}
+
+	for ranking in rankings:
+		for rank, item in enumerate(ranking, start=1):
+			item_key = key(item)
+			scores[item_key] = scores.get(item_key, 0.0) + 1.0 / (k + rank)
+			items.setdefault(item_key, item)
+
+	fused = sorted(scores.items(), key=lambda entry: entry[1], reverse=True)
+	if limit is not None:
+		fused = fused[:limit]
+
+	return [(items[item_key], score) for item_key, score in fused]
@@ -0,0 +1,152 @@
+"""Output stage between the chat graph and the gRPC writer: token batching with backpressure"""
+
+import asyncio
+import logging
+import os
+from typing import AsyncIterator, Generic, TypeVar, Union
+
+logger = logging.getLogger(__name__)
+
+STREAM_QUEUE_SIZE = int(os.getenv("STREAM_QUEUE_SIZE", 256))
+STREAM_MAX_BATCH_BYTES = int(os.getenv("STREAM_MAX_BATCH_BYTES", 2048))
+STREAM_MIN_WINDOW_MS = float(os.getenv("STREAM_MIN_WINDOW_MS", 0))
+STREAM_MAX_WINDOW_MS = float(os.getenv("STREAM_MAX_WINDOW_MS", 50))
+
+T = TypeVar("T")
+
+_DONE = object()
+
+class ResponseStream(Generic[T]):
+	"""
+	Runs `source` (an async iterator of text chunks and other events) in a producer task that feeds a
+	bounded queue, and yields from the queue with consecutive text chunks merged into one string.
+
+	- Backpressure: when the client reads slower than the graph produces, the queue fills up and the
+	  producer blocks on it, which pauses the graph (and the model stream) instead of buffering without bound.
+	- Batching: a batch grows until `max_batch_bytes` or until the window has passed. The window adapts
+	  to the client: it is twice the average time a write takes (the time the consumer is away between two
+	  reads), clamped to [min_window_ms, max_window_ms]. A fast reader gets every chunk right away, a slow
+	  one gets fewer and larger messages.
+	- The first text chunk is never held back, it is the time to first token.
+	Non-text events keep their position, they end the current batch.
+	"""
+
+	def __init__(
+		self,
+		source: AsyncIterator[Union[str, T]],
+		queue_size: int = STREAM_QUEUE_SIZE,
+		max_batch_bytes: int = STREAM_MAX_BATCH_BYTES,
+		min_window_ms: float = STREAM_MIN_WINDOW_MS,
+		max_window_ms: float = STREAM_MAX_WINDOW_MS
+	):
+		self.source = source
+		self.max_batch_bytes = max_batch_bytes
+		self.min_window = min_window_ms / 1000
+		self.max_window = max_window_ms / 1000
+		self.window = self.min_window
+
+		self._queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+		self._write_time = 0.0
+
+		# Metrics
+		self.chunks = 0
+		self.messages = 0
+		self.max_queue_depth = 0
+		self.producer_blocked = 0.0
+
+	async def __aiter__(self) -> AsyncIterator[Union[str, T]]:
+		loop = asyncio.get_running_loop()
+		producer = asyncio.create_task(self._produce())
+		first_text = True
+
+		try:
+			pending = None
+			while True:
+				item = pending if pending is not None else await self._queue.get()
+				pending = None
+				if item is _DONE:
+					break
+				if isinstance(item, BaseException):
+					raise item
+
+				if isinstance(item, str) and not first_text:
+					parts = [item]
+					size = len(item.encode())
+					deadline = loop.time() + self.window
+
+					while size < self.max_batch_bytes:
+						if self._queue.empty():
+							remaining = deadline - loop.time()
+							if remaining <= 0:
+								break
+							try:
+								next_item = await asyncio.wait_for(self._queue.get(), timeout=remaining)
+							except asyncio.TimeoutError:
+								break
+						else:
+							next_item = self._queue.get_nowait()
+
+						if not isinstance(next_item, str):
+							pending = next_item
+							break
+						parts.append(next_item)
+						size += len(next_item.encode())
+
+					self.chunks += len(parts)
+					item = "".join(parts)
+				elif isinstance(item, str):
+					first_text = False
+					self.chunks += 1
+
+				self.messages += 1
+				written_at = loop.time()
+				yield item
+				self._adapt(loop.time() - written_at)
+
+		finally:
+			producer.cancel()
+			try:
+				await producer
+			except asyncio.CancelledError:
+				pass
+
+	def stats(self) -> dict[str, float]:
+		return {
+			"chunks": self.chunks,
+			"messages": self.messages,
+			"chunks_per_message": self.chunks / self.messages if self.messages else 0.0,
+			"window_ms": self.window * 1000,
+			"max_queue_depth": self.max_queue_depth,
+			"producer_blocked_ms": self.producer_blocked * 1000,
+		}
+
+	async def _produce(self):
+		loop = asyncio.get_running_loop()
+		end: object = _DONE
+		try:
+			async for item in self.source:
+				if self._queue.full():
+					blocked_at = loop.time()
+					await self._queue.put(item)
+					self.producer_blocked += loop.time() - blocked_at
+				else:
+					self._queue.put_nowait(item)
+				self.max_queue_depth = max(self.max_queue_depth, self._queue.qsize())
+		except asyncio.CancelledError as e:
+			end = e
+			raise
+		except Exception as e:
+			# Handed to the consumer, which raises it in order (after the events produced before it)
+			end = e
+		finally:
+			# The consumer always gets the end of the stream, also when the source was cancelled by someone
+			# else (a single-flight follower whose flight got cancelled). Only a producer cancelled by the
+			# consumer itself has nobody left to tell.
+			task = asyncio.current_task()
+			if not (task and task.cancelling()):
+				await self._queue.put(end)
+
+	def _adapt(self, write_time: float):
+		# Exponential moving average of the write time, the window follows it
+		self._write_time = 0.8 * self._write_time + 0.2 * write_time
+		self.window = min(self.max_window, max(self.min_window, 2 * self._write_time))
@@ -0,0 +1,158 @@
+"""
+Query -> graph model node classifier, the cheap replacement of the LLM router.
+
+Features are the router query embedding plus a few lexical features, the model is a logistic
+regression or XGBoost trained offline from labeled examples (jsonl lines {"text": ..., "label": ...})
+and loaded from a joblib file.
+
+Train a model file:
+	python -m app.utils.route_classifier labeled.jsonl route_classifier.joblib [logreg|xgboost]
+"""
+
+import json
+import logging
+import os
+import re
+import sys
+from pathlib import Path
+from typing import Any, Literal, Optional
+
+import numpy as np
+
+from app.utils.embedding_service import EmbeddingService
+from app.utils.model_router import ROUTER_EMBEDDING_MODEL
+
+logger = logging.getLogger(__name__)
+
+ROUTE_CLASSIFIER_PATH = Path(os.getenv("ROUTE_CLASSIFIER_PATH", Path.home() / ".cache" / "llm_service" / "route_classifier.joblib"))
+ROUTE_LABELS = ["fast_model", "complex_model", "coding_model"]
+
+ClassifierKind = Literal["logreg", "xgboost"]
+
+_CODE_KEYWORDS = re.compile(r"\b(def|class|import|function|const|let|var|return|async|await|lambda|struct|impl|select|from|where|npm|pip|git|docker|error|exception|traceback|stack trace|compile|regex|api|sql)\b", re.I)
+_REASONING_WORDS = re.compile(r"\b(why|explain|compare|analy[sz]e|prove|derive|calculate|solve|estimate|step by step|trade-?offs?|implications?|evaluate|optimi[sz]e|plan|strategy)\b", re.I)
+_MATH = re.compile(r"[\d]+\s*[-+*/^=<>]\s*[\d(]|\b(integral|derivative|equation|probability|matrix|theorem)\b", re.I)
+_CODE_SYMBOLS = set("{}[]();=<>_`$#")
+
+# Bump when lexical_features changes so old model files are rejected
+LEXICAL_FEATURES_VERSION = 1
+
+def lexical_features(text: str) -> np.ndarray:
+	"""Cheap surface features, they catch code and math the small embedding model tends to blur"""
+	chars = max(len(text), 1)
+	words = text.split()
+	return np.array([
+		np.log1p(len(text)),
+		np.log1p(len(words)),
+		np.log1p(text.count("\n")),
+		sum(c in _CODE_SYMBOLS for c in text) / chars,
+		float("```" in text),
+		np.log1p(len(_CODE_KEYWORDS.findall(text))),
+		np.log1p(len(_REASONING_WORDS.findall(text))),
+		np.log1p(len(_MATH.findall(text))),
+		sum(c.isdigit() for c in text) / chars,
+		float(text.rstrip().endswith("?")),
+	], dtype=np.float32)
+
+def build_features(texts: list[str], embeddings: np.ndarray) -> np.ndarray:
+	return np.hstack([np.asarray(embeddings, dtype=np.float32), np.stack([lexical_features(text) for text in texts])])
+
+def load_labeled(path: Path) -> tuple[list[str], list[str]]:
+	texts, labels = [], []
+	with open(path) as f:
+		for line in f:
+			if line.strip():
+				example = json.loads(line)
+				if example["label"] not in ROUTE_LABELS:
+					raise ValueError(f"Unknown route label {example['label']!r} in {path}, expected one of {ROUTE_LABELS}")
+				texts.append(example["text"])
+				labels.append(example["label"])
+	return texts, labels
+
+class RouteClassifier:
+	"""
+	Predicts the graph node (fast_model, complex_model, coding_model) of a query.
+	The embedding service must be the one the classifier was trained with (checked by name on load).
+	"""
+
+	def __init__(self, model: Any, labels: list[str], embedding_service: EmbeddingService):
+		self.model = model
+		self.labels = labels
+		self.embedding_service = embedding_service
+
+	@classmethod
+	def train(cls, texts: list[str], labels: list[str], embedding_service: EmbeddingService, kind: ClassifierKind = "logreg") -> "RouteClassifier":
+		label_names = sorted(set(labels))
+		y = np.array([label_names.index(label) for label in labels])
+		X = build_features(texts, embedding_service.encode_now(texts))
+
+		if kind == "xgboost":
+			from xgboost import XGBClassifier
+			model = XGBClassifier(n_estimators=200, max_depth=4, learning_rate=0.1, n_jobs=1)
+		else:
+			from sklearn.linear_model import LogisticRegression
+			from sklearn.pipeline import make_pipeline
+			from sklearn.preprocessing import StandardScaler
+			model = make_pipeline(StandardScaler(), LogisticRegression(max_iter=2000, C=1.0))
+
+		model.fit(X, y)
+		return cls(model, label_names, embedding_service)
+
+	@classmethod
+	def load(cls, path: Path = ROUTE_CLASSIFIER_PATH, embedding_service: Optional[EmbeddingService] = None) -> "RouteClassifier":
+		import joblib
+
+		data = joblib.load(path)
+		if embedding_service is None:
+			# The name of an ONNX service is "<model>@onnx-int8" (see EmbeddingService.from_onnx)
+			model_name, _, backend = data["embedding_model"].partition("@")
+			if backend:
+				embedding_service = EmbeddingService.from_onnx(model_name, quantize=backend == "onnx-int8")
+			else:
+				embedding_service = EmbeddingService.from_sentence_transformer(model_name)
+
+		if data["embedding_model"] != embedding_service.name:
+			raise ValueError(f"{path} was trained on {data['embedding_model']} embeddings, not {embedding_service.name}")
+		if data["lexical_features_version"] != LEXICAL_FEATURES_VERSION:
+			raise ValueError(f"{path} was trained with lexical features v{data['lexical_features_version']}, current is v{LEXICAL_FEATURES_VERSION}")
+
+		return cls(data["model"], data["labels"], embedding_service)
+
+	def save(self, path: Path = ROUTE_CLASSIFIER_PATH):
+		import joblib
+
+		path.parent.mkdir(parents=True, exist_ok=True)
+		joblib.dump({
+			"model": self.model,
+			"labels": self.labels,
+			"embedding_model": self.embedding_service.name,
+			"lexical_features_version": LEXICAL_FEATURES_VERSION,
+		}, path)
+
+	def predict(self, texts: list[str]) -> list[tuple[str, float]]:
+		"""(node, probability) per text, embeds synchronously"""
+		return self.predict_embeddings(texts, self.embedding_service.encode_now(texts))
+
+	async def apredict(self, texts: list[str]) -> list[tuple[str, float]]:
+		"""Same as predict, the embeddings go through the batching queue of the service"""
+		return self.predict_embeddings(texts, await self.embedding_service.encode(texts))
+
+	def predict_embeddings(self, texts: list[str], embeddings: np.ndarray) -> list[tuple[str, float]]:
+		probabilities = self.model.predict_proba(build_features(texts, embeddings))
+		best = probabilities.argmax(axis=1)
+		return [(self.labels[i], float(probabilities[row, i])) for row, i in enumerate(best)]
+
+def main():
+	if len(sys.argv) < 3:
+		print(__doc__)
+		sys.exit(1)
+
+	texts, labels = load_labeled(Path(sys.argv[1]))
+	kind: ClassifierKind = "xgboost" if len(sys.argv) > 3 and sys.argv[3] == "xgboost" else "logreg"
+
+	classifier = RouteClassifier.train(texts, labels, EmbeddingService.create(ROUTER_EMBEDDING_MODEL), kind=kind)
+	classifier.save(Path(sys.argv[2]))
+	print(f"Trained {kind} on {len(texts)} examples, saved to {sys.argv[2]}")
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,62 @@
+"""Valkey cache of router decisions for repeated short queries"""
+
+import hashlib
+import logging
+from typing import Optional
+
+from glide import ExpirySet, ExpiryType, GlideClient
+
+from app.utils.embeddings import normalize_query
+
+logger = logging.getLogger(__name__)
+
+ROUTE_DECISION_TTL = 3600
+# Long queries rarely repeat verbatim, caching them only fills Valkey
+ROUTE_DECISION_MAX_QUERY_CHARS = 500
+
+class RouteDecisionCache:
+	"""
+	Maps (normalized query, router) -> graph node name, the decision of the router before any per request rule.
+	Failures are logged and treated as a miss, routing never fails because of the cache.
+	"""
+
+	def __init__(self, valkey_client: GlideClient, ttl: int = ROUTE_DECISION_TTL, max_query_chars: int = ROUTE_DECISION_MAX_QUERY_CHARS):
+		self.valkey_client = valkey_client
+		self.ttl = ttl
+		self.max_query_chars = max_query_chars
+
+		self.hits = 0
+		self.misses = 0
+
+	def cacheable(self, query: str) -> bool:
+		return 0 < len(query) <= self.max_query_chars
+
+	async def get(self, query: str, router: str) -> Optional[str]:
+		if not self.cacheable(query):
+			return None
+
+		try:
+			value = await self.valkey_client.get(self._key(query, router))
+		except Exception as e:
+			logger.warning(f"Failed to read cached route decision: {e}")
+			return None
+
+		if value is None:
+			self.misses += 1
+			return None
+
+		self.hits += 1
+		return value.decode() if isinstance(value, bytes) else str(value)
+
+	async def set(self, query: str, router: str, node: str):
+		if not self.cacheable(query):
+			return
+
+		try:
+			await self.valkey_client.set(self._key(query, router), node, expiry=ExpirySet(ExpiryType.SEC, self.ttl))
+		except Exception as e:
+			logger.warning(f"Failed to cache route decision: {e}")
+
+	def _key(self, query: str, router: str) -> str:
+		digest = hashlib.sha256(normalize_query(query).encode()).hexdigest()
+		return f"route_decision:{router}:{digest}"
@@ -0,0 +1,178 @@
+"""Semantic cache of final answers, so near-identical questions skip routing and generation"""
+
+import hashlib
+import logging
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Optional
+
+import numpy as np
+
+from app.utils.embeddings import normalize_query
+
+logger = logging.getLogger(__name__)
+
+SEMANTIC_CACHE_TTL = int(os.getenv("SEMANTIC_CACHE_TTL", 3600))
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.95))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", 10_000))
+# Long prompts are almost never repeated and depend on their details, only short questions are cached
+SEMANTIC_CACHE_MAX_QUERY_CHARS = 300
+
+def cache_scope(model: str, user_id: str, file_ids: list[str], used_retrieval: bool) -> str:
+	"""
+	Answers are only shared between requests with the same scope: same model, same attachments and
+	retrieval on or off. Greetings and FAQ answers are shared by every user, an answer shaped by
+	attachments or by the user's retrieved documents also needs the same user.
+	"""
+	parts = [model]
+	if file_ids:
+		parts.append("files:" + hashlib.blake2b(",".join(sorted(file_ids)).encode(), digest_size=8).hexdigest())
+	if used_retrieval:
+		parts.append("retrieval")
+	if file_ids or used_retrieval:
+		parts.append(f"user:{user_id}")
+	return "|".join(parts)
+
+@dataclass
+class _Scope:
+	vectors: np.ndarray # (capacity, dim), rows of free slots are zero
+	keys: list[Optional[str]] # slot -> entry key
+	size: int = 0
+
+@dataclass
+class _Entry:
+	scope: str
+	slot: int
+	answer: str
+	expires_at: float
+
+class SemanticResponseCache:
+	"""
+	In-process nearest neighbour cache of answers.
+
+	Each scope keeps a matrix of normalized query embeddings, a lookup is one matrix-vector product and
+	a hit needs cosine >= `threshold`. Entries expire after `ttl` seconds and the least recently used
+	entry is evicted once `max_entries` is reached (over all scopes).
+	"""
+
+	def __init__(
+		self,
+		embed_fn: Callable[[str], Awaitable[np.ndarray]],
+		threshold: float = SEMANTIC_CACHE_THRESHOLD,
+		ttl: float = SEMANTIC_CACHE_TTL,
+		max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES,
+		max_query_chars: int = SEMANTIC_CACHE_MAX_QUERY_CHARS
+	):
+		self.embed_fn = embed_fn
+		self.threshold = threshold
+		self.ttl = ttl
+		self.max_entries = max_entries
+		self.max_query_chars = max_query_chars
+
+		self._scopes: dict[str, _Scope] = {}
+		self._entries: OrderedDict[str, _Entry] = OrderedDict()
+
+		# Metrics
+		self.hits = 0
+		self.misses = 0
+		self.stores = 0
+		self.evictions = 0
+		self.expirations = 0
+
+	def cacheable(self, query: str) -> bool:
+		return 0 < len(query) <= self.max_query_chars
+
+	async def lookup(self, query: str, scope: str) -> Optional[str]:
+		"""The cached answer of the most similar query in the scope, None on a miss"""
+		if not self.cacheable(query):
+			return None
+
+		entries = self._scopes.get(scope)
+		if entries is None or not self._entries:
+			self.misses += 1
+			return None
+
+		vector = self._normalize(await self.embed_fn(query))
+		similarities = entries.vectors @ vector
+		now = time.monotonic()
+
+		# Best first, skipping expired entries (they are dropped on the way)
+		for slot in np.argsort(-similarities):
+			if similarities[slot] < self.threshold:
+				break
+			key = entries.keys[slot]
+			if key is None:
+				continue
+			entry = self._entries[key]
+			if entry.expires_at <= now:
+				self._remove(key)
+				self.expirations += 1
+				continue
+
+			self._entries.move_to_end(key)
+			self.hits += 1
+			logger.debug(f"Semantic cache hit ({similarities[slot]:.3f}) in scope {scope}")
+			return entry.answer
+
+		self.misses += 1
+		return None
+
+	async def store(self, query: str, scope: str, answer: str):
+		if not self.cacheable(query) or not answer:
+			return
+
+		vector = self._normalize(await self.embed_fn(query))
+		key = f"{scope}\0{normalize_query(query)}"
+		if key in self._entries:
+			self._remove(key)
+
+		while len(self._entries) >= self.max_entries:
+			oldest, _ = next(iter(self._entries.items()))
+			self._remove(oldest)
+			self.evictions += 1
+
+		entries = self._scopes.get(scope)
+		if entries is None:
+			entries = self._scopes[scope] = _Scope(vectors=np.zeros((8, vector.shape[0]), dtype=np.float32), keys=[None] * 8)
+
+		try:
+			slot = entries.keys.index(None)
+		except ValueError:
+			# Full, double the capacity
+			slot = len(entries.keys)
+			entries.vectors = np.vstack([entries.vectors, np.zeros_like(entries.vectors)])
+			entries.keys.extend([None] * slot)
+
+		entries.vectors[slot] = vector
+		entries.keys[slot] = key
+		entries.size += 1
+		self._entries[key] = _Entry(scope=scope, slot=slot, answer=answer, expires_at=time.monotonic() + self.ttl)
+		self.stores += 1
+
+	def stats(self) -> dict[str, float]:
+		lookups = self.hits + self.misses
+		return {
+			"hits": self.hits,
+			"misses": self.misses,
+			"hit_rate": self.hits / lookups if lookups else 0.0,
+			"stores": self.stores,
+			"evictions": self.evictions,
+			"expirations": self.expirations,
+			"entries": len(self._entries),
+		}
+
+	def _remove(self, key: str):
+		entry = self._entries.pop(key)
+		entries = self._scopes[entry.scope]
+		entries.vectors[entry.slot] = 0
+		entries.keys[entry.slot] = None
+		entries.size -= 1
+		# Per-user scopes come and go, don't keep their matrices around
+		if entries.size == 0:
+			del self._scopes[entry.scope]
+
+	def _normalize(self, vector: np.ndarray) -> np.ndarray:
+		vector = np.asarray(vector, dtype=np.float32).ravel()
+		return vector / (np.linalg.norm(vector) or 1.0)
@@ -0,0 +1,149 @@
+"""Single-flight coalescing: identical generations in flight at the same time run once and are fanned out"""
+
+import asyncio
+import hashlib
+import logging
+import os
+from typing import AsyncIterator, Callable, Generic, Optional, TypeVar
+
+from app.graph.state import RetrievedChunk
+from app.utils.embeddings import normalize_query
+
+logger = logging.getLogger(__name__)
+
+# Set to 0 to run every request on its own
+REQUEST_COALESCING = os.getenv("REQUEST_COALESCING", "1") != "0"
+
+T = TypeVar("T")
+
+def coalesce_key(model: str, user_text: str, retrieved_context: list[RetrievedChunk]) -> str:
+	"""Requests with the same key produce the same answer: same model, same question, same retrieved chunks"""
+	context = hashlib.blake2b(digest_size=8)
+	for chunk in retrieved_context:
+		context.update(chunk["chunk_id"].encode() + b"\0" + chunk["content"].encode() + b"\0")
+	question = hashlib.sha256(normalize_query(user_text).encode()).hexdigest()
+	return f"{model}|{question}|{context.hexdigest()}"
+
+class FanOutBuffer(Generic[T]):
+	"""
+	Every event of one generation, kept until it ends. Each subscriber reads it from the start,
+	so a late subscriber first gets what was produced before it joined, then follows live.
+	"""
+
+	def __init__(self):
+		self.items: list[T] = []
+		self.done = False
+		self.error: Optional[BaseException] = None
+		self._changed = asyncio.Event()
+
+	def append(self, item: T):
+		self.items.append(item)
+		self._notify()
+
+	def finish(self, error: Optional[BaseException] = None):
+		self.done = True
+		self.error = error
+		self._notify()
+
+	async def subscribe(self) -> AsyncIterator[T]:
+		index = 0
+		while True:
+			while index < len(self.items):
+				yield self.items[index]
+				index += 1
+			if self.done:
+				if self.error is not None:
+					raise self.error
+				return
+			await self._changed.wait()
+
+	def _notify(self):
+		# Wake the current waiters, the next ones wait on a fresh event
+		self._changed.set()
+		self._changed = asyncio.Event()
+
+class _Flight(Generic[T]):
+	def __init__(self):
+		self.buffer: FanOutBuffer[T] = FanOutBuffer()
+		self.subscribers = 0
+		self.task: Optional[asyncio.Task] = None
+
+class SingleFlight(Generic[T]):
+	"""
+	The first request for a key (the leader) runs `source()` in a task that fills a FanOutBuffer,
+	the requests arriving while it runs subscribe to the same buffer instead of generating again.
+	The generation keeps going when the leader's client disconnects, it is only cancelled when every
+	subscriber is gone. A finished flight is forgotten, the next request starts a new one.
+	Checking `in_flight` and calling `subscribe` without an await in between decides atomically
+	whether a request joins or leads.
+	"""
+
+	def __init__(self):
+		self._flights: dict[str, _Flight[T]] = {}
+
+		# Metrics
+		self.leaders = 0
+		self.followers = 0
+
+	def in_flight(self, key: str) -> bool:
+		return key in self._flights
+
+	def subscribe(self, key: str, source: Callable[[], AsyncIterator[T]], on_done: Optional[Callable[[], None]] = None) -> tuple[AsyncIterator[T], bool]:
+		"""
+		The events of the generation for `key` (started from `source` if none is running) and whether this call started it.
+		`on_done` is called when a generation started by this call ends, is cancelled or fails (e.g. to release
+		what the leader acquired for it), it is not used when the call joins a running one.
+		"""
+		flight = self._flights.get(key)
+		leader = flight is None
+		if flight is None:
+			flight = _Flight()
+			self._flights[key] = flight
+			flight.task = asyncio.create_task(self._run(key, flight, source))
+			if on_done is not None:
+				# Also runs when the task is cancelled before it started
+				flight.task.add_done_callback(lambda _: on_done())
+			self.leaders += 1
+		else:
+			self.followers += 1
+
+		flight.subscribers += 1
+		return self._follow(key, flight), leader
+
+	def stats(self) -> dict[str, float]:
+		total = self.leaders + self.followers
+		return {
+			"in_flight": len(self._flights),
+			"leaders": self.leaders,
+			"followers": self.followers,
+			"coalesced_rate": self.followers / total if total else 0.0,
+		}
+
+	async def _follow(self, key: str, flight: _Flight[T]) -> AsyncIterator[T]:
+		try:
+			async for item in flight.buffer.subscribe():
+				yield item
+		finally:
+			flight.subscribers -= 1
+			if flight.subscribers == 0 and not flight.buffer.done and flight.task:
+				# Nobody is listening anymore
+				flight.task.cancel()
+				self._forget(key, flight)
+
+	async def _run(self, key: str, flight: _Flight[T], source: Callable[[], AsyncIterator[T]]):
+		try:
+			async for item in source():
+				flight.buffer.append(item)
+		except asyncio.CancelledError:
+			flight.buffer.finish(asyncio.CancelledError())
+			raise
+		except Exception as e:
+			flight.buffer.finish(e)
+		else:
+			flight.buffer.finish()
+		finally:
+			self._forget(key, flight)
+
+	def _forget(self, key: str, flight: _Flight[T]):
+		if self._flights.get(key) is flight:
+			del self._flights[key]
@@ -0,0 +1,162 @@
+"""Shared token counting with one lazily loaded tokenizer per model family"""
+
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from langchain_core.messages import BaseMessage, SystemMessage
+
+logger = logging.getLogger(__name__)
+
+# Models of the same family share a vocabulary, so one tokenizer is loaded per family
+# instead of one per model. Ollama model names start with the family name (qwen3-vl:2b, gemma3:1b).
+MODEL_FAMILY_TOKENIZERS = {
+	"qwen": "Qwen/Qwen2.5-0.5B-Instruct",
+	"gemma": "google/gemma-3-1b-it",
+}
+# Anything else (and families whose tokenizer can't be downloaded) is counted with tiktoken
+DEFAULT_FAMILY = "default"
+
+class TokenCounter:
+	"""
+	Counts tokens with the tokenizer of the model family.
+
+	Tokenizers are only loaded the first time a family is counted (a download, so code on the
+	event loop awaits `load` first). Counts are kept in an LRU cache keyed by a hash of the
+	content so a message is tokenized once, not on every turn.
+	"""
+
+	def __init__(self, cache_size: int = 50_000):
+		self.cache_size = cache_size
+
+		self._tokenizers: dict[str, Callable[[str], int]] = {}
+		self._cache: OrderedDict[tuple[str, bytes], int] = OrderedDict()
+		# Counting also runs in worker threads (trim_messages), the LRU is only touched under its lock
+		self._cache_lock = threading.Lock()
+		self._lock = threading.Lock()
+
+	def model_family(self, model: Optional[str]) -> str:
+		if model:
+			name = model.lower()
+			for family in MODEL_FAMILY_TOKENIZERS:
+				if name.startswith(family):
+					return family
+		return DEFAULT_FAMILY
+
+	def count(self, text: str, model: Optional[str] = None) -> int:
+		if not text:
+			return 0
+
+		family = self.model_family(model)
+		key = (family, hashlib.blake2b(text.encode(), digest_size=16).digest())
+
+		with self._cache_lock:
+			cached = self._cache.get(key)
+			if cached is not None:
+				self._cache.move_to_end(key)
+				return cached
+
+		count = self._tokenizer(family)(text)
+
+		with self._cache_lock:
+			self._cache[key] = count
+			if len(self._cache) > self.cache_size:
+				self._cache.popitem(last=False)
+
+		return count
+
+	def count_message(self, msg: BaseMessage, model: Optional[str] = None) -> int:
+		return self.count(message_text(msg), model)
+
+	async def load(self, model: Optional[str] = None):
+		"""Loads the tokenizer of the model family on a worker thread, so counting won't block the event loop"""
+		family = self.model_family(model)
+		if family not in self._tokenizers:
+			await asyncio.to_thread(self._tokenizer, family)
+
+	def tokenizer(self, model: Optional[str] = None) -> Callable[[str], int]:
+		"""The (loaded) token counting function of the model family"""
+		return self._tokenizer(self.model_family(model))
+
+	def _tokenizer(self, family: str) -> Callable[[str], int]:
+		tokenizer = self._tokenizers.get(family)
+		if tokenizer is None:
+			# Loading a tokenizer is slow, make sure two threads don't load the same one
+			with self._lock:
+				tokenizer = self._tokenizers.get(family)
+				if tokenizer is None:
+					tokenizer = self._load_tokenizer(family)
+					self._tokenizers[family] = tokenizer
+		return tokenizer
+
+	def _load_tokenizer(self, family: str) -> Callable[[str], int]:
+		repo_id = MODEL_FAMILY_TOKENIZERS.get(family)
+		if repo_id:
+			try:
+				# Imported here, transformers is slow to import and only needed once per family
+				from transformers import AutoTokenizer
+
+				hf_tokenizer = AutoTokenizer.from_pretrained(repo_id)
+				logger.info(f"Loaded tokenizer {repo_id} for the {family} family")
+				return lambda text: len(hf_tokenizer.encode(text, add_special_tokens=False))
+			except Exception as e:
+				logger.warning(f"Failed to load tokenizer {repo_id}, using tiktoken for {family}: {e}")
+
+		try:
+			import tiktoken
+
+			encoding = tiktoken.get_encoding("cl100k_base")
+			return lambda text: len(encoding.encode(text, disallowed_special=()))
+		except Exception as e:
+			logger.warning(f"No tokenizer available for {family}, estimating 4 chars per token: {e}")
+			return lambda text: len(text) // 4
+
+def message_text(msg: BaseMessage) -> str:
+	"""The text parts of a message (multimodal content is a list of blocks)"""
+	if isinstance(msg.content, str):
+		return msg.content
+
+	return "".join(
+		block if isinstance(block, str) else str(block.get("text", ""))
+		for block in msg.content
+	)
+
+def trim_messages(
+	messages: list[BaseMessage],
+	max_tokens: int,
+	model: Optional[str] = None,
+	counter: Optional["TokenCounter"] = None
+) -> list[BaseMessage]:
+	"""
+	Trim messages to fit within token limit.
+
+	Strategy:
+	- Keep system messages
+	- Keep most recent messages
+	- Drop oldest messages first
+	"""
+	counter = counter or token_counter
+
+	system_msgs = [msg for msg in messages if isinstance(msg, SystemMessage)]
+	used_tokens = sum(counter.count_message(msg, model) for msg in system_msgs)
+
+	# Collected newest first and reversed once at the end
+	kept: list[BaseMessage] = []
+	for msg in reversed(messages):
+		if isinstance(msg, SystemMessage):
+			continue
+
+		msg_tokens = counter.count_message(msg, model)
+		if used_tokens + msg_tokens > max_tokens:
+			break
+
+		kept.append(msg)
+		used_tokens += msg_tokens
+
+	kept.reverse()
+	return system_msgs + kept
+
+token_counter = TokenCounter()
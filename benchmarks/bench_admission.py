@@ -0,0 +1,83 @@
+"""
+A request spike against one model backend, without admission control (before) and with it (after).
+
+The fake backend decodes PARALLEL streams at full speed and shares its throughput beyond that, so with
+N streams each one gets PARALLEL / N of a stream's speed (how Ollama behaves once its parallel slots
+and the GPU are saturated). A client gives up after DEADLINE_S. "before" sends every request at once,
+"after" goes through AdmissionController with the same deadline as the wait limit, a tenth of the
+requests are high priority. A few requests run before the spike, like the traffic that precedes one,
+so the controller knows how long a generation holds its slot.
+
+Run from the llm_service directory:
+	python -m benchmarks.bench_admission
+"""
+
+import asyncio
+import time
+
+import numpy as np
+
+from app.utils.admission import AdmissionController, AdmissionRejected, PRIORITIES
+
+PARALLEL = 4
+TOKENS = 50
+TOKEN_MS = 10
+SPIKE = 64
+DEADLINE_S = 3.0
+
+class FakeBackend:
+	def __init__(self):
+		self.streams = 0
+
+	async def generate(self):
+		self.streams += 1
+		try:
+			for _ in range(TOKENS):
+				await asyncio.sleep(TOKEN_MS / 1000 * max(1.0, self.streams / PARALLEL))
+		finally:
+			self.streams -= 1
+
+async def request(backend: FakeBackend, admission: AdmissionController | None, priority: int) -> tuple[str, float]:
+	start = time.perf_counter()
+	slot = None
+	try:
+		if admission is not None:
+			slot = await admission.acquire("fake", priority, timeout=DEADLINE_S)
+		await asyncio.wait_for(backend.generate(), timeout=DEADLINE_S - (time.perf_counter() - start))
+		return "ok", time.perf_counter() - start
+	except AdmissionRejected:
+		return "rejected", time.perf_counter() - start
+	except asyncio.TimeoutError:
+		return "timed out", time.perf_counter() - start
+	finally:
+		if slot is not None:
+			slot.release()
+
+async def spike(admission: AdmissionController | None) -> dict[str, float]:
+	backend = FakeBackend()
+	await asyncio.gather(*(request(backend, admission, PRIORITIES["normal"]) for _ in range(PARALLEL)))
+
+	priorities = [PRIORITIES["high"] if i % 10 == 0 else PRIORITIES["normal"] for i in range(SPIKE)]
+	results = await asyncio.gather(*(request(backend, admission, priority) for priority in priorities))
+
+	ok = [latency * 1000 for outcome, latency in results if outcome == "ok"]
+	high_ok = [latency * 1000 for (outcome, latency), priority in zip(results, priorities) if outcome == "ok" and priority == PRIORITIES["high"]]
+	failed = [latency * 1000 for outcome, latency in results if outcome != "ok"]
+	return {
+		"completed": len(ok),
+		"wasted": sum(1 for outcome, _ in results if outcome == "timed out"),
+		"rejected": sum(1 for outcome, _ in results if outcome == "rejected"),
+		"p50_ms": float(np.percentile(ok, 50)) if ok else float("nan"),
+		"high_p50_ms": float(np.percentile(high_ok, 50)) if high_ok else float("nan"),
+		"fail_after_ms": float(np.mean(failed)) if failed else float("nan"),
+	}
+
+async def main():
+	print(f"{SPIKE} requests at once, {PARALLEL} parallel slots, {TOKENS} tokens at {TOKEN_MS}ms, {DEADLINE_S}s deadline")
+	print(f"  {'':<8} {'completed':>9} {'timed out':>9} {'rejected':>8} {'p50 ms':>8} {'high p50':>9} {'fails after ms':>14}")
+	for name, admission in [("before", None), ("after", AdmissionController(limits={"fake": PARALLEL}))]:
+		r = await spike(admission)
+		print(f"  {name:<8} {r['completed']:>9} {r['wasted']:>9} {r['rejected']:>8} {r['p50_ms']:>8.0f} {r['high_p50_ms']:>9.0f} {r['fail_after_ms']:>14.0f}")
+
+if __name__ == "__main__":
+	asyncio.run(main())
@@ -0,0 +1,81 @@
+"""
+Compares the encodings available for cached history and file status events.
+
+Run from the llm_service directory:
+	python -m benchmarks.bench_codec
+"""
+
+import json
+import random
+import string
+import timeit
+
+from app.utils.codec import ValueCodec
+
+def _sentence(rng: random.Random, words: int) -> str:
+	return " ".join("".join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 9))) for _ in range(words))
+
+def history_messages(rng: random.Random, turns: int) -> list[dict]:
+	"""Messages shaped like the ones ConversationContextManager stores (one per list element)"""
+	messages = [{"t": "s", "c": "You are a helpful AI assistant."}]
+	for _ in range(turns):
+		messages.append({"t": "h", "c": _sentence(rng, rng.randint(5, 40))})
+		messages.append({"t": "a", "c": _sentence(rng, rng.randint(40, 400))})
+	return messages
+
+def legacy_history_messages(messages: list[dict]) -> list[dict]:
+	"""The same messages in the pre-codec layout (class name and long keys on every element)"""
+	names = {"s": "SystemMessage", "h": "HumanMessage", "a": "AIMessage"}
+	return [{"type": names[msg["t"]], "content": msg["c"], "additional_kwargs": {}} for msg in messages]
+
+def file_status_event(rng: random.Random) -> dict:
+	"""A status event as published by FileManager (JSON encoded field values)"""
+	return {
+		"file_id": json.dumps("".join(rng.choices(string.hexdigits, k=24))),
+		"status": json.dumps("processing"),
+		"progress": json.dumps(rng.random()),
+		"message": json.dumps("Embedding chunks"),
+		"s3_uri": json.dumps("https://reelzapp.s3.us-east-1.amazonaws.com/uploads/user/post/file.mp4"),
+		"file_name": json.dumps("file.mp4"),
+		"mime_type": json.dumps("video/mp4"),
+		"size_bytes": json.dumps(rng.randint(10_000, 50_000_000)),
+		"created_at": json.dumps("2026-01-01T10:00:00.000000")
+	}
+
+def bench(label: str, encode, decode, values: list, number: int = 20):
+	encoded = [encode(value) for value in values]
+	size = sum(len(value) for value in encoded)
+
+	encode_s = timeit.timeit(lambda: [encode(value) for value in values], number=number) / number
+	decode_s = timeit.timeit(lambda: [decode(value) for value in encoded], number=number) / number
+
+	per_value = 1e6 / len(values)
+	print(f"  {label:<28} {size:>10} B {encode_s * per_value:>9.2f} us/enc {decode_s * per_value:>9.2f} us/dec")
+
+def main():
+	rng = random.Random(7)
+
+	messages = history_messages(rng, turns=200)
+	legacy = legacy_history_messages(messages)
+	events = [file_status_event(rng) for _ in range(1000)]
+
+	codecs = {
+		"json": ValueCodec("json", compress_threshold=1 << 30),
+		"json+zstd(>1KB)": ValueCodec("json"),
+		"msgpack": ValueCodec("msgpack", compress_threshold=1 << 30),
+		"msgpack+zstd(>1KB)": ValueCodec("msgpack"),
+		"msgpack+zstd(>256B)": ValueCodec("msgpack", compress_threshold=256),
+	}
+
+	print(f"History: {len(messages)} messages, one value per message")
+	bench("legacy json (class names)", lambda value: json.dumps(value).encode(), json.loads, legacy)
+	for label, codec in codecs.items():
+		bench(label, codec.encode, codec.decode, messages)
+
+	print(f"\nFile status events: {len(events)} events")
+	bench("legacy json", lambda value: json.dumps(value).encode(), json.loads, events)
+	for label, codec in codecs.items():
+		bench(label, codec.encode, codec.decode, events)
+
+if __name__ == "__main__":
+	main()
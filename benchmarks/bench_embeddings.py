@@ -0,0 +1,97 @@
+"""
+PyTorch (SentenceTransformer) against int8 ONNX Runtime embedding backends on CPU.
+
+Each backend runs in its own process so the RSS numbers are not polluted by the other one.
+Reports single query latency, batch throughput, RSS after loading and peak RSS, then the
+cosine parity of the ONNX output against PyTorch.
+Needs sentence-transformers, transformers, torch, onnx and onnxruntime; the first ONNX run exports
+and quantizes the model into ONNX_CACHE_DIR.
+
+Run from the llm_service directory:
+	python -m benchmarks.bench_embeddings [model_name]
+"""
+
+import multiprocessing
+import resource
+import sys
+import time
+
+import numpy as np
+
+from app.utils.model_router import ROUTER_EMBEDDING_MODEL
+
+BATCH_SIZE = 32
+N_SINGLE = 200
+N_BATCHES = 20
+
+def sample_texts(n: int) -> list[str]:
+	subjects = ["the invoice", "my React component", "this quarterly report", "the login form", "a video of the meeting", "the Python script"]
+	actions = ["summarize", "fix the bug in", "extract the dates from", "explain", "translate", "find the trend in"]
+	return [f"Please {actions[i % len(actions)]} {subjects[(i // len(actions)) % len(subjects)]} #{i}" for i in range(n)]
+
+def rss_mb() -> float:
+	with open("/proc/self/status") as f:
+		for line in f:
+			if line.startswith("VmRSS:"):
+				return int(line.split()[1]) / 1024
+	return 0.0
+
+def run_backend(backend: str, model_name: str, results):
+	from app.utils.embedding_service import EmbeddingService
+
+	service = EmbeddingService.create(model_name, backend=backend)
+	texts = sample_texts(N_SINGLE)
+
+	start = time.perf_counter()
+	service.encode_now(texts[:1]) # loads the model
+	load_s = time.perf_counter() - start
+	loaded_rss = rss_mb()
+
+	latencies = []
+	for text in texts:
+		start = time.perf_counter()
+		service.encode_now([text])
+		latencies.append((time.perf_counter() - start) * 1000)
+
+	batches = [sample_texts(BATCH_SIZE * (i + 1))[-BATCH_SIZE:] for i in range(N_BATCHES)]
+	start = time.perf_counter()
+	for batch in batches:
+		service.encode_now(batch)
+	throughput = BATCH_SIZE * N_BATCHES / (time.perf_counter() - start)
+
+	results[backend] = {
+		"load_s": load_s,
+		"p50_ms": float(np.percentile(latencies, 50)),
+		"p99_ms": float(np.percentile(latencies, 99)),
+		"throughput": throughput,
+		"rss_mb": loaded_rss,
+		"peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+		"vectors": service.encode_now(texts[:64]),
+	}
+
+def main():
+	model_name = sys.argv[1] if len(sys.argv) > 1 else ROUTER_EMBEDDING_MODEL
+	context = multiprocessing.get_context("spawn")
+
+	with context.Manager() as manager:
+		results = manager.dict()
+		for backend in ["torch", "onnx"]:
+			process = context.Process(target=run_backend, args=(backend, model_name, results))
+			process.start()
+			process.join()
+			if process.exitcode != 0:
+				print(f"{backend} backend failed (exit code {process.exitcode})")
+				return
+		results = dict(results)
+
+	print(f"{model_name}, batch size {BATCH_SIZE}")
+	print(f"  {'backend':<8} {'load s':>8} {'p50 ms':>8} {'p99 ms':>8} {'texts/s':>9} {'RSS MB':>8} {'peak MB':>8}")
+	for backend, r in results.items():
+		print(f"  {backend:<8} {r['load_s']:>8.2f} {r['p50_ms']:>8.2f} {r['p99_ms']:>8.2f} {r['throughput']:>9.1f} {r['rss_mb']:>8.0f} {r['peak_rss_mb']:>8.0f}")
+
+	# Same check as app.utils.onnx_embeddings.check_parity, on the vectors computed above
+	cosines = (results["torch"]["vectors"] * results["onnx"]["vectors"]).sum(axis=1)
+	print(f"\nparity (cosine onnx vs torch): min {cosines.min():.4f}, mean {cosines.mean():.4f}")
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,87 @@
+"""
+Time to first token with a stalling primary model, without hedging (before) and with HedgedChatModel (after).
+
+The fake primary answers its first token in ~FAST_MS, except STALL_RATE of the requests that stall for
+STALL_MS (an overloaded Ollama node). The fallback is an idle model with the same speed. Reports the
+TTFT percentiles, the hedge rate (the extra load) and checks that every answer comes from one model only.
+
+Run from the llm_service directory:
+	python -m benchmarks.bench_hedging
+"""
+
+import asyncio
+import random
+import time
+from typing import Any
+
+import numpy as np
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from app.utils.hedging import HedgedChatModel, HedgePolicy
+
+FAST_MS = 50
+STALL_MS = 3000
+STALL_RATE = 0.03
+TOKENS = 10
+REQUESTS = 600
+CONCURRENCY = 20
+
+class FakeModel(BaseChatModel):
+	word: str
+	stall_rate: float = 0.0
+	started: int = 0
+
+	@property
+	def _llm_type(self) -> str:
+		return "fake"
+
+	def _generate(self, messages: list[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+		return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.word))])
+
+	async def _astream(self, messages: list[BaseMessage], stop=None, run_manager=None, **kwargs: Any):
+		self.started += 1
+		stall = random.random() < self.stall_rate
+		await asyncio.sleep((STALL_MS if stall else random.uniform(0.5, 1.5) * FAST_MS) / 1000)
+		for _ in range(TOKENS):
+			yield ChatGenerationChunk(message=AIMessageChunk(content=self.word + " "))
+			await asyncio.sleep(0.002)
+
+async def measure(model: BaseChatModel) -> list[float]:
+	semaphore = asyncio.Semaphore(CONCURRENCY)
+
+	async def one() -> float:
+		async with semaphore:
+			start = time.perf_counter()
+			ttft = None
+			words = set()
+			async for chunk in model.astream([HumanMessage("hi")]):
+				if ttft is None:
+					ttft = time.perf_counter() - start
+				words.update(str(chunk.content).split())
+			assert len(words) == 1, f"mixed answer: {words}"
+			return (ttft or 0.0) * 1000
+
+	return await asyncio.gather(*(one() for _ in range(REQUESTS)))
+
+async def main():
+	random.seed(0)
+
+	print(f"{REQUESTS} requests, {STALL_RATE:.0%} stall {STALL_MS}ms, first token otherwise ~{FAST_MS}ms")
+	print(f"  {'':<8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8} {'extra load':>11}")
+	primary = FakeModel(word="primary", stall_rate=STALL_RATE)
+	policy = HedgePolicy(max_rate=0.05)
+	for name, model in [
+		("before", primary),
+		("after", HedgedChatModel(primary=primary, fallback=FakeModel(word="fallback"), primary_name="primary", fallback_name="fallback", policy=policy)),
+	]:
+		primary.started = 0
+		ttfts = await measure(model)
+		extra = policy.hedges / REQUESTS if name == "after" else 0.0
+		p50, p95, p99 = np.percentile(ttfts, [50, 95, 99])
+		print(f"  {name:<8} {p50:>8.0f} {p95:>8.0f} {p99:>8.0f} {max(ttfts):>8.0f} {extra:>11.1%}")
+	print(f"  policy: {policy.stats()}")
+
+if __name__ == "__main__":
+	asyncio.run(main())
@@ -0,0 +1,54 @@
+"""
+Import-time cost of the service modules, from `python -X importtime` in a fresh interpreter.
+
+Prints the wall time of each import and the modules with the largest cumulative import time,
+so regressions (a heavy library imported at module level again) show up as new entries.
+
+Run from the llm_service directory:
+	python -m benchmarks.bench_import [module ...]
+"""
+
+import subprocess
+import sys
+import time
+
+DEFAULT_MODULES = ["app.graph.builder", "app.llm_service"]
+TOP = 15
+
+def import_profile(module: str) -> tuple[float, list[tuple[int, int, str]], str]:
+	"""Wall time (ms), [(self us, cumulative us, module)] and the error output if the import failed"""
+	start = time.perf_counter()
+	result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], capture_output=True, text=True)
+	wall_ms = (time.perf_counter() - start) * 1000
+
+	entries = []
+	errors = []
+	for line in result.stderr.splitlines():
+		if not line.startswith("import time:"):
+			errors.append(line)
+			continue
+		parts = line[len("import time:"):].split("|")
+		if len(parts) != 3 or not parts[0].strip().isdigit():
+			continue # header
+		entries.append((int(parts[0]), int(parts[1]), parts[2].rstrip()))
+
+	return wall_ms, entries, "\n".join(errors) if result.returncode else ""
+
+def main():
+	modules = sys.argv[1:] or DEFAULT_MODULES
+
+	for module in modules:
+		wall_ms, entries, error = import_profile(module)
+		if error:
+			print(f"{module}: import failed\n{error.strip().splitlines()[-1]}\n")
+			continue
+
+		total_ms = sum(self_us for self_us, _, _ in entries) / 1000
+		print(f"{module}: {wall_ms:.0f}ms wall (interpreter included), {total_ms:.0f}ms in imports, {len(entries)} modules")
+		print(f"  {'cumulative ms':>14} {'self ms':>9}  module")
+		for self_us, cumulative_us, name in sorted(entries, key=lambda e: e[1], reverse=True)[:TOP]:
+			print(f"  {cumulative_us / 1000:>14.1f} {self_us / 1000:>9.1f}  {name}")
+		print()
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,146 @@
+"""
+ChatOpenAICompatible against a local stub of an OpenAI compatible server (vLLM) streaming SSE chunks.
+
+First checks the client end to end (streamed text, usage, tool call chunks, structured output), then
+compares the pooled keep-alive session with a new session (and connection) per request: time to first
+token, total time and the TCP connections the server had to accept. On loopback a handshake is almost
+free and the timings are within noise, the connection count is what changes (every one of them is a
+TCP, and with TLS a TLS, handshake on a real network).
+
+Run from the llm_service directory:
+	python -m benchmarks.bench_openai_compatible
+"""
+
+import asyncio
+import json
+import time
+
+import numpy as np
+from aiohttp import web
+from langchain_core.messages import HumanMessage
+from pydantic import BaseModel
+
+from app.utils.providers import ChatOpenAICompatible, OpenAICompatibleClient, close_clients
+
+TOKENS = 20
+TOKEN_MS = 2
+REQUESTS = 400
+CONCURRENCY = 32
+
+class StubServer:
+	"""/v1/chat/completions streaming TOKENS words, or a tool call when tools are required"""
+
+	def __init__(self):
+		self.connections: set[tuple] = set() # client (host, port) of every connection
+		self.requests = 0
+
+	async def chat(self, request: web.Request) -> web.StreamResponse:
+		body = await request.json()
+		self.requests += 1
+		self.connections.add(request.transport.get_extra_info("peername")) # type: ignore[union-attr]
+
+		resp = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+		await resp.prepare(request)
+
+		async def send(payload):
+			await resp.write(f"data: {json.dumps(payload)}\n\n".encode())
+
+		def event(delta, finish_reason=None):
+			return {"id": "cmpl-1", "model": body["model"], "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+
+		await send(event({"role": "assistant", "content": ""}))
+		if body.get("tools") and body.get("tool_choice") == "required":
+			name = body["tools"][0]["function"]["name"]
+			await send(event({"tool_calls": [{"index": 0, "id": "call_1", "type": "function", "function": {"name": name, "arguments": "{\"node\": "}}]}))
+			await send(event({"tool_calls": [{"index": 0, "function": {"arguments": "\"fast_model\"}"}}]}))
+			await send(event({}, "tool_calls"))
+		else:
+			for i in range(TOKENS):
+				await asyncio.sleep(TOKEN_MS / 1000)
+				await send(event({"content": "word" if i == 0 else " word"}))
+			await send(event({}, "stop"))
+
+		# The usage event (stream_options.include_usage), then a comment line like vLLM's keep-alives
+		await send({"id": "cmpl-1", "model": body["model"], "choices": [], "usage": {"prompt_tokens": 5, "completion_tokens": TOKENS, "total_tokens": 5 + TOKENS}})
+		await resp.write(b": keep-alive\n\n")
+		await resp.write(b"data: [DONE]\n\n")
+		await resp.write_eof()
+		return resp
+
+async def serve(stub: StubServer) -> tuple[web.AppRunner, str]:
+	app = web.Application()
+	app.router.add_post("/v1/chat/completions", stub.chat)
+	runner = web.AppRunner(app)
+	await runner.setup()
+	site = web.TCPSite(runner, "127.0.0.1", 0)
+	await site.start()
+	port = site._server.sockets[0].getsockname()[1] # type: ignore[union-attr]
+	return runner, f"http://127.0.0.1:{port}/v1"
+
+class Route(BaseModel):
+	node: str
+
+async def check(base_url: str):
+	model = ChatOpenAICompatible(model="qwen3-vl:4b", base_url=base_url, temperature=0)
+
+	merged = None
+	async for chunk in model.astream([HumanMessage("hi")]):
+		merged = chunk if merged is None else merged + chunk
+	assert merged is not None
+	assert merged.content == " ".join(["word"] * TOKENS), merged.content
+	assert merged.usage_metadata and merged.usage_metadata["output_tokens"] == TOKENS
+
+	route = await model.with_structured_output(Route).ainvoke([HumanMessage("route me")])
+	assert isinstance(route, Route) and route.node == "fast_model", route
+	await close_clients()
+	print("  streamed text, usage, tool call chunks and structured output: ok")
+
+async def one(base_url: str, client: OpenAICompatibleClient) -> tuple[float, float]:
+	model = ChatOpenAICompatible(model="qwen3-vl:4b", base_url=base_url)
+	start = time.perf_counter()
+	first = None
+	async for chunk in model.astream([HumanMessage("hi")], client=client):
+		if first is None and chunk.content:
+			first = time.perf_counter() - start
+	return first or 0.0, time.perf_counter() - start
+
+async def load(base_url: str, pooled: bool) -> dict[str, float]:
+	semaphore = asyncio.Semaphore(CONCURRENCY)
+	shared = OpenAICompatibleClient(base_url)
+
+	async def request():
+		async with semaphore:
+			if pooled:
+				return await one(base_url, shared)
+			client = OpenAICompatibleClient(base_url)
+			try:
+				return await one(base_url, client)
+			finally:
+				await client.close()
+
+	start = time.perf_counter()
+	results = await asyncio.gather(*(request() for _ in range(REQUESTS)))
+	elapsed = time.perf_counter() - start
+	await shared.close()
+	return {
+		"ttft_p50_ms": float(np.percentile([r[0] for r in results], 50)) * 1000,
+		"total_p50_ms": float(np.percentile([r[1] for r in results], 50)) * 1000,
+		"requests_per_s": REQUESTS / elapsed,
+	}
+
+async def main():
+	print(f"stub server: {TOKENS} tokens at {TOKEN_MS}ms, {REQUESTS} requests, {CONCURRENCY} concurrent")
+	for name, pooled in [("session per request", False), ("pooled session", True)]:
+		stub = StubServer()
+		runner, base_url = await serve(stub)
+		try:
+			if pooled:
+				await check(base_url)
+				stub.connections.clear()
+			r = await load(base_url, pooled)
+		finally:
+			await runner.cleanup()
+		print(f"  {name:<20} TTFT p50 {r['ttft_p50_ms']:>6.1f}ms  total p50 {r['total_p50_ms']:>6.1f}ms  {r['requests_per_s']:>6.0f} req/s  {len(stub.connections):>4} connections")
+
+if __name__ == "__main__":
+	asyncio.run(main())
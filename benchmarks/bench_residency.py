@@ -0,0 +1,114 @@
+"""
+Cold model loads with Ollama's fixed keep_alive (before) against ModelResidencyManager (after).
+
+A fake Ollama server (aiohttp) implements /api/generate and /api/ps: a request to an unloaded model
+pays LOAD_MS, a loaded model stays resident for the keep_alive of its last request. Time is scaled,
+one simulated second lasts SCALE real seconds, so an hour of traffic replays in a few seconds.
+The traffic is one model requested every few minutes (exponential gaps), the kind of load a 5 minute
+keep_alive keeps unloading. "after" also checks how often `is_warm` agrees with the server.
+
+Run from the llm_service directory:
+	python -m benchmarks.bench_residency
+"""
+
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from aiohttp import ClientSession, web
+
+from app.utils.model_residency import MIN_KEEP_ALIVE, ModelResidencyManager
+
+SCALE = 0.001
+LOAD_MS = 40
+REQUESTS = 40
+MEAN_GAP = 420 # simulated seconds
+MODEL = "qwen3-vl:2b"
+
+def clock() -> float:
+	"""Simulated seconds"""
+	return time.monotonic() / SCALE
+
+class FakeOllama:
+	def __init__(self):
+		self.expires: dict[str, float] = {} # model -> simulated unload time
+		self.loads = 0
+
+	def resident(self, model: str) -> bool:
+		return self.expires.get(model, 0.0) > clock()
+
+	async def generate(self, request: web.Request) -> web.Response:
+		body = await request.json()
+		model = body["model"]
+		if not self.resident(model):
+			self.loads += 1
+			await asyncio.sleep(LOAD_MS / 1000)
+		self.expires[model] = clock() + float(body.get("keep_alive", MIN_KEEP_ALIVE))
+		return web.json_response({"model": model, "response": "", "done": True})
+
+	async def ps(self, request: web.Request) -> web.Response:
+		now = clock()
+		models = [
+			# Reported in simulated seconds from now, the manager only uses the distance
+			{"name": model, "model": model, "expires_at": (datetime.now(timezone.utc) + timedelta(seconds=expires - now)).isoformat()}
+			for model, expires in self.expires.items() if expires > now
+		]
+		return web.json_response({"models": models})
+
+async def serve(fake: FakeOllama) -> tuple[web.AppRunner, str]:
+	app = web.Application()
+	app.router.add_post("/api/generate", fake.generate)
+	app.router.add_get("/api/ps", fake.ps)
+	runner = web.AppRunner(app)
+	await runner.setup()
+	site = web.TCPSite(runner, "127.0.0.1", 0)
+	await site.start()
+	port = site._server.sockets[0].getsockname()[1] # type: ignore[union-attr]
+	return runner, f"http://127.0.0.1:{port}"
+
+async def replay(gaps: np.ndarray, adaptive: bool) -> dict[str, float]:
+	fake = FakeOllama()
+	runner, host = await serve(fake)
+	manager = ModelResidencyManager([MODEL], host=host, poll_interval=0.05, clock=clock)
+	latencies, agreement = [], []
+
+	try:
+		if adaptive:
+			await manager.start()
+		async with ClientSession() as session:
+			for gap in gaps:
+				await asyncio.sleep(gap * SCALE)
+				if adaptive:
+					agreement.append(manager.is_warm(MODEL) == fake.resident(MODEL))
+					manager.record_request(MODEL)
+					keep_alive = manager.keep_alive(MODEL)
+				else:
+					keep_alive = MIN_KEEP_ALIVE
+
+				start = time.perf_counter()
+				async with session.post(f"{host}/api/generate", json={"model": MODEL, "prompt": "hi", "keep_alive": keep_alive}) as resp:
+					await resp.read()
+				latencies.append((time.perf_counter() - start) * 1000)
+	finally:
+		await manager.stop()
+		await runner.cleanup()
+
+	return {
+		"cold_loads": fake.loads,
+		"p50_ms": float(np.percentile(latencies, 50)),
+		"mean_ms": float(np.mean(latencies)),
+		"is_warm_agreement": float(np.mean(agreement)) if agreement else float("nan"),
+	}
+
+async def main():
+	gaps = np.random.default_rng(0).exponential(MEAN_GAP, REQUESTS)
+	print(f"{REQUESTS} requests, mean gap {MEAN_GAP}s (simulated), cold load {LOAD_MS}ms")
+	print(f"  {'keep_alive':<22} {'cold loads':>10} {'p50 ms':>8} {'mean ms':>8} {'is_warm agrees':>15}")
+	for name, adaptive in [("before (fixed 5m)", False), ("after (residency)", True)]:
+		result = await replay(gaps, adaptive)
+		agreement = f"{result['is_warm_agreement']:.0%}" if adaptive else "-"
+		print(f"  {name:<22} {result['cold_loads']:>10} {result['p50_ms']:>8.1f} {result['mean_ms']:>8.1f} {agreement:>15}")
+
+if __name__ == "__main__":
+	asyncio.run(main())
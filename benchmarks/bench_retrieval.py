@@ -0,0 +1,138 @@
+"""
+Recall@k against latency for the retrieval methods on a synthetic corpus.
+
+The corpus mixes topical text with exact identifiers (usernames, error codes). The dense
+encoder only sees the topic words (like a real embedding model it blurs rare identifiers)
+and BM25 sees every token, which is the gap hybrid retrieval is meant to close.
+Both searches run in memory, the fusion is the same reciprocal_rank_fusion used in
+ConversationContextManager.retrieve_context.
+
+Run from the llm_service directory:
+	python -m benchmarks.bench_retrieval
+"""
+
+import math
+import random
+import string
+import time
+from collections import Counter
+
+import numpy as np
+
+from app.utils.rank_fusion import reciprocal_rank_fusion
+
+N_DOCS = 5000
+N_TOPICS = 50
+DIM = 128
+K = 5
+
+def build_corpus(rng: random.Random):
+	topic_words = [[f"t{topic}w{i}" for i in range(30)] for topic in range(N_TOPICS)]
+	docs, doc_topics, doc_ids = [], [], []
+
+	for _ in range(N_DOCS):
+		topic = rng.randrange(N_TOPICS)
+		identifier = "".join(rng.choices(string.ascii_lowercase + string.digits, k=10))
+		words = rng.choices(topic_words[topic], k=40) + [identifier]
+		rng.shuffle(words)
+		docs.append(words)
+		doc_topics.append(topic)
+		doc_ids.append(identifier)
+
+	return topic_words, docs, doc_topics, doc_ids
+
+def build_queries(rng: random.Random, docs, doc_ids, n: int = 300):
+	"""Half semantic queries (topic words of a document), half identifier lookups"""
+	queries = []
+	for i in range(n):
+		target = rng.randrange(N_DOCS)
+		if i % 2 == 0:
+			words = rng.sample([w for w in docs[target] if w != doc_ids[target]], 8)
+		else:
+			words = ["what", "does", doc_ids[target], "mean"]
+		queries.append((words, target))
+	return queries
+
+class DenseIndex:
+	def __init__(self, docs, rng: np.random.Generator):
+		self.word_vectors: dict[str, np.ndarray] = {}
+		self.rng = rng
+		matrix = np.stack([self.embed(doc) for doc in docs])
+		self.matrix = matrix
+
+	def _word_vector(self, word: str) -> np.ndarray:
+		if word not in self.word_vectors:
+			self.word_vectors[word] = self.rng.standard_normal(DIM).astype(np.float32)
+		return self.word_vectors[word]
+
+	def embed(self, words) -> np.ndarray:
+		# Identifiers are out of vocabulary for the "model" and contribute nothing
+		vectors = [self._word_vector(w) for w in words if w.startswith("t")]
+		vector = np.mean(vectors, axis=0) if vectors else np.zeros(DIM, dtype=np.float32)
+		return vector / (np.linalg.norm(vector) or 1.0)
+
+	def search(self, words, limit: int) -> list[int]:
+		scores = self.matrix @ self.embed(words)
+		top = np.argpartition(-scores, limit)[:limit]
+		return top[np.argsort(-scores[top])].tolist()
+
+class BM25Index:
+	def __init__(self, docs, k1: float = 1.2, b: float = 0.75):
+		self.k1, self.b = k1, b
+		self.postings: dict[str, list[tuple[int, int]]] = {}
+		self.doc_len = np.array([len(doc) for doc in docs], dtype=np.float32)
+		self.avg_len = float(self.doc_len.mean())
+
+		for doc_id, doc in enumerate(docs):
+			for word, tf in Counter(doc).items():
+				self.postings.setdefault(word, []).append((doc_id, tf))
+
+		self.idf = {
+			word: math.log(1 + (len(docs) - len(p) + 0.5) / (len(p) + 0.5))
+			for word, p in self.postings.items()
+		}
+
+	def search(self, words, limit: int) -> list[int]:
+		scores: dict[int, float] = {}
+		for word in set(words):
+			for doc_id, tf in self.postings.get(word, ()):
+				norm = tf + self.k1 * (1 - self.b + self.b * self.doc_len[doc_id] / self.avg_len)
+				scores[doc_id] = scores.get(doc_id, 0.0) + self.idf[word] * tf * (self.k1 + 1) / norm
+		return [doc_id for doc_id, _ in sorted(scores.items(), key=lambda e: e[1], reverse=True)[:limit]]
+
+def main():
+	rng = random.Random(11)
+	_, docs, _, doc_ids = build_corpus(rng)
+	queries = build_queries(rng, docs, doc_ids)
+
+	dense = DenseIndex(docs, np.random.default_rng(11))
+	bm25 = BM25Index(docs)
+
+	methods = {
+		"vector_search": lambda words: dense.search(words, K),
+		"keyword": lambda words: bm25.search(words, K),
+		"hybrid": lambda words: [
+			doc for doc, _ in reciprocal_rank_fusion([dense.search(words, K * 3), bm25.search(words, K * 3)], limit=K)
+		],
+	}
+
+	print(f"{N_DOCS} docs, {len(queries)} queries (half semantic, half identifier lookups), k={K}")
+	print(f"  {'method':<14} {'recall@k':>9} {'semantic':>9} {'ident.':>9} {'p50 ms':>8} {'p99 ms':>8}")
+
+	for name, search in methods.items():
+		hits = {"semantic": 0, "identifier": 0}
+		latencies = []
+		for i, (words, target) in enumerate(queries):
+			start = time.perf_counter()
+			results = search(words)
+			latencies.append((time.perf_counter() - start) * 1000)
+			if target in results:
+				hits["semantic" if i % 2 == 0 else "identifier"] += 1
+
+		half = len(queries) / 2
+		p50, p99 = np.percentile(latencies, [50, 99])
+		recall = (hits["semantic"] + hits["identifier"]) / len(queries)
+		print(f"  {name:<14} {recall:>9.3f} {hits['semantic'] / half:>9.3f} {hits['identifier'] / half:>9.3f} {p50:>8.3f} {p99:>8.3f}")
+
+if __name__ == "__main__":
+	main()
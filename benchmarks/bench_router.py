@@ -0,0 +1,115 @@
+"""
+Per-query cost of ModelRouter intent detection.
+
+Compares the stacked-matrix _detect_intent (single queries and whole batches) against the old
+approach of one cosine similarity call per intent. The embedding model is replaced by random
+unit vectors so only the classification itself is timed.
+
+Also times ModelRouter construction with a cold and a warm on-disk intent embedding cache.
+Set BENCH_REAL_MODEL=1 to use the real sentence-transformers model for that part.
+
+Run from the llm_service directory:
+	python -m benchmarks.bench_router
+"""
+
+import os
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from app.utils.embedding_service import EmbeddingService
+from app.utils.model_router import ROUTER_EMBEDDING_MODEL, ModelRouter
+
+DIM = 384 # all-MiniLM-L6-v2
+N_QUERIES = 2000
+BATCH_SIZES = [1, 8, 32, 128]
+
+def random_encoder(rng: np.random.Generator):
+	def encode_batch(texts: list[str]) -> np.ndarray:
+		vectors = rng.standard_normal((len(texts), DIM)).astype(np.float32)
+		return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+	return encode_batch
+
+def cosine_similarity(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+	# What sklearn.metrics.pairwise.cosine_similarity does: normalize both sides on every call
+	a = a / np.linalg.norm(a, axis=1, keepdims=True)
+	b = b / np.linalg.norm(b, axis=1, keepdims=True)
+	return a @ b.T
+
+def per_intent_loop(router: ModelRouter, per_intent: dict[str, np.ndarray], query: np.ndarray, threshold: float = 0.4) -> str:
+	best_intent, best_score = "UNKNOWN", -1.0
+	for intent, examples in per_intent.items():
+		score = float(cosine_similarity(query.reshape(1, -1), examples).max())
+		if score > best_score:
+			best_intent, best_score = intent, score
+	return best_intent if best_score >= threshold else "UNKNOWN"
+
+def main():
+	rng = np.random.default_rng(12)
+	router = ModelRouter(EmbeddingService(random_encoder(rng), name="bench"), cache_dir=None)
+	queries = random_encoder(rng)([""] * N_QUERIES)
+
+	per_intent = {
+		intent: router.intent_matrix[router.intent_index == i]
+		for i, intent in enumerate(router.intent_names)
+	}
+
+	# Both implementations agree (random vectors score below the real threshold, so compare the argmax)
+	vectorized = [intent for intent, _ in router._detect_intent(queries, threshold=-1.0)]
+	looped = [per_intent_loop(router, per_intent, query, threshold=-1.0) for query in queries]
+	assert vectorized == looped
+
+	print(f"{len(router.intent_names)} intents, {router.intent_matrix.shape[0]} examples, dim {DIM}, {N_QUERIES} queries")
+	print(f"  {'method':<28} {'us/query':>10}")
+
+	start = time.perf_counter()
+	for query in queries:
+		per_intent_loop(router, per_intent, query)
+	print(f"  {'per-intent loop':<28} {(time.perf_counter() - start) / N_QUERIES * 1e6:>10.2f}")
+
+	for batch_size in BATCH_SIZES:
+		start = time.perf_counter()
+		for i in range(0, N_QUERIES, batch_size):
+			router._detect_intent(queries[i:i + batch_size] if batch_size > 1 else queries[i])
+		label = "matrix, single query" if batch_size == 1 else f"matrix, batch of {batch_size}"
+		print(f"  {label:<28} {(time.perf_counter() - start) / N_QUERIES * 1e6:>10.2f}")
+
+	# The full sync routing path (intent + capability rules + decision dict)
+	start = time.perf_counter()
+	for query in queries:
+		router.route_embedding(query, None, None)
+	print(f"  {'route_embedding':<28} {(time.perf_counter() - start) / N_QUERIES * 1e6:>10.2f}")
+
+	startup(rng)
+
+def startup(rng: np.random.Generator):
+	"""Router construction time, cold cache (encodes the examples) against warm cache (mmap)"""
+	def make_service() -> EmbeddingService:
+		if os.getenv("BENCH_REAL_MODEL"):
+			return EmbeddingService.from_sentence_transformer(ROUTER_EMBEDDING_MODEL)
+		return EmbeddingService(random_encoder(rng), name="bench")
+
+	print("\nrouter startup")
+	print(f"  {'cache':<28} {'ms':>10} {'encodes':>8}")
+	with tempfile.TemporaryDirectory() as cache_dir:
+		for label in ["cold", "warm"]:
+			service = make_service()
+			encodes = 0
+			encode_batch = service.encode_batch
+
+			def counting_encode(texts: list[str]) -> np.ndarray:
+				nonlocal encodes
+				encodes += 1
+				return encode_batch(texts)
+
+			service.encode_batch = counting_encode
+			start = time.perf_counter()
+			router = ModelRouter(service, cache_dir=Path(cache_dir))
+			elapsed = (time.perf_counter() - start) * 1000
+			print(f"  {label:<28} {elapsed:>10.3f} {encodes:>8}")
+			assert isinstance(router.intent_matrix, np.memmap)
+
+if __name__ == "__main__":
+	main()
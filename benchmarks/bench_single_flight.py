@@ -0,0 +1,70 @@
+"""
+A burst of identical questions (a viral post), every request generating (before) against SingleFlight (after).
+
+The fake backend decodes PARALLEL streams at full speed and shares its throughput beyond that.
+REQUESTS identical requests arrive over ARRIVAL_S, every generation produces TOKENS tokens.
+Reports the generations the backend ran and the time to the full answer for the clients.
+
+Run from the llm_service directory:
+	python -m benchmarks.bench_single_flight
+"""
+
+import asyncio
+import time
+
+import numpy as np
+
+from app.utils.single_flight import SingleFlight
+
+PARALLEL = 4
+TOKENS = 100
+TOKEN_MS = 10
+REQUESTS = 50
+ARRIVAL_S = 1.0
+
+class FakeBackend:
+	def __init__(self):
+		self.streams = 0
+		self.generations = 0
+
+	async def generate(self):
+		self.generations += 1
+		self.streams += 1
+		try:
+			for i in range(TOKENS):
+				await asyncio.sleep(TOKEN_MS / 1000 * max(1.0, self.streams / PARALLEL))
+				yield f"token{i} "
+		finally:
+			self.streams -= 1
+
+async def client(backend: FakeBackend, single_flight: SingleFlight | None, delay: float) -> tuple[float, str]:
+	await asyncio.sleep(delay)
+	start = time.perf_counter()
+	if single_flight is None:
+		tokens = backend.generate()
+	else:
+		tokens, _ = single_flight.subscribe("qwen3-vl:2b|question|context", backend.generate)
+	answer = "".join([token async for token in tokens])
+	return time.perf_counter() - start, answer
+
+async def run(single_flight: SingleFlight | None) -> dict[str, float]:
+	backend = FakeBackend()
+	delays = np.linspace(0, ARRIVAL_S, REQUESTS)
+	results = await asyncio.gather(*(client(backend, single_flight, delay) for delay in delays))
+	latencies = [latency * 1000 for latency, _ in results]
+	assert all(answer == results[0][1] for _, answer in results)
+	return {
+		"generations": backend.generations,
+		"p50_ms": float(np.percentile(latencies, 50)),
+		"p95_ms": float(np.percentile(latencies, 95)),
+	}
+
+async def main():
+	print(f"{REQUESTS} identical requests over {ARRIVAL_S}s, {TOKENS} tokens at {TOKEN_MS}ms, {PARALLEL} parallel slots")
+	print(f"  {'':<8} {'generations':>11} {'p50 ms':>8} {'p95 ms':>8}")
+	for name, single_flight in [("before", None), ("after", SingleFlight())]:
+		r = await run(single_flight)
+		print(f"  {name:<8} {r['generations']:>11} {r['p50_ms']:>8.0f} {r['p95_ms']:>8.0f}")
+
+if __name__ == "__main__":
+	asyncio.run(main())
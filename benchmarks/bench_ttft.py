@@ -0,0 +1,110 @@
+"""
+Time to first token of the agent nodes, blocking invoke (before) against token streaming (after).
+
+A fake chat model stands in for Ollama and produces N_TOKENS tokens at a fixed decode rate, so the
+numbers only reflect how the graph delivers tokens. "before" is the old node (sync `invoke`, the
+graph streamed in "updates" mode, the client sees the answer when the node returns), "after" is
+make_agent_node streamed in "messages" mode like LLMChat.
+
+Run from the llm_service directory:
+	python -m benchmarks.bench_ttft
+"""
+
+import asyncio
+import time
+from typing import Annotated, Any, TypedDict
+
+import numpy as np
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langgraph.graph import END, StateGraph
+from langgraph.graph.message import add_messages
+
+from app.graph.nodes.agent import make_agent_node
+from app.graph.prompts import agent_prompt_template
+from app.utils.model_registry import model_registry
+
+N_TOKENS = 100
+TOKEN_MS = 10
+RUNS = 5
+CONCURRENCY = [1, 8]
+
+class FakeDecoder(BaseChatModel):
+	"""Produces N_TOKENS words, one every TOKEN_MS"""
+
+	@property
+	def _llm_type(self) -> str:
+		return "fake-decoder"
+
+	def bind_tools(self, tools, **kwargs: Any):
+		return self
+
+	def _generate(self, messages: list[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+		time.sleep(N_TOKENS * TOKEN_MS / 1000)
+		return ChatResult(generations=[ChatGeneration(message=AIMessage(content=" ".join(["token"] * N_TOKENS)))])
+
+	async def _astream(self, messages: list[BaseMessage], stop=None, run_manager=None, **kwargs: Any):
+		for i in range(N_TOKENS):
+			await asyncio.sleep(TOKEN_MS / 1000)
+			chunk = ChatGenerationChunk(message=AIMessageChunk(content="token" if i == 0 else " token"))
+			if run_manager:
+				await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+			yield chunk
+
+class State(TypedDict):
+	messages: Annotated[list[BaseMessage], add_messages]
+
+def build(node) -> Any:
+	workflow = StateGraph(State)
+	workflow.add_node("fast_model", node)
+	workflow.set_entry_point("fast_model")
+	workflow.add_edge("fast_model", END)
+	return workflow.compile()
+
+def blocking_node():
+	agent = agent_prompt_template.partial(tools="") | FakeDecoder()
+
+	def agent_node(state: State):
+		return {"messages": [agent.invoke({"messages": state["messages"]})]}
+
+	return agent_node
+
+async def first_token_before(graph) -> tuple[float, float]:
+	start = time.perf_counter()
+	first = None
+	async for update in graph.astream({"messages": [("user", "hi")]}, stream_mode="updates"):
+		if first is None and "fast_model" in update:
+			first = time.perf_counter() - start
+	return first or 0.0, time.perf_counter() - start
+
+async def first_token_after(graph) -> tuple[float, float]:
+	start = time.perf_counter()
+	first = None
+	async for chunk, metadata in graph.astream({"messages": [("user", "hi")]}, stream_mode="messages"):
+		if first is None and metadata.get("langgraph_node") == "fast_model" and chunk.content:
+			first = time.perf_counter() - start
+	return first or 0.0, time.perf_counter() - start
+
+async def measure(graph, first_token, concurrency: int) -> tuple[float, float]:
+	ttfts, totals = [], []
+	for _ in range(RUNS):
+		for ttft, total in await asyncio.gather(*(first_token(graph) for _ in range(concurrency))):
+			ttfts.append(ttft * 1000)
+			totals.append(total * 1000)
+	return float(np.percentile(ttfts, 50)), float(np.percentile(totals, 50))
+
+async def main():
+	model_registry.register("fake-decoder", FakeDecoder())
+	before = build(blocking_node())
+	after = build(make_agent_node("fake-decoder", [], agent_prompt_template, max_context_tokens=32_000))
+
+	print(f"{N_TOKENS} tokens at {TOKEN_MS}ms/token, {RUNS} runs")
+	print(f"  {'node':<26} {'streams':>8} {'TTFT p50 ms':>12} {'total p50 ms':>13}")
+	for concurrency in CONCURRENCY:
+		for name, graph, first_token in [("before (invoke/updates)", before, first_token_before), ("after (astream/messages)", after, first_token_after)]:
+			ttft, total = await measure(graph, first_token, concurrency)
+			print(f"  {name:<26} {concurrency:>8} {ttft:>12.1f} {total:>13.1f}")
+
+if __name__ == "__main__":
+	asyncio.run(main())
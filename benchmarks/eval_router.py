@@ -0,0 +1,101 @@
+"""
+Accuracy and latency of the routing modes on a labeled set.
+
+The classifier is scored with stratified k-fold cross validation (every example is predicted by
+a model that never saw it), or on the whole set when a trained model file is given. The LLM
+router (gemma3:1b through Ollama) is scored on the same examples.
+Latency is per query and includes embedding the query.
+
+Run from the llm_service directory:
+	python -m benchmarks.eval_router [--labels benchmarks/data/router_labels.jsonl] [--model route_classifier.joblib] [--kind logreg|xgboost] [--no-llm]
+"""
+
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+
+from app.utils.embedding_service import EmbeddingService
+from app.utils.model_router import ROUTER_EMBEDDING_MODEL
+from app.utils.route_classifier import ROUTE_LABELS, RouteClassifier, load_labeled
+
+FOLDS = 5
+
+def report(name: str, labels: list[str], predictions: list[str], latencies_ms: list[float]):
+	accuracy = np.mean([p == l for p, l in zip(predictions, labels)])
+	per_label = "  ".join(
+		f"{label} {np.mean([p == l for p, l in zip(predictions, labels) if l == label]):.2f}"
+		for label in ROUTE_LABELS if label in labels
+	)
+	p50, p99 = np.percentile(latencies_ms, [50, 99])
+	print(f"  {name:<22} {accuracy:>9.3f} {p50:>9.2f} {p99:>9.2f}   {per_label}")
+
+def stratified_folds(labels: list[str], folds: int, seed: int = 15) -> list[np.ndarray]:
+	rng = np.random.default_rng(seed)
+	assignment = np.empty(len(labels), dtype=int)
+	for label in set(labels):
+		indices = np.flatnonzero(np.array(labels) == label)
+		rng.shuffle(indices)
+		assignment[indices] = np.arange(len(indices)) % folds
+	return [np.flatnonzero(assignment == fold) for fold in range(folds)]
+
+def timed_predictions(classifier: RouteClassifier, texts: list[str]) -> tuple[list[str], list[float]]:
+	predictions, latencies = [], []
+	for text in texts:
+		start = time.perf_counter()
+		predictions.append(classifier.predict([text])[0][0])
+		latencies.append((time.perf_counter() - start) * 1000)
+	return predictions, latencies
+
+def evaluate_classifier(texts: list[str], labels: list[str], embedding_service: EmbeddingService, kind: str, model_path: Path | None):
+	if model_path:
+		return timed_predictions(RouteClassifier.load(model_path, embedding_service), texts)
+
+	predictions: list[str] = [""] * len(texts)
+	latencies: list[float] = [0.0] * len(texts)
+	for test_indices in stratified_folds(labels, FOLDS):
+		test = set(test_indices.tolist())
+		train = [i for i in range(len(texts)) if i not in test]
+		classifier = RouteClassifier.train([texts[i] for i in train], [labels[i] for i in train], embedding_service, kind=kind) # type: ignore[arg-type]
+
+		fold_predictions, fold_latencies = timed_predictions(classifier, [texts[i] for i in test_indices])
+		for i, prediction, latency in zip(test_indices, fold_predictions, fold_latencies):
+			predictions[i] = prediction
+			latencies[i] = latency
+
+	return predictions, latencies
+
+def evaluate_llm(texts: list[str]) -> tuple[list[str], list[float]]:
+	from app.graph.router import llm_route
+
+	predictions, latencies = [], []
+	for text in texts:
+		start = time.perf_counter()
+		predictions.append(llm_route(text))
+		latencies.append((time.perf_counter() - start) * 1000)
+	return predictions, latencies
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--labels", type=Path, default=Path(__file__).parent / "data" / "router_labels.jsonl")
+	parser.add_argument("--model", type=Path, default=None, help="trained model file, cross validation when omitted")
+	parser.add_argument("--kind", choices=["logreg", "xgboost"], default="logreg")
+	parser.add_argument("--no-llm", action="store_true", help="skip the LLM router (no Ollama needed)")
+	args = parser.parse_args()
+
+	texts, labels = load_labeled(args.labels)
+	embedding_service = EmbeddingService.create(ROUTER_EMBEDDING_MODEL)
+	embedding_service.encode_now(texts[:1]) # load the model outside of the timings
+
+	print(f"{len(texts)} labeled queries from {args.labels}")
+	print(f"  {'router':<22} {'accuracy':>9} {'p50 ms':>9} {'p99 ms':>9}   per label accuracy")
+
+	name = f"classifier ({args.kind})" if not args.model else f"classifier ({args.model.name})"
+	report(name, labels, *evaluate_classifier(texts, labels, embedding_service, args.kind, args.model))
+
+	if not args.no_llm:
+		report("llm (gemma3:1b)", labels, *evaluate_llm(texts))
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,57 @@
+"""HedgedChatModel with fake models: the race, an empty answer and the closing of the streams"""
+
+import asyncio
+from typing import Any
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from app.utils.hedging import HedgedChatModel, HedgePolicy
+
+class FakeModel(BaseChatModel):
+	words: list[str]
+	delay: float = 0.0
+	closed: int = 0
+
+	@property
+	def _llm_type(self) -> str:
+		return "fake"
+
+	def _generate(self, messages: list[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+		return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(self.words)))])
+
+	async def _astream(self, messages: list[BaseMessage], stop=None, run_manager=None, **kwargs: Any):
+		try:
+			await asyncio.sleep(self.delay)
+			for word in self.words:
+				yield ChatGenerationChunk(message=AIMessageChunk(content=word))
+		finally:
+			self.closed += 1
+
+def hedged(primary: FakeModel, fallback: FakeModel) -> HedgedChatModel:
+	return HedgedChatModel(primary=primary, fallback=fallback, primary_name="qwen3-vl:4b", fallback_name="qwen3-vl:2b", policy=HedgePolicy(burst=10))
+
+async def test_a_stalled_primary_is_hedged_on_the_fallback(monkeypatch):
+	monkeypatch.setattr("app.utils.hedging.HEDGE_DEFAULT_MS", 20)
+	primary = FakeModel(words=["slow"], delay=5)
+	fallback = FakeModel(words=["fast", " answer"])
+	model = hedged(primary, fallback)
+
+	result = await model.ainvoke([HumanMessage("hi")])
+
+	assert result.content == "fast answer"
+	assert model.policy.hedge_wins == 1
+	assert primary.closed == 1 and fallback.closed == 1
+
+async def test_an_empty_answer_is_an_empty_message():
+	primary = FakeModel(words=[])
+	fallback = FakeModel(words=["unused"])
+	model = hedged(primary, fallback)
+
+	result = await model.ainvoke([HumanMessage("hi")])
+
+	assert isinstance(result, AIMessage)
+	assert result.content == ""
+	assert model.policy.hedges == 0
+	assert primary.closed == 1
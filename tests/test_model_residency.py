@@ -0,0 +1,150 @@
+"""ModelResidencyManager against a fake Ollama server (/api/generate and /api/ps)"""
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from app.utils.model_residency import MAX_KEEP_ALIVE, MIN_KEEP_ALIVE, ModelResidencyManager
+
+class FakeClock:
+	def __init__(self):
+		self.now = 1000.0
+
+	def __call__(self) -> float:
+		return self.now
+
+class FakeOllama:
+	def __init__(self):
+		self.generate_requests: list[dict] = []
+		self.running: list[dict] = []
+		self.fail = False
+
+	async def generate(self, request: web.Request) -> web.Response:
+		if self.fail:
+			return web.json_response({"error": "model not found"}, status=404)
+		body = await request.json()
+		self.generate_requests.append(body)
+		return web.json_response({"model": body["model"], "response": "", "done": True})
+
+	async def ps(self, request: web.Request) -> web.Response:
+		if self.fail:
+			return web.Response(status=500, text="boom")
+		return web.json_response({"models": self.running})
+
+def expires_in(seconds: float) -> str:
+	# Ollama's format: local time with an offset and nanoseconds
+	expires = datetime.now(timezone(timedelta(hours=2))) + timedelta(seconds=seconds)
+	return expires.strftime("%Y-%m-%dT%H:%M:%S.%f") + "123+02:00"
+
+@pytest.fixture
+async def ollama():
+	fake = FakeOllama()
+	app = web.Application()
+	app.router.add_post("/api/generate", fake.generate)
+	app.router.add_get("/api/ps", fake.ps)
+	server = TestServer(app)
+	await server.start_server()
+	yield fake, str(server.make_url("")).rstrip("/")
+	await server.close()
+
+@pytest.fixture
+async def manager(ollama):
+	_, host = ollama
+	manager = ModelResidencyManager(host=host, poll_interval=3600, clock=FakeClock())
+	yield manager
+	await manager.stop()
+
+async def test_preload_sends_keep_alive_and_marks_the_model_warm(ollama, manager):
+	fake, _ = ollama
+	await manager.start([], preload=False)
+
+	await manager.preload("qwen3-vl:2b")
+
+	assert fake.generate_requests == [{"model": "qwen3-vl:2b", "keep_alive": MIN_KEEP_ALIVE}]
+	assert manager.is_warm("qwen3-vl:2b")
+	assert manager.preloads == 1
+
+async def test_failed_preload_leaves_the_model_cold(ollama, manager):
+	fake, _ = ollama
+	await manager.start([], preload=False)
+	fake.fail = True
+
+	await manager.preload("qwen3-vl:2b")
+
+	assert not manager.is_warm("qwen3-vl:2b")
+	assert manager.preloads == 0
+
+async def test_start_preloads_only_the_cold_models(ollama, manager):
+	fake, _ = ollama
+	fake.running = [{"name": "qwen3-vl:4b", "model": "qwen3-vl:4b", "expires_at": expires_in(600)}]
+
+	await manager.start(["qwen3-vl:2b", "qwen3-vl:4b"])
+
+	assert [body["model"] for body in fake.generate_requests] == ["qwen3-vl:2b"]
+	assert manager.warm_models() == {"qwen3-vl:2b", "qwen3-vl:4b"}
+	assert manager.started
+
+async def test_poll_reads_the_running_models_and_their_expiry(ollama, manager):
+	fake, _ = ollama
+	clock = manager.clock
+	fake.running = [
+		{"name": "qwen3-vl:2b", "model": "qwen3-vl:2b", "expires_at": expires_in(600)},
+		{"name": "gemma3:1b", "model": "gemma3:1b", "expires_at": expires_in(-60)},
+		# keep_alive -1 (forever) has no usable expiry
+		{"name": "qwen3-vl:4b", "model": "qwen3-vl:4b", "expires_at": ""},
+	]
+	await manager.start([], preload=False)
+
+	assert manager.polls == 1
+	assert manager.resident["qwen3-vl:2b"] - clock() == pytest.approx(600, abs=5)
+	assert manager.is_warm("qwen3-vl:2b")
+	assert not manager.is_warm("gemma3:1b")
+	assert manager.is_warm("qwen3-vl:4b")
+
+	# Ollama unloaded everything
+	fake.running = []
+	await manager.poll()
+	assert manager.warm_models() == set()
+
+async def test_failed_poll_keeps_the_last_residency(ollama, manager):
+	fake, _ = ollama
+	fake.running = [{"name": "qwen3-vl:2b", "model": "qwen3-vl:2b", "expires_at": expires_in(600)}]
+	await manager.start([], preload=False)
+
+	fake.fail = True
+	await manager.poll()
+
+	assert manager.poll_failures == 1
+	assert manager.is_warm("qwen3-vl:2b")
+
+async def test_is_warm_until_the_keep_alive_runs_out(manager):
+	clock = manager.clock
+	manager.record_request("qwen3-vl:2b")
+	assert manager.is_warm("qwen3-vl:2b")
+
+	clock.now += MIN_KEEP_ALIVE + 1
+	assert not manager.is_warm("qwen3-vl:2b")
+
+def test_keep_alive_follows_the_traffic_of_the_model():
+	clock = FakeClock()
+	manager = ModelResidencyManager(clock=clock)
+	assert manager.keep_alive("qwen3-vl:2b") == MIN_KEEP_ALIVE
+
+	# A request every 10 minutes: twice the average gap
+	for _ in range(4):
+		manager.record_request("qwen3-vl:2b")
+		clock.now += 600
+	assert manager.keep_alive("qwen3-vl:2b") == 1200
+
+	# Busy models stay at the minimum, rare ones at the maximum
+	for _ in range(10):
+		manager.record_request("gemma3:1b")
+		clock.now += 5
+	assert manager.keep_alive("gemma3:1b") == MIN_KEEP_ALIVE
+
+	manager.record_request("qwen3-vl:4b")
+	clock.now += 3000
+	manager.record_request("qwen3-vl:4b")
+	assert manager.keep_alive("qwen3-vl:4b") == MAX_KEEP_ALIVE
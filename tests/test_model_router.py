@@ -0,0 +1,74 @@
+"""ModelRouter decisions for the node picked by the classifier / LLM router, with the residency of the models"""
+
+from typing import Any, cast
+
+import numpy as np
+import pytest
+
+from app.graph.state import QueryAnalysis
+from app.utils.embedding_service import EmbeddingService
+from app.utils.model_residency import ModelResidencyManager
+from app.utils.model_router import ModelRouter
+
+class FakeClock:
+	def __init__(self):
+		self.now = 1000.0
+
+	def __call__(self) -> float:
+		return self.now
+
+class Preferences:
+	def __init__(self, preferred_model: str):
+		self.preferred_model = preferred_model
+
+def query(general: float, coding: float, data: float) -> np.ndarray:
+	return np.array([general, coding, data], dtype=np.float32)
+
+@pytest.fixture
+def residency() -> ModelResidencyManager:
+	return ModelResidencyManager(clock=FakeClock())
+
+@pytest.fixture
+def router(residency) -> ModelRouter:
+	router = ModelRouter(EmbeddingService(lambda texts: np.zeros((len(texts), 3)), name="fake"), cache_dir=None, residency=residency)
+	# Every example is the unit vector of its intent (GENERAL_CONVERSATION, CODING_ASSISTANCE, DATA_ANALYSIS),
+	# so the intent scores of a query are its (normalized) coordinates
+	router.intent_matrix = np.eye(3, dtype=np.float32)[router.intent_index]
+	return router
+
+def analysis(**overrides: Any) -> QueryAnalysis:
+	return cast(QueryAnalysis, {"complexity": "simple", "needs_vision": False, "needs_video_analysis": False, **overrides})
+
+def test_keeps_the_routed_node_when_no_loaded_model_is_as_close(router, residency):
+	residency.record_request("qwen3-vl:2b")
+
+	decision = router.route_node("complex_model", "llm router", query(0.2, 0.0, 1.0), None, None)
+
+	assert decision["primary_model"]["name"] == "qwen3-vl:4b"
+
+def test_a_cold_routed_node_gives_way_to_a_loaded_one_as_close(router, residency):
+	residency.record_request("qwen3-vl:2b")
+
+	decision = router.route_node("complex_model", "llm router", query(1.0, 0.0, 1.0), None, None)
+
+	assert decision["primary_model"]["name"] == "qwen3-vl:2b"
+	assert "its model is loaded" in decision["reasoning"]
+
+def test_a_loaded_routed_node_is_kept(router, residency):
+	residency.record_request("qwen3-vl:2b")
+	residency.record_request("qwen3-vl:4b")
+
+	decision = router.route_node("complex_model", "llm router", query(1.0, 0.0, 0.9), None, None)
+
+	assert decision["primary_model"]["name"] == "qwen3-vl:4b"
+
+def test_vision_and_pinned_models_win_over_the_routed_node(router, residency):
+	residency.record_request("qwen3-vl:4b")
+
+	decision = router.route_node("coding_model", "llm router", query(0.0, 1.0, 0.0), analysis(needs_vision=True), None)
+	assert decision["primary_model"]["name"] == "qwen3-vl:4b"
+	assert decision["vision_model"] is not None
+
+	decision = router.route_node("complex_model", "llm router", query(1.0, 0.0, 1.0), None, Preferences("qwen2.5-coder:0.5b"))
+	assert decision["primary_model"]["name"] == "qwen2.5-coder:0.5b"
+	assert router.pinned_node(Preferences("qwen2.5-coder:0.5b")) == "coding_model"
@@ -0,0 +1,171 @@
+"""ChatOpenAICompatible and its pooled client against a local stub of an OpenAI compatible server"""
+
+import asyncio
+import json
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from langchain_core.messages import HumanMessage
+from pydantic import BaseModel
+
+from app.utils.providers import ChatOpenAICompatible, OpenAICompatibleClient, OpenAICompatibleError, close_clients
+
+class Route(BaseModel):
+	node: str
+
+def sse(payload) -> bytes:
+	return f"data: {json.dumps(payload)}\n\n".encode()
+
+def event(delta: dict, finish_reason=None) -> dict:
+	return {"id": "cmpl-1", "model": "qwen3-vl:4b", "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+
+class StubServer:
+	"""/v1/chat/completions streaming the next scripted response (a list of raw SSE bytes, or a status and body)"""
+
+	def __init__(self):
+		self.bodies: list[dict] = []
+		self.peers: list[tuple] = []
+		self.responses: list = []
+
+	async def chat(self, request: web.Request) -> web.StreamResponse:
+		self.bodies.append(await request.json())
+		self.peers.append(request.transport.get_extra_info("peername")) # type: ignore[union-attr]
+
+		script = self.responses.pop(0) if self.responses else text_stream(["Hello", " world"])
+		if isinstance(script, tuple):
+			status, body = script
+			return web.Response(status=status, text=body)
+
+		resp = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+		await resp.prepare(request)
+		for part in script:
+			await resp.write(part)
+		await resp.write_eof()
+		return resp
+
+def text_stream(words: list[str]) -> list[bytes]:
+	return [
+		sse(event({"role": "assistant", "content": ""})),
+		*(sse(event({"content": word})) for word in words),
+		sse(event({}, "stop")),
+		sse({"id": "cmpl-1", "model": "qwen3-vl:4b", "choices": [], "usage": {"prompt_tokens": 3, "completion_tokens": len(words), "total_tokens": 3 + len(words)}}),
+		b"data: [DONE]\n\n",
+	]
+
+@pytest.fixture
+async def stub():
+	stub = StubServer()
+	app = web.Application()
+	app.router.add_post("/v1/chat/completions", stub.chat)
+	server = TestServer(app)
+	await server.start_server()
+	yield stub, str(server.make_url("/v1"))
+	await close_clients()
+	await server.close()
+
+async def test_streams_text_and_usage(stub):
+	server, base_url = stub
+	model = ChatOpenAICompatible(model="qwen3-vl:4b", base_url=base_url, temperature=0)
+
+	merged = None
+	async for chunk in model.astream([HumanMessage("hi")]):
+		merged = chunk if merged is None else merged + chunk
+
+	assert merged is not None
+	assert merged.content == "Hello world"
+	assert merged.usage_metadata == {"input_tokens": 3, "output_tokens": 2, "total_tokens": 5}
+	assert merged.response_metadata["finish_reason"] == "stop"
+
+	body = server.bodies[0]
+	assert body["stream"] is True
+	assert body["temperature"] == 0
+	assert body["messages"] == [{"role": "user", "content": "hi"}]
+
+async def test_sse_comments_multiline_data_and_a_missing_done(stub):
+	server, base_url = stub
+	server.responses.append([
+		b": keep-alive\n\n",
+		# One event split over two data lines, and CRLF line endings
+		b'data: {"id": "cmpl-1", "choices": [{"index": 0,\r\ndata: "delta": {"content": "split"}, "finish_reason": null}]}\r\n\r\n',
+		b"\n",
+		# The last event is not followed by a blank line or [DONE]
+		b'data: {"id": "cmpl-1", "choices": [{"index": 0, "delta": {"content": " end"}, "finish_reason": "stop"}]}',
+	])
+	client = OpenAICompatibleClient(base_url)
+
+	events = [event async for event in client.stream_chat({"model": "qwen3-vl:4b", "messages": []})]
+	await client.close()
+
+	assert [e["choices"][0]["delta"]["content"] for e in events] == ["split", " end"]
+
+async def test_tool_calls_and_structured_output(stub):
+	server, base_url = stub
+	server.responses.append([
+		sse(event({"role": "assistant", "content": ""})),
+		sse(event({"tool_calls": [{"index": 0, "id": "call_1", "type": "function", "function": {"name": "Route", "arguments": "{\"node\": "}}]})),
+		sse(event({"tool_calls": [{"index": 0, "function": {"arguments": "\"fast_model\"}"}}]})),
+		sse(event({}, "tool_calls")),
+		b"data: [DONE]\n\n",
+	])
+	model = ChatOpenAICompatible(model="qwen3-vl:4b", base_url=base_url)
+
+	route = await model.with_structured_output(Route).ainvoke([HumanMessage("route me")])
+
+	assert route == Route(node="fast_model")
+	body = server.bodies[0]
+	assert body["tool_choice"] == "required"
+	assert body["tools"][0]["function"]["name"] == "Route"
+
+async def test_provider_specific_kwargs_are_not_sent(stub):
+	server, base_url = stub
+	model = ChatOpenAICompatible(model="qwen3-vl:4b", base_url=base_url)
+
+	await model.bind(keep_alive=600, max_tokens=64).ainvoke([HumanMessage("hi")])
+
+	body = server.bodies[0]
+	assert "keep_alive" not in body
+	assert body["max_tokens"] == 64
+
+async def test_requests_reuse_the_pooled_connection(stub):
+	server, base_url = stub
+	model = ChatOpenAICompatible(model="qwen3-vl:4b", base_url=base_url)
+
+	for _ in range(5):
+		await model.ainvoke([HumanMessage("hi")])
+
+	assert len(server.peers) == 5
+	assert len(set(server.peers)) == 1
+
+async def test_http_errors_raise_with_the_status(stub):
+	server, base_url = stub
+	server.responses.append((503, "model is loading"))
+	model = ChatOpenAICompatible(model="qwen3-vl:4b", base_url=base_url)
+
+	with pytest.raises(OpenAICompatibleError) as error:
+		await model.ainvoke([HumanMessage("hi")])
+
+	assert error.value.status == 503
+	assert "model is loading" in str(error.value)
+
+async def test_an_empty_stream_is_an_error(stub):
+	server, base_url = stub
+	server.responses.append([b"data: [DONE]\n\n"])
+	model = ChatOpenAICompatible(model="qwen3-vl:4b", base_url=base_url)
+
+	with pytest.raises(OpenAICompatibleError):
+		await model.ainvoke([HumanMessage("hi")])
+
+async def test_sync_invoke_works_with_and_without_a_running_loop(stub):
+	_, base_url = stub
+	model = ChatOpenAICompatible(model="qwen3-vl:4b", base_url=base_url)
+
+	async def invoke_in_a_loop():
+		# A sync call from a coroutine, asyncio.run would raise here
+		return model.invoke([HumanMessage("hi")])
+
+	# Both on other threads, the stub server runs on this loop
+	result = await asyncio.to_thread(model.invoke, [HumanMessage("hi")])
+	assert result.content == "Hello world"
+	result = await asyncio.to_thread(asyncio.run, invoke_in_a_loop())
+	assert result.content == "Hello world"